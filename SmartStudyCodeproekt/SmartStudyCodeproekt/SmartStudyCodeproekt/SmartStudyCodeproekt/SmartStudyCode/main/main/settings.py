@@ -141,4 +141,59 @@ OPENROUTER_API_KEY = "sk-or-v1-c37a9111459696a100d396d50302b177b04543d8ebec83473
 OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
 OPENROUTER_MODEL = "openai/gpt-4o-mini" 
 OPENROUTER_SITE_URL = "http://127.0.0.1:8000"
-OPENROUTER_APP_TITLE = "SmartCodeStudy"
\ No newline at end of file
+OPENROUTER_APP_TITLE = "SmartCodeStudy"
+
+# Адаптивные тесты: "streak" (по умолчанию) или "irt" (нужен numpy)
+ADAPTIVE_ENGINE = "streak"
+IRT_MODEL = "2pl"
+IRT_MIN_ITEMS = 5
+IRT_MAX_ITEMS = 10
+IRT_SE_TARGET = 0.5
+# выбор случайного из K самых информативных вопросов — контроль экспозиции; 1 — чистый максимум
+IRT_RANDOMESQUE_K = 5
+
+# Время на адаптивный тест и запас для ответа teacher-теста, пришедшего впритык к дедлайну
+# (webapp/views.py, webapp/attempt_finalizer.py).
+ADAPTIVE_TIME_LIMIT_SEC = 10 * 60
+ANSWER_GRACE_SEC = 5
+
+# Вопросы teacher-теста в cache (webapp/teacher_test_payload.py) — только для показа:
+# правильность ответа при проверке берётся из Answers. С локальным cache у каждого
+# процесса своя копия, и после правки теста другие процессы до TTL показывают старый
+# текст; для нескольких воркеров CACHES лучше направить на общий backend (Redis).
+# TTL — нижняя граница: у назначенного теста запись живёт до конца экзамена.
+TEST_PAYLOAD_TTL_SEC = 12 * 60 * 60
+
+# Карточки и первая страница истории teacher_statistics (webapp/stats_cache.py).
+# Сбрасываются событиями; TTL — страховка.
+TEACHER_STATS_CACHE_TTL_SEC = 10 * 60
+
+# Выгрузки teacher/statistics/export/ (webapp/exports.py): строк на один fetch серверного курсора.
+EXPORT_CHUNK_SIZE = 2000
+
+# Анализ заданий теста (webapp/item_analysis.py); сбрасывается закрытием попытки и правкой вопросов.
+ITEM_ANALYSIS_CACHE_TTL_SEC = 24 * 60 * 60
+
+# Очередь отчётов AIStatHelper (webapp/ai_jobs.py, manage.py run_ai_report_worker).
+# CONCURRENCY — задач в работе одновременно на все воркеры; QUOTA — анализов на студента за сутки.
+# TIMEOUT — после него задача считается брошенной и возвращается в очередь: с запасом больше
+# OPENROUTER_READ_TIMEOUT_SEC * (OPENROUTER_MAX_RETRIES + 1) плюс паузы между повторами.
+AI_REPORT_CONCURRENCY = 4
+AI_REPORT_DAILY_QUOTA = 10
+AI_REPORT_JOB_TIMEOUT_SEC = 300
+AI_REPORT_JOB_MAX_TRIES = 2
+
+# Общие отчёты AIStatHelper по обезличенному профилю (webapp/report_cache.py).
+# TTL продлевается при каждом попадании; при переполнении CACHES вытесняет по LRU.
+AI_REPORT_CACHE_TTL_SEC = 7 * 24 * 60 * 60
+
+# Клиент OpenRouter (webapp/llm_client.py): один на процесс. READ_TIMEOUT * (MAX_RETRIES + 1)
+# должен укладываться в AI_REPORT_JOB_TIMEOUT_SEC. Breaker: THRESHOLD неудач за WINDOW —
+# COOLDOWN секунд запросы не отправляются, затем одна проба.
+OPENROUTER_CONNECT_TIMEOUT_SEC = 5
+OPENROUTER_READ_TIMEOUT_SEC = 30
+OPENROUTER_MAX_RETRIES = 2
+OPENROUTER_RETRY_BACKOFF_SEC = 0.5
+OPENROUTER_BREAKER_THRESHOLD = 5
+OPENROUTER_BREAKER_WINDOW_SEC = 60
+OPENROUTER_BREAKER_COOLDOWN_SEC = 30
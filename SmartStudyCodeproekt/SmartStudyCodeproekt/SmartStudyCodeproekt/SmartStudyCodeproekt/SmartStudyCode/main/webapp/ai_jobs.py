@@ -0,0 +1,262 @@
+# webapp/ai_jobs.py
+from __future__ import annotations
+
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Iterator
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .ai_stat_helper import generate_ai_stat_report, stream_ai_stat_report
+from .llm_client import CircuitOpenError
+from .models import AIReportJob, AIStatHelperReport, Users
+
+# Отчёты AIStatHelper генерируются не в запросе, а воркером (manage.py run_ai_report_worker):
+# «Анализ» кладёт строку в ai_report_jobs, страница опрашивает статус.
+# - у студента одна активная задача (уникальный частичный индекс) и не больше AI_REPORT_DAILY_QUOTA за сутки;
+# - одновременно в работе не больше AI_REPORT_CONCURRENCY задач на все воркеры;
+# - задача, зависшая дольше AI_REPORT_JOB_TIMEOUT_SEC (воркер упал), возвращается в очередь;
+#   результат пишет только тот, кто задачу взял (worker + tries), поэтому «зависший» воркер,
+#   доделавший её после возврата, ничего не перезапишет.
+
+ACTIVE = (AIReportJob.QUEUED, AIReportJob.RUNNING)
+
+# задача отложена для SSE (student_ai_stat_helper_start), браузер ещё не подключился к потоку
+SSE_RESERVED = "sse"
+# если так и не подключился — задачу доделает воркер
+_SSE_ATTACH_TIMEOUT = timedelta(seconds=30)
+
+# ключ pg_advisory_xact_lock: выборка задач и подсчёт занятых слотов — по одному воркеру за раз
+_CLAIM_LOCK_KEY = 0x5CA1AB1E
+
+
+class AIReportQuotaExceeded(Exception):
+    pass
+
+
+def _concurrency() -> int:
+    return int(getattr(settings, "AI_REPORT_CONCURRENCY", 4))
+
+
+def _quota() -> int:
+    return int(getattr(settings, "AI_REPORT_DAILY_QUOTA", 10))
+
+
+def _timeout() -> timedelta:
+    return timedelta(seconds=int(getattr(settings, "AI_REPORT_JOB_TIMEOUT_SEC", 300)))
+
+
+def _max_tries() -> int:
+    return int(getattr(settings, "AI_REPORT_JOB_MAX_TRIES", 2))
+
+
+def enqueue_report_job(student: Users, *, snapshot: dict, snapshot_hash: str, watermark: str) -> AIReportJob:
+    """Новая задача или уже активная задача студента; сверх квоты — AIReportQuotaExceeded."""
+    active = AIReportJob.objects.filter(student=student, status__in=ACTIVE).first()
+    if active is not None:
+        return active
+
+    used = (
+        AIReportJob.objects
+        .filter(student=student, created_at__gte=timezone.now() - timedelta(days=1))
+        .exclude(status=AIReportJob.FAILED)
+        .count()
+    )
+    if used >= _quota():
+        raise AIReportQuotaExceeded(f"Daily limit of {_quota()} analyses reached, try again tomorrow")
+
+    try:
+        with transaction.atomic():
+            return AIReportJob.objects.create(
+                student=student, snapshot_hash=snapshot_hash, watermark=watermark, snapshot_json=snapshot,
+            )
+    except IntegrityError:
+        # параллельный запрос того же студента успел первым
+        return AIReportJob.objects.filter(student=student).order_by("-created_at", "-id").first()
+
+
+def latest_job(student: Users) -> AIReportJob | None:
+    return AIReportJob.objects.filter(student=student).order_by("-created_at", "-id").first()
+
+
+def requeue_stale(now: datetime | None = None) -> int:
+    now = now or timezone.now()
+    stale = AIReportJob.objects.filter(status=AIReportJob.RUNNING).filter(
+        Q(started_at__lt=now - _timeout()) | Q(worker=SSE_RESERVED, started_at__lt=now - _SSE_ATTACH_TIMEOUT)
+    )
+    failed = stale.filter(tries__gte=_max_tries()).update(
+        status=AIReportJob.FAILED, error="Timed out", finished_at=now,
+    )
+    requeued = stale.filter(tries__lt=_max_tries()).update(status=AIReportJob.QUEUED, worker="")
+    return failed + requeued
+
+
+def _claim_lock() -> None:
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [_CLAIM_LOCK_KEY])
+
+
+def claim_jobs(worker: str, *, limit: int, now: datetime | None = None) -> list[int]:
+    """Переводит до limit задач в running, не превышая общий лимит; возвращает их id."""
+    now = now or timezone.now()
+    requeue_stale(now)
+    with transaction.atomic():
+        _claim_lock()
+        slots = min(limit, _concurrency() - AIReportJob.objects.filter(status=AIReportJob.RUNNING).count())
+        if slots <= 0:
+            return []
+        ids = list(
+            AIReportJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=AIReportJob.QUEUED)
+            .order_by("created_at", "id")
+            .values_list("id", flat=True)[:slots]
+        )
+        AIReportJob.objects.filter(id__in=ids).update(
+            status=AIReportJob.RUNNING, worker=worker, started_at=now, tries=F("tries") + 1,
+        )
+    return ids
+
+
+def _owned(job: AIReportJob):
+    # задача всё ещё у того, кто её взял: requeue_stale и повторный claim меняют worker/tries
+    return AIReportJob.objects.filter(id=job.id, status=AIReportJob.RUNNING, worker=job.worker, tries=job.tries)
+
+
+def _fail_job(job: AIReportJob, e: Exception) -> str:
+    # при открытом breaker повтор бесполезен — студент видит последний отчёт
+    retry = job.tries < _max_tries() and not isinstance(e, CircuitOpenError)
+    status = AIReportJob.QUEUED if retry else AIReportJob.FAILED
+    _owned(job).update(
+        status=status, error=str(e)[:2000], worker="", finished_at=None if retry else timezone.now(),
+    )
+    return status
+
+
+def complete_job(job: AIReportJob, report_dict: dict, report_text: str) -> AIStatHelperReport | None:
+    """Сохраняет отчёт; None — задачу уже забрали (requeue_stale), результат запишет новый владелец."""
+    with transaction.atomic():
+        if not _owned(job).select_for_update().exists():
+            return None
+        report, _ = AIStatHelperReport.objects.update_or_create(
+            student=job.student,
+            snapshot_hash=job.snapshot_hash,
+            defaults={
+                "report_json": report_dict or {},
+                "report_text": report_text or "",
+                "watermark": job.watermark,
+                "snapshot_json": job.snapshot_json,
+                "created_at": timezone.now(),
+            },
+        )
+        _owned(job).update(status=AIReportJob.DONE, report=report, error="", finished_at=timezone.now())
+    return report
+
+
+def run_job(job_id: int) -> str:
+    """Генерация вне транзакции (запрос к LLM долгий), запись результата — короткой транзакцией."""
+    job = AIReportJob.objects.select_related("student").get(id=job_id)
+    if job.status != AIReportJob.RUNNING:
+        return job.status
+
+    try:
+        report_dict, report_text = generate_ai_stat_report(student=job.student, snapshot=job.snapshot_json)
+    except Exception as e:
+        return _fail_job(job, e)
+
+    if complete_job(job, report_dict, report_text) is None:
+        return "superseded"
+    return AIReportJob.DONE
+
+
+def stream_job(job: AIReportJob) -> Iterator[tuple[str, Any]]:
+    """
+    Генерация задачи прямо в запросе (SSE, см. student_ai_stat_helper_stream): события
+    stream_ai_stat_report, в конце отчёт сохраняется как у воркера. Если браузер закрыл
+    поток раньше, задача возвращается в очередь — отчёт доделает воркер.
+    """
+    finished = False
+    try:
+        for event, data in stream_ai_stat_report(student=job.student, snapshot=job.snapshot_json):
+            if event == "done":
+                complete_job(job, *data)
+                finished = True
+            yield event, data
+    except Exception as e:
+        finished = True
+        _fail_job(job, e)
+        yield "error", str(e)
+    finally:
+        if not finished:
+            _owned(job).update(status=AIReportJob.QUEUED, worker="")
+
+
+def start_stream_job(student: Users, *, snapshot: dict, snapshot_hash: str, watermark: str) -> AIReportJob | None:
+    """
+    Задача для генерации в запросе (POST): те же дедупликация, квота и общий лимит, что у очереди;
+    задача откладывается для SSE, воркеры её не берут. None — у студента уже идёт генерация
+    (воркером или другой вкладкой) или все слоты заняты; тогда страница просто ждёт статус задачи.
+    """
+    job = enqueue_report_job(student, snapshot=snapshot, snapshot_hash=snapshot_hash, watermark=watermark)
+    with transaction.atomic():
+        # слоты считаются под тем же локом, что в claim_jobs
+        _claim_lock()
+        if AIReportJob.objects.filter(status=AIReportJob.RUNNING).count() >= _concurrency():
+            # задача остаётся в очереди — её возьмёт воркер, когда слот освободится
+            return None
+        reserved = AIReportJob.objects.filter(id=job.id, status=AIReportJob.QUEUED).update(
+            status=AIReportJob.RUNNING, worker=SSE_RESERVED, started_at=timezone.now(),
+        )
+    return job if reserved else None
+
+
+def attach_stream_job(student: Users, job_id: int) -> AIReportJob | None:
+    """
+    SSE-поток берёт отложенную задачу студента: ровно один раз, повторный GET (перезагрузка,
+    вторая вкладка) получит None. Владелец — уникальная метка потока.
+    """
+    claimed = AIReportJob.objects.filter(
+        id=job_id, student=student, status=AIReportJob.RUNNING, worker=SSE_RESERVED,
+    ).update(worker=f"{SSE_RESERVED}:{uuid.uuid4().hex[:12]}", started_at=timezone.now(), tries=F("tries") + 1)
+    if not claimed:
+        return None
+    return AIReportJob.objects.select_related("student").get(id=job_id)
+
+
+def _run_in_thread(job_id: int) -> str:
+    try:
+        return run_job(job_id)
+    finally:
+        connection.close()
+
+
+def run_worker(worker: str, *, threads: int, interval: float, once: bool = False, log=None) -> int:
+    """
+    Цикл воркера: берёт задачи, пока есть свободные потоки и общий лимит позволяет.
+    once — выйти, когда очередь пуста и всё запущенное доделано. Возвращает число обработанных задач.
+    """
+    processed = 0
+    running: set[Future] = set()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        while True:
+            for f in [f for f in running if f.done()]:
+                running.discard(f)
+                processed += 1
+                # ошибка БД в потоке не должна останавливать воркер: задачу вернёт requeue_stale
+                result = f.exception() or f.result()
+                if log:
+                    log(f"job finished: {result}")
+
+            ids = claim_jobs(worker, limit=threads - len(running)) if len(running) < threads else []
+            for job_id in ids:
+                running.add(pool.submit(_run_in_thread, job_id))
+
+            if once and not running and not ids:
+                return processed
+            time.sleep(0.2 if ids or running else interval)
@@ -3,58 +3,76 @@ from __future__ import annotations
 import hashlib
 import json
 import re
-from typing import Any
+from typing import Any, Iterator
 
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Count, Max, Q
 from django.utils import timezone
 
-from openai import OpenAI
-
 from .models import (
     AdaptiveAttempt,
     AdaptiveAttemptAnswer,
+    AIStatHelperReport,
+    SkillTaggingRun,
     Testattempts,
     Useranswers,
     Users,
 )
+from .llm_client import chat_completion
+from .report_cache import cached_report, get_shared_report, report_profile, store_report
+from .skills import OTHER_SKILL
 
 # --- Настройка: какие basic-коды считать Python ---
 PYTHON_BASIC_CODES = {"python-basics", "files-exceptions-functions"}
 
-# --- Классификация вопроса -> тема (простая эвристика по ключевым словам) ---
-_SKILL_RULES: list[tuple[str, list[str]]] = [
-    ("Переменные и типы данных", ["variable", "переменн", "type", "тип", "int", "float", "str", "bool", "cast", "преобраз"]),
-    ("Операторы и выражения", ["оператор", "operator", "арифмет", "+", "-", "*", "/", "//", "%", "**", "and", "or", "not"]),
-    ("Условия if/elif/else", ["if", "elif", "else", "услови", "condition", "сравнен", "==", "!=", ">=", "<="]),
-    ("Циклы for/while", ["for", "while", "loop", "цикл", "range", "итерац"]),
-    ("Строки", ["string", "строк", "split", "join", "replace", "strip", "format", "f-string", "find"]),
-    ("Списки и индексация", ["list", "спис", "index", "индекс", "append", "pop", "slice", "срез"]),
-    ("Словари и множества", ["dict", "словар", "set", "множ", "key", "value", "items", "get("]),
-    ("Функции", ["def ", "return", "function", "функц", "аргумент", "параметр"]),
-    ("Исключения", ["try", "except", "finally", "raise", "ошибк", "exception"]),
-    ("Файлы", ["open(", "file", "файл", "read(", "write(", "with open"]),
-    ("Ввод/вывод", ["print", "input("]),
-]
-
-
-def _infer_skill(question_text: str | None) -> str:
-    text = (question_text or "").strip().lower()
-    if not text:
-        return "Другое"
-    text = re.sub(r"\s+", " ", text)
-    for skill, keys in _SKILL_RULES:
-        for k in keys:
-            if k in text:
-                return skill
-    return "Другое"
+# Навык вопроса размечается при записи (webapp/skills.py); здесь — только GROUP BY по нему.
+
+
+# поля снимка, которые не относятся к содержимому и не должны менять hash
+_VOLATILE_STATS = ("generated_at",)
+
+# поднять, если меняется состав снимка — сохранённые watermark перестанут совпадать
+SNAPSHOT_VERSION = 2
 
 
 def snapshot_hash(snapshot: dict) -> str:
-    raw = json.dumps(snapshot, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    """Hash только по содержимому: тот же набор ответов — тот же hash в любую минуту."""
+    stats = {k: v for k, v in (snapshot.get("stats") or {}).items() if k not in _VOLATILE_STATS}
+    raw = json.dumps({**snapshot, "stats": stats}, ensure_ascii=False, sort_keys=True).encode("utf-8")
     return hashlib.sha256(raw).hexdigest()
 
 
+def snapshot_watermark(student: Users) -> str:
+    """
+    Дешёвая отметка «что-то изменилось»: число, последний id и время завершённых попыток обоих видов
+    и последний прогон разметки навыков (tag_question_skills). Три запроса по индексам вместо выгрузки ответов.
+    """
+    tagging = SkillTaggingRun.objects.order_by("-id").values_list("id", flat=True).first()
+    parts = [f"v{SNAPSHOT_VERSION}", f"s{tagging or 0}"]
+    for qs in (
+        Testattempts.objects.filter(user=student, finished_at__isnull=False),
+        AdaptiveAttempt.objects.filter(user=student, finished_at__isnull=False),
+    ):
+        agg = qs.aggregate(n=Count("id"), last_id=Max("id"), last_at=Max("finished_at"))
+        last_at = agg["last_at"].isoformat() if agg["last_at"] else "-"
+        parts.append(f"{agg['n']}.{agg['last_id'] or 0}.{last_at}")
+    return ":".join(parts)
+
+
+def current_snapshot(student: Users, latest: AIStatHelperReport | None) -> tuple[dict, str, str]:
+    """
+    (snapshot, hash, watermark). Если watermark совпадает с сохранённым в последнем отчёте —
+    снимок берётся из отчёта без агрегатов по ответам. Ничего не пишет: новый watermark
+    сохраняет готовый отчёт (complete_job), GET страницы остаётся только чтением.
+    """
+    watermark = snapshot_watermark(student)
+    if latest is not None and latest.watermark == watermark and latest.snapshot_json:
+        return latest.snapshot_json, latest.snapshot_hash, watermark
+
+    snapshot = build_ai_stat_snapshot(student)
+    return snapshot, snapshot_hash(snapshot), watermark
+
+
 def build_ai_stat_snapshot(student: Users) -> dict:
     """
     Возвращает ТОЛЬКО JSON-совместимый dict.
@@ -82,31 +100,25 @@ def build_ai_stat_snapshot(student: Users) -> dict:
     total_by_skill: dict[str, int] = {}
     wrong_by_skill: dict[str, int] = {}
 
-    # Teacher: Useranswers
-    uas = (
+    # по запросу на таблицу ответов: (навык, is_correct) -> число; без неразмеченных — «Другое»
+    grouped = (
         Useranswers.objects
         .filter(attempt__in=teacher_attempts)
-        .select_related("question")
-        .only("is_correct", "question__question_text")
-    )
-    for ua in uas:
-        skill = _infer_skill(getattr(ua.question, "question_text", ""))
-        total_by_skill[skill] = total_by_skill.get(skill, 0) + 1
-        if not bool(getattr(ua, "is_correct", False)):
-            wrong_by_skill[skill] = wrong_by_skill.get(skill, 0) + 1
-
-    # Basic: AdaptiveAttemptAnswer
-    bas = (
+        .values_list("question__skill_tag__skill", "is_correct")
+        .annotate(n=Count("id"))
+        .order_by(),
         AdaptiveAttemptAnswer.objects
         .filter(attempt__in=basic_attempts)
-        .select_related("question")
-        .only("is_correct", "question__text")
+        .values_list("question__skill", "is_correct")
+        .annotate(n=Count("id"))
+        .order_by(),
     )
-    for a in bas:
-        skill = _infer_skill(getattr(a.question, "text", ""))
-        total_by_skill[skill] = total_by_skill.get(skill, 0) + 1
-        if not bool(getattr(a, "is_correct", False)):
-            wrong_by_skill[skill] = wrong_by_skill.get(skill, 0) + 1
+    for rows in grouped:
+        for skill, is_correct, n in rows:
+            skill = skill or OTHER_SKILL
+            total_by_skill[skill] = total_by_skill.get(skill, 0) + n
+            if not is_correct:
+                wrong_by_skill[skill] = wrong_by_skill.get(skill, 0) + n
 
     ranked = sorted(
         total_by_skill.keys(),
@@ -138,27 +150,11 @@ def build_ai_stat_snapshot(student: Users) -> dict:
     }
 
 
-# -------- OpenRouter client (КЛЮЧ ИЗ settings.py) --------
-
-OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
-
-
-def _get_openrouter_client() -> OpenAI:
-    key = (getattr(settings, "OPENROUTER_API_KEY", "") or "").strip()
-    if not key:
-        raise RuntimeError("OPENROUTER_API_KEY is empty in settings.py")
-
-    site_url = (getattr(settings, "OPENROUTER_SITE_URL", "") or "http://127.0.0.1:8000").strip()
-    app_title = (getattr(settings, "OPENROUTER_APP_TITLE", "") or "SmartCodeStudy").strip()
-
-    return OpenAI(
-        api_key=key,
-        base_url=OPENROUTER_BASE_URL,
-        default_headers={
-            "HTTP-Referer": site_url,
-            "X-Title": app_title,
-        },
-    )
+_FALLBACK_REPORT = {
+    "summary": "Не удалось корректно сформировать отчёт. Нажми «Обновить» и попробуй ещё раз.",
+    "weak_topics": [],
+    "priority_plan": [],
+}
 
 
 def _extract_json_object(text: str) -> dict:
@@ -183,11 +179,7 @@ def _extract_json_object(text: str) -> dict:
             pass
 
     # 3) fallback
-    return {
-        "summary": "Не удалось корректно сформировать отчёт. Нажми «Обновить» и попробуй ещё раз.",
-        "weak_topics": [],
-        "priority_plan": [],
-    }
+    return _FALLBACK_REPORT
 
 
 def _normalize_report(d: dict) -> dict:
@@ -234,15 +226,7 @@ def _normalize_report(d: dict) -> dict:
     }
 
 
-def generate_ai_stat_report(*, student: Users, snapshot: dict) -> tuple[dict, str]:
-    """
-    Возвращает (report_dict, report_text).
-    report_dict — для красивого отображения в шаблоне.
-    report_text — плоская версия (можно хранить в БД).
-    """
-    client = _get_openrouter_client()
-    model = (getattr(settings, "OPENROUTER_MODEL", "") or "openai/gpt-4o-mini").strip()
-
+def _llm_messages(profile: dict) -> list[dict]:
     system = (
         "Ты — AIStatHelper, помощник по обучению Python.\n"
         "Ты анализируешь ТОЛЬКО агрегированные данные и объясняешь, какие темы Python проседают.\n\n"
@@ -268,25 +252,52 @@ def generate_ai_stat_report(*, student: Users, snapshot: dict) -> tuple[dict, st
     )
 
     user_payload = {
-        "student_name": getattr(student, "username", "—"),
-        "stats": snapshot.get("stats", {}),
-        "weak_skills": snapshot.get("weak_skills", []),
-        "note": "Это агрегаты по Python. Нельзя раскрывать конкретные вопросы/формулировки. Только темы.",
+        "stats": {
+            "teacher_python_attempts": profile["teacher_python_attempts"],
+            "basic_python_attempts": profile["basic_python_attempts"],
+        },
+        "weak_skills": profile["weak_skills"],
+        "note": (
+            "Это агрегаты по Python. Числа округлены вниз до границы интервала. "
+            "Нельзя раскрывать конкретные вопросы/формулировки. Только темы. Не обращайся к студенту по имени."
+        ),
     }
 
-    resp = client.chat.completions.create(
-        model=model,
-        temperature=0.4,
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
-        ],
-    )
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
+    ]
+
+
+def _parse_report(content: str) -> dict | None:
+    """Ответ модели -> нормализованный отчёт; None — JSON не разобран (такой отчёт не кэшируется)."""
+    report_raw = _extract_json_object((content or "").strip())
+    if report_raw is _FALLBACK_REPORT:
+        return None
+    return _normalize_report(report_raw)
+
+
+def _ask_llm(profile: dict, model: str) -> dict | None:
+    """Один запрос к LLM по обезличенному профилю."""
+    resp = chat_completion(model=model, temperature=0.4, messages=_llm_messages(profile))
+    return _parse_report(resp.choices[0].message.content or "")
+
+
+def _greeting(student: Users) -> str:
+    name = getattr(student, "username", "") or ""
+    return f"{name}, вот разбор твоих результатов по Python.\n\n" if name else ""
 
-    content = (resp.choices[0].message.content or "").strip()
-    report_raw = _extract_json_object(content)
-    report_dict = _normalize_report(report_raw)
 
+def _personalize(report: dict, student: Users) -> dict:
+    summary = f"{_greeting(student)}{report.get('summary', '')}".strip()
+    return {**report, "summary": summary}
+
+
+def _model() -> str:
+    return (getattr(settings, "OPENROUTER_MODEL", "") or "openai/gpt-4o-mini").strip()
+
+
+def _report_text(report_dict: dict) -> str:
     # плоский текст (чтобы красиво читалось и в БД, и в логах)
     parts: list[str] = []
     if report_dict.get("summary"):
@@ -304,5 +315,117 @@ def generate_ai_stat_report(*, student: Users, snapshot: dict) -> tuple[dict, st
     if report_dict.get("priority_plan"):
         parts.append("\n\nПлан:\n- " + "\n- ".join(report_dict["priority_plan"]))
 
-    report_text = "\n".join([p for p in parts if p]).strip()
-    return report_dict, report_text
+    return "\n".join([p for p in parts if p]).strip()
+
+
+def generate_ai_stat_report(*, student: Users, snapshot: dict) -> tuple[dict, str]:
+    """
+    Возвращает (report_dict, report_text).
+    report_dict — для красивого отображения в шаблоне.
+    report_text — плоская версия (можно хранить в БД).
+    Отчёт общий для студентов с тем же профилем (webapp/report_cache.py), имя — после генерации.
+    """
+    model = _model()
+    profile = report_profile(snapshot)
+    shared = get_shared_report(profile, model, lambda: _ask_llm(profile, model))
+    report_dict = _personalize(shared or _normalize_report(_FALLBACK_REPORT), student)
+    return report_dict, _report_text(report_dict)
+
+
+_SUMMARY_START = re.compile(r'"summary"\s*:\s*"')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class _SummaryReader:
+    """
+    Строка "summary" из JSON, который приходит кусками: каждый символ разбирается один раз,
+    в буфере — только неразобранный хвост. Незавершённая escape-последовательность в конце
+    куска откладывается до следующего.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = ""
+        self._started = False
+        self.closed = False
+
+    def feed(self, delta: str) -> str:
+        """Новый текст summary из delta ("" — пока нечего показать; после closed всё игнорируется)."""
+        if self.closed:
+            return ""
+        self._buffer += delta
+        if not self._started:
+            m = _SUMMARY_START.search(self._buffer)
+            if not m:
+                # ключ мог прийти не целиком — храним только хвост, с которого он может начаться
+                cut = self._buffer.rfind('"summary"')
+                self._buffer = self._buffer[cut:] if cut >= 0 else self._buffer[-len('"summary'):]
+                return ""
+            self._started = True
+            self._buffer = self._buffer[m.end():]
+
+        buffer = self._buffer
+        out: list[str] = []
+        i = 0
+        while i < len(buffer):
+            ch = buffer[i]
+            if ch == '"':
+                self.closed = True
+                break
+            if ch != "\\":
+                out.append(ch)
+                i += 1
+                continue
+            if i + 1 >= len(buffer):
+                break
+            esc = buffer[i + 1]
+            if esc == "u":
+                code = buffer[i + 2:i + 6]
+                if len(code) < 4:
+                    break
+                try:
+                    out.append(chr(int(code, 16)))
+                except ValueError:
+                    pass
+                i += 6
+                continue
+            out.append(_ESCAPES.get(esc, esc))
+            i += 2
+        self._buffer = "" if self.closed else buffer[i:]
+        return "".join(out)
+
+
+def stream_ai_stat_report(*, student: Users, snapshot: dict) -> Iterator[tuple[str, Any]]:
+    """
+    То же, что generate_ai_stat_report, но по мере генерации:
+    ("summary", новый кусок текста summary)… затем ("done", (report_dict, report_text)).
+    Отчёт из общего cache приходит сразу целиком; после потока JSON собирается и проходит _normalize_report.
+    """
+    model = _model()
+    profile = report_profile(snapshot)
+    greeting = _greeting(student)
+    if greeting:
+        yield "summary", greeting
+
+    shared = cached_report(profile, model)
+    if shared is None:
+        stream = chat_completion(model=model, temperature=0.4, messages=_llm_messages(profile), stream=True)
+        content: list[str] = []
+        reader = _SummaryReader()
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            content.append(delta)
+            # после summary reader ничего не разбирает: темы и план покажет страница после "done"
+            text = reader.feed(delta)
+            if text:
+                yield "summary", text
+
+        shared = _parse_report("".join(content))
+        if shared is not None:
+            store_report(profile, model, shared)
+    else:
+        yield "summary", shared.get("summary", "")
+
+    report_dict = _personalize(shared or _normalize_report(_FALLBACK_REPORT), student)
+    yield "done", (report_dict, _report_text(report_dict))
@@ -0,0 +1,147 @@
+# webapp/ai_stub.py
+from __future__ import annotations
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Локальная замена OpenRouter для разработки и тестов: отвечает на POST .../chat/completions
+# в формате OpenAI готовым отчётом по weak_skills из запроса; умеет отвечать с задержкой и
+# ошибками, чтобы проверять таймауты, повторы и breaker (webapp/llm_client.py). Сеть и ключ не нужны:
+# OPENROUTER_BASE_URL = "http://127.0.0.1:8765/v1" и manage.py run_ai_stub_server.
+
+
+def stub_report(payload: dict) -> dict:
+    skills = [s.get("skill") for s in payload.get("weak_skills", []) if s.get("skill")] or ["Основы Python"]
+    return {
+        "summary": "Это тестовый отчёт локального stub-сервера.\n\nДанные не отправлялись во внешний сервис.",
+        "weak_topics": [
+            {
+                "topic": skill,
+                "why_weak": "Доля ошибок по теме выше средней.",
+                "explanation": "Повтори теорию по теме и разбери примеры.",
+                "mini_tasks": ["Реши 3 задачи по теме", "Объясни тему своими словами"],
+            }
+            for skill in skills[:3]
+        ],
+        "priority_plan": [f"Повторить: {skill}" for skill in skills[:5]],
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # клиент ушёл по своему таймауту — для stub это штатно
+            pass
+
+    def _send_json(self, status: int, obj: dict) -> None:
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        user = next((m.get("content") for m in body.get("messages", []) if m.get("role") == "user"), "")
+        try:
+            payload = json.loads(user or "{}")
+        except ValueError:
+            payload = {}
+
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            fail = server.fail_next > 0
+            if fail:
+                server.fail_next -= 1
+        if server.delay:
+            time.sleep(server.delay)
+        if fail:
+            self._send_json(server.fail_status, {"error": {"message": "stub failure", "code": server.fail_status}})
+            return
+        with server.lock:
+            server.completions += 1
+
+        content = json.dumps(stub_report(payload), ensure_ascii=False)
+        if body.get("stream"):
+            self._send_stream(body.get("model", "stub"), content)
+            return
+
+        self._send_json(200, {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def _send_stream(self, model: str, content: str) -> None:
+        """stream=True: ответ кусками по 16 символов в формате SSE chat.completion.chunk."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        pieces = [content[i:i + 16] for i in range(0, len(content), 16)]
+        for i, piece in enumerate(pieces):
+            if self.server.fail_stream_after and i >= self.server.fail_stream_after:
+                # так OpenRouter сообщает об ошибке, когда статус 200 уже отправлен
+                error = {"error": {"message": "stub stream failure", "code": 502}}
+                self.wfile.write(f"data: {json.dumps(error)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                return
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "delta": {"role": "assistant", "content": piece} if i == 0 else {"content": piece},
+                    "finish_reason": "stop" if i == len(pieces) - 1 else None,
+                }],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_stub_server(
+    host: str = "127.0.0.1", port: int = 0, *, delay: float = 0.0, fail_next: int = 0, fail_status: int = 500,
+) -> ThreadingHTTPServer:
+    """
+    port=0 — свободный порт (server.server_address[1]). Поведение меняется на ходу через атрибуты:
+    delay — задержка ответа, chunk_delay — пауза между кусками потока (stream=True),
+    fail_next — сколько следующих запросов ответить fail_status, fail_stream_after — оборвать поток
+    ошибкой после стольких кусков (0 — не обрывать).
+    Счётчики: requests — все запросы, completions — удачные ответы.
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.lock = threading.Lock()
+    server.delay = delay
+    server.chunk_delay = 0.0
+    server.fail_next = fail_next
+    server.fail_status = fail_status
+    server.fail_stream_after = 0
+    server.requests = 0
+    server.completions = 0
+    return server
@@ -0,0 +1,194 @@
+# webapp/attempt_finalizer.py
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    AdaptiveAttempt,
+    AdaptiveAttemptAnswer,
+    AttemptQuestionSheet,
+    Questions,
+    Testattempts,
+    Useranswers,
+)
+from .stats_rollup import record_adaptive_attempts, record_teacher_attempts
+
+# Попытки, у которых дедлайн прошёл, а finished_at так и не выставлен (студент закрыл вкладку).
+# Закрываем пачками: один SELECT id + один UPDATE ... FROM (агрегат ответов) на пачку.
+# Параллельно с живыми студентами безопасно: UPDATE трогает только finished_at IS NULL,
+# а запас margin больше, чем ANSWER_GRACE_SEC, на который ещё принимаются ответы.
+# Закрытые попытки (RETURNING id) в той же транзакции попадают в свёртку статистики.
+
+# те же настройки, что у views (webapp/views.py)
+TIME_LIMIT_SEC = int(getattr(settings, "ADAPTIVE_TIME_LIMIT_SEC", 10 * 60))
+ANSWER_GRACE_SEC = int(getattr(settings, "ANSWER_GRACE_SEC", 5))
+
+_JSON_ARRAY_LENGTH = {
+    "postgresql": "jsonb_array_length",
+    "sqlite": "json_array_length",
+    "mysql": "JSON_LENGTH",
+}
+
+
+@dataclass
+class FinalizeReport:
+    teacher: int = 0
+    adaptive: int = 0
+
+    def __str__(self) -> str:
+        return f"teacher attempts closed={self.teacher}, adaptive attempts closed={self.adaptive}"
+
+
+def _placeholders(ids: list[int]) -> str:
+    return ", ".join(["%s"] * len(ids))
+
+
+def rounded_percent(correct: int, total: int) -> int:
+    """Процент с округлением половины вверх — так же, как _score_sql; им считают и views."""
+    return (200 * correct + total) // (2 * total) if total > 0 else 0
+
+
+def _score_sql(correct: str, total: str) -> str:
+    # процент с округлением половины вверх, целочисленно (rounded_percent)
+    return f"CASE WHEN {total} > 0 THEN (200 * {correct} + {total}) / (2 * {total}) ELSE 0 END"
+
+
+def expired_teacher_attempts(now: datetime, *, margin_sec: int, abandon_after: timedelta):
+    """Открытые попытки тестов учителя с истёкшим Tests.time_limit; без лимита — старше abandon_after."""
+    open_attempts = Testattempts.objects.filter(finished_at__isnull=True, started_at__isnull=False)
+    limits = set(open_attempts.values_list("test__time_limit", flat=True).distinct())
+
+    cond = Q(test__time_limit__isnull=True) | Q(test__time_limit__lte=0)
+    cond &= Q(started_at__lt=now - abandon_after)
+    # лимитов столько же, сколько разных тестов в работе — по условию на каждый
+    for minutes in limits:
+        if minutes and int(minutes) > 0:
+            cond |= Q(
+                test__time_limit=minutes,
+                started_at__lt=now - timedelta(minutes=int(minutes), seconds=margin_sec),
+            )
+    return open_attempts.filter(cond)
+
+
+def expired_adaptive_attempts(now: datetime, *, margin_sec: int):
+    return AdaptiveAttempt.objects.filter(
+        finished_at__isnull=True,
+        started_at__lt=now - timedelta(seconds=TIME_LIMIT_SEC + margin_sec),
+    )
+
+
+def _close_teacher_batch(ids: list[int], now: datetime) -> int:
+    attempts = Testattempts._meta.db_table
+    sheets = AttemptQuestionSheet._meta.db_table
+    answers = Useranswers._meta.db_table
+    questions = Questions._meta.db_table
+    json_len = _JSON_ARRAY_LENGTH.get(connection.vendor, "json_array_length")
+    marks = _placeholders(ids)
+
+    # total — по листу попытки, для старых попыток без листа — по числу вопросов теста
+    sql = f"""
+        UPDATE {attempts}
+        SET finished_at = %s,
+            total_questions = agg.total,
+            correct_answers = agg.correct,
+            score = {_score_sql("agg.correct", "agg.total")}
+        FROM (
+            SELECT a.id AS id,
+                   COALESCE({json_len}(s.question_ids), q.n, 0) AS total,
+                   COALESCE(c.correct, 0) AS correct
+            FROM {attempts} a
+            LEFT JOIN {sheets} s ON s.attempt_id = a.id
+            LEFT JOIN (
+                SELECT test_id, COUNT(*) AS n
+                FROM {questions}
+                WHERE test_id IN (SELECT test_id FROM {attempts} WHERE id IN ({marks}))
+                GROUP BY test_id
+            ) q ON q.test_id = a.test_id
+            LEFT JOIN (
+                SELECT attempt_id, COUNT(*) AS correct
+                FROM {answers}
+                WHERE attempt_id IN ({marks}) AND is_correct = %s
+                GROUP BY attempt_id
+            ) c ON c.attempt_id = a.id
+            WHERE a.id IN ({marks})
+        ) agg
+        WHERE {attempts}.id = agg.id AND {attempts}.finished_at IS NULL
+        RETURNING {attempts}.id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [now, *ids, *ids, True, *ids])
+        closed = [row[0] for row in cursor.fetchall()]
+    record_teacher_attempts(closed)
+    return len(closed)
+
+
+def _close_adaptive_batch(ids: list[int], now: datetime) -> int:
+    attempts = AdaptiveAttempt._meta.db_table
+    answers = AdaptiveAttemptAnswer._meta.db_table
+    marks = _placeholders(ids)
+
+    # счётчики ведёт _record_adaptive_answer, но источник правды — сами ответы
+    sql = f"""
+        UPDATE {attempts}
+        SET finished_at = %s,
+            total_questions = agg.total,
+            correct_answers = agg.correct,
+            score_percent = {_score_sql("agg.correct", "agg.total")}
+        FROM (
+            SELECT a.id AS id,
+                   COUNT(x.id) AS total,
+                   COALESCE(SUM(CASE WHEN x.is_correct THEN 1 ELSE 0 END), 0) AS correct
+            FROM {attempts} a
+            LEFT JOIN {answers} x ON x.attempt_id = a.id
+            WHERE a.id IN ({marks})
+            GROUP BY a.id
+        ) agg
+        WHERE {attempts}.id = agg.id AND {attempts}.finished_at IS NULL
+        RETURNING {attempts}.id
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [now, *ids])
+        closed = [row[0] for row in cursor.fetchall()]
+    record_adaptive_attempts(closed)
+    return len(closed)
+
+
+def _close_in_batches(qs, close_batch, now: datetime, batch_size: int) -> int:
+    closed = 0
+    last_id = 0
+    while True:
+        ids = list(qs.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return closed
+        # короткая транзакция на пачку — блокировки строк не копятся
+        with transaction.atomic():
+            closed += close_batch(ids, now)
+        last_id = ids[-1]
+
+
+def finalize_expired_attempts(
+    *,
+    now: datetime | None = None,
+    margin_sec: int = 60,
+    abandon_after: timedelta = timedelta(hours=24),
+    batch_size: int = 500,
+) -> FinalizeReport:
+    now = now or timezone.now()
+    margin_sec = max(margin_sec, ANSWER_GRACE_SEC + 1)
+
+    report = FinalizeReport()
+    report.teacher = _close_in_batches(
+        expired_teacher_attempts(now, margin_sec=margin_sec, abandon_after=abandon_after),
+        _close_teacher_batch, now, batch_size,
+    )
+    report.adaptive = _close_in_batches(
+        expired_adaptive_attempts(now, margin_sec=margin_sec),
+        _close_adaptive_batch, now, batch_size,
+    )
+    return report
@@ -0,0 +1,38 @@
+# webapp/cache_utils.py
+from __future__ import annotations
+
+from django.core.cache import cache
+
+# Общие приёмы работы с cache: версия в ключе (правка поднимает версию, старые записи
+# просто истекают) и счётчики попаданий. Используют stats_cache, report_cache, question_bank,
+# teacher_test_payload и item_analysis.
+
+
+def incr(key: str) -> int:
+    """+1 к числу без TTL. add/incr атомарны на Redis и Memcached; ключ вытеснили — начинаем с 1."""
+    if cache.add(key, 1, timeout=None):
+        return 1
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def get_version(key: str) -> int:
+    return int(cache.get(key) or 0)
+
+
+def bump_version(key: str) -> int:
+    return incr(key)
+
+
+def counter_stats(hits_key: str, misses_key: str) -> dict:
+    hits = int(cache.get(hits_key) or 0)
+    misses = int(cache.get(misses_key) or 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 3) if total else 0.0,
+    }
@@ -0,0 +1,266 @@
+# webapp/exports.py
+from __future__ import annotations
+
+import csv
+import re
+import zipfile
+from datetime import datetime
+from typing import Iterable, Iterator
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+
+from .models import AdaptiveAttemptAnswer, Answers, Useranswers
+from .services import teacher_basic_attempts, teacher_group_name, teacher_test_attempts
+
+# Выгрузка попыток и ответов учителя. Строки идут из БД через iterator(chunk_size=...) —
+# на PostgreSQL это серверный курсор, — и сразу уходят в StreamingHttpResponse:
+# память не растёт с размером выгрузки, первый байт (заголовок) уходит до первого запроса.
+
+ATTEMPT_COLUMNS = (
+    "kind", "attempt_id", "student_id", "student", "group", "test", "topic",
+    "started_at", "finished_at", "total_questions", "correct_answers", "score",
+)
+ANSWER_COLUMNS = (
+    "kind", "attempt_id", "student_id", "student", "test", "question_id", "question",
+    "answer", "correct_answer", "is_correct",
+)
+
+_FLUSH_BYTES = 64 * 1024
+
+
+def _chunk_size() -> int:
+    return int(getattr(settings, "EXPORT_CHUNK_SIZE", 2000))
+
+
+def _scoped(teacher_id: int, group_id, student_id, test_key) -> tuple:
+    """Те же фильтры, что на teacher_statistics; ветка, не подходящая под test_key, — None."""
+    test_id = int(test_key[2:]) if test_key and test_key.startswith("T-") else None
+    topic_code = test_key[2:] if test_key and test_key.startswith("B-") else None
+    tests = None
+    if topic_code is None:
+        tests = teacher_test_attempts(teacher_id, group_id=group_id, student_id=student_id, test_id=test_id)
+    basic = None
+    if test_id is None:
+        basic = teacher_basic_attempts(teacher_id, group_id=group_id, student_id=student_id, topic_code=topic_code)
+    return tests, basic
+
+
+def attempt_rows(teacher_id: int, *, group_id: int | None = None, student_id: int | None = None,
+                 test_key: str | None = None) -> Iterator[tuple]:
+    tests, basic = _scoped(teacher_id, group_id, student_id, test_key)
+    if tests is not None:
+        rows = (
+            tests.filter(finished_at__isnull=False)
+            .order_by("id")
+            .values_list(
+                "id", "user_id", "user__username", "schedule__group__name", "test__title", "test__topic__name",
+                "started_at", "finished_at", "total_questions", "correct_answers", "score",
+            )
+        )
+        for row in rows.iterator(chunk_size=_chunk_size()):
+            yield ("teacher", *row)
+    if basic is not None:
+        rows = (
+            basic.filter(finished_at__isnull=False)
+            .annotate(group_name=teacher_group_name(teacher_id, group_id))
+            .order_by("id")
+            .values_list(
+                "id", "user_id", "user__username", "group_name", "topic_code", "topic_code",
+                "started_at", "finished_at", "total_questions", "correct_answers", "score_percent",
+            )
+        )
+        for row in rows.iterator(chunk_size=_chunk_size()):
+            yield ("basic", *row)
+
+
+def answer_rows(teacher_id: int, *, group_id: int | None = None, student_id: int | None = None,
+                test_key: str | None = None) -> Iterator[tuple]:
+    tests, basic = _scoped(teacher_id, group_id, student_id, test_key)
+    if tests is not None:
+        # правильный вариант — подзапросом к answers, в том же запросе
+        correct = Answers.objects.filter(question_id=OuterRef("question_id"), is_correct=True).order_by("id")
+        rows = (
+            Useranswers.objects
+            .filter(attempt_id__in=tests.values("id"))
+            .annotate(correct_text=Subquery(correct.values("answer_text")[:1]))
+            .order_by("attempt_id", "id")
+            .values_list(
+                "attempt_id", "attempt__user_id", "attempt__user__username", "attempt__test__title",
+                "question_id", "question__question_text", "answer__answer_text", "answer_text", "correct_text",
+                "is_correct",
+            )
+        )
+        # в answer_text лежит ответ студента — на случай, если вариант потом удалили
+        for (attempt_id, user_id, username, title, question_id, question, chosen, typed, correct_text,
+             is_correct) in rows.iterator(chunk_size=_chunk_size()):
+            yield ("teacher", attempt_id, user_id, username, title, question_id, question,
+                   chosen if chosen is not None else typed, correct_text, is_correct)
+    if basic is not None:
+        rows = (
+            AdaptiveAttemptAnswer.objects
+            .filter(attempt_id__in=basic.values("id"))
+            .order_by("attempt_id", "id")
+            .values_list(
+                "attempt_id", "attempt__user_id", "attempt__user__username", "attempt__topic_code",
+                "question_id", "question__text", "chosen_option", "question__correct_option", "is_correct",
+            )
+        )
+        for row in rows.iterator(chunk_size=_chunk_size()):
+            yield ("basic", *row)
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ", timespec="seconds")
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return str(value)
+
+
+class _Echo:
+    def write(self, value: str) -> str:
+        return value
+
+
+_NUMBER = re.compile(r"^-?\d+(\.\d+)?$")
+
+
+def _csv_safe(value: str) -> str:
+    # текст студентов не должен открываться в Excel как формула (в том числе после \t и \r)
+    return "'" + value if value[:1] in ("=", "+", "-", "@", "\t", "\r") and not _NUMBER.match(value) else value
+
+
+def stream_csv(header: Iterable[str], rows: Iterable[tuple]) -> Iterator[bytes]:
+    writer = csv.writer(_Echo())
+    # BOM — чтобы Excel открыл UTF-8 с кириллицей без мастера импорта
+    yield ("\ufeff" + writer.writerow(header)).encode("utf-8")
+    buf: list[str] = []
+    size = 0
+    for row in rows:
+        line = writer.writerow([_csv_safe(_cell(v)) for v in row])
+        buf.append(line)
+        size += len(line)
+        if size >= _FLUSH_BYTES:
+            yield "".join(buf).encode("utf-8")
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+
+# --- XLSX: минимальная книга из одного листа, пишется zip-потоком без openpyxl ---
+
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+_SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_SHEET_TAIL = "</sheetData></worksheet>"
+
+
+class _Sink:
+    """Файл без seek/tell: zipfile пишет в него локальные заголовки с data descriptor."""
+
+    def __init__(self) -> None:
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _xlsx_cell(value) -> str:
+    if value is None:
+        return "<c/>"
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f"<c><v>{value}</v></c>"
+    text = escape(_XML_ILLEGAL.sub("", _cell(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(values: Iterable) -> str:
+    return "<row>" + "".join(_xlsx_cell(v) for v in values) + "</row>"
+
+
+def stream_xlsx(header: Iterable[str], rows: Iterable[tuple], *, sheet: str = "Sheet1") -> Iterator[bytes]:
+    sink = _Sink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        zf.writestr("_rels/.rels", _ROOT_RELS)
+        zf.writestr("xl/workbook.xml", _WORKBOOK.format(name=escape(sheet, {'"': "&quot;"})))
+        zf.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+        yield sink.drain()
+
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as part:
+            part.write((_SHEET_HEAD + _xlsx_row(header)).encode("utf-8"))
+            buf: list[str] = []
+            size = 0
+            for row in rows:
+                line = _xlsx_row(row)
+                buf.append(line)
+                size += len(line)
+                if size >= _FLUSH_BYTES:
+                    part.write("".join(buf).encode("utf-8"))
+                    buf, size = [], 0
+                    data = sink.drain()
+                    if data:
+                        yield data
+            part.write(("".join(buf) + _SHEET_TAIL).encode("utf-8"))
+    yield sink.drain()
+
+
+EXPORTS = {
+    "attempts": (ATTEMPT_COLUMNS, attempt_rows),
+    "answers": (ANSWER_COLUMNS, answer_rows),
+}
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", stream_csv),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", stream_xlsx),
+}
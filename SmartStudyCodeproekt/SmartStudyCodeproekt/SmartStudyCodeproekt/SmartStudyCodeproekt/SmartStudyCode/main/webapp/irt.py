@@ -0,0 +1,175 @@
+# webapp/irt.py
+from __future__ import annotations
+
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .question_bank import BankQuestion, question_bank
+
+# Для неоткалиброванных вопросов трудность b берём из ручного level.
+LEVEL_DIFFICULTY = {1: -1.0, 2: 0.0, 3: 1.0}
+
+# Сетка для EAP-оценки способности theta, априорное N(0, 1).
+_GRID = np.linspace(-4.0, 4.0, 81)
+_LOG_PRIOR = -0.5 * _GRID ** 2
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def irt_model() -> str:
+    return str(_setting("IRT_MODEL", "2pl")).lower()
+
+
+def min_items() -> int:
+    return int(_setting("IRT_MIN_ITEMS", 5))
+
+
+def max_items() -> int:
+    return int(_setting("IRT_MAX_ITEMS", 10))
+
+
+def se_target() -> float:
+    return float(_setting("IRT_SE_TARGET", 0.5))
+
+
+def top_k() -> int:
+    return max(1, int(_setting("IRT_RANDOMESQUE_K", 5)))
+
+
+_rng = np.random.default_rng()
+
+
+class ItemPool:
+    """Параметры вопросов одной темы в виде векторов: ids, a (дискриминация), b (трудность)."""
+
+    def __init__(self, ids, a, b) -> None:
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.a = np.asarray(a, dtype=np.float64)
+        self.b = np.asarray(b, dtype=np.float64)
+        if irt_model() == "1pl":
+            self.a = np.ones_like(self.b)
+        self.pos = {int(qid): i for i, qid in enumerate(self.ids)}
+
+    @classmethod
+    def from_questions(cls, questions: list[BankQuestion]) -> "ItemPool":
+        return cls(
+            [q.id for q in questions],
+            [q.discrimination or 1.0 for q in questions],
+            [q.difficulty if q.difficulty is not None else LEVEL_DIFFICULTY.get(q.level, 0.0) for q in questions],
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def params(self, qids) -> tuple[np.ndarray, np.ndarray]:
+        idx = [self.pos[q] for q in qids if q in self.pos]
+        return self.a[idx], self.b[idx]
+
+    def select(self, theta: float, exclude, rng: np.random.Generator | None = None) -> int | None:
+        """
+        Случайный из top_k самых информативных вопросов при theta (randomesque): при чистом
+        argmax все студенты с одной theta получали бы одну и ту же последовательность.
+        """
+        if not len(self.ids):
+            return None
+        p = 1.0 / (1.0 + np.exp(-self.a * (theta - self.b)))
+        info = self.a ** 2 * p * (1.0 - p)
+        idx = [self.pos[q] for q in exclude if q in self.pos]
+        if idx:
+            info[idx] = -np.inf
+        k = min(top_k(), len(info))
+        top = np.argpartition(info, -k)[-k:]
+        top = top[np.isfinite(info[top])]
+        if not len(top):
+            return None
+        return int(self.ids[(rng or _rng).choice(top)])
+
+
+def estimate_theta(a: np.ndarray, b: np.ndarray, u: np.ndarray) -> tuple[float, float]:
+    """EAP-оценка theta и её стандартная ошибка по ответам u (1/0) на вопросы (a, b)."""
+    if not len(u):
+        return 0.0, 1.0
+    z = a[:, None] * (_GRID[None, :] - b[:, None])
+    # log P и log(1 - P) через logaddexp — без переполнения на краях сетки
+    log_p = -np.logaddexp(0.0, -z)
+    log_q = -np.logaddexp(0.0, z)
+    log_post = _LOG_PRIOR + (u[:, None] * log_p + (1.0 - u[:, None]) * log_q).sum(axis=0)
+    w = np.exp(log_post - log_post.max())
+    w /= w.sum()
+    theta = float((_GRID * w).sum())
+    se = float(np.sqrt(((_GRID - theta) ** 2 * w).sum()))
+    return theta, se
+
+
+_pools: dict[str, ItemPool] = {}
+_pools_generation: int | None = None
+_pools_lock = threading.Lock()
+
+
+def topic_pool(topic_code: str) -> ItemPool:
+    """Пул темы строится из question_bank и живёт до следующей перезагрузки банка."""
+    global _pools_generation
+    questions = question_bank.topic_questions(topic_code)
+    with _pools_lock:
+        if _pools_generation != question_bank.generation:
+            _pools.clear()
+            _pools_generation = question_bank.generation
+        pool = _pools.get(topic_code)
+        if pool is None:
+            pool = ItemPool.from_questions(questions)
+            _pools[topic_code] = pool
+    return pool
+
+
+# --- состояние попытки в session ---
+
+def initial_state() -> dict:
+    return {"responses": [], "theta": 0.0, "se": 1.0}
+
+
+def _estimate(pool: ItemPool, responses: list) -> tuple[float, float]:
+    responses = [(qid, u) for qid, u in responses if qid in pool.pos]
+    a, b = pool.params([qid for qid, _ in responses])
+    u = np.asarray([u for _, u in responses], dtype=np.float64)
+    return estimate_theta(a, b, u)
+
+
+def record_response(topic_code: str, state: dict, qid: int, is_correct: bool) -> None:
+    responses = list(state.get("responses", []))
+    responses.append([qid, int(is_correct)])
+    state["responses"] = responses
+    state["theta"], state["se"] = _estimate(topic_pool(topic_code), responses)
+
+
+def should_stop(state: dict) -> bool:
+    n = len(state.get("responses", []))
+    if n >= max_items():
+        return True
+    return n >= min_items() and float(state.get("se", 1.0)) <= se_target()
+
+
+def plan_next(topic_code: str, state: dict, rng: np.random.Generator | None = None) -> None:
+    """
+    Тот же контракт, что у views._plan_next: current_qid + branches (ok / bad).
+    Для каждой ветки пересчитываем theta так, будто ответ уже дан. rng — для воспроизводимого выбора.
+    """
+    pool = topic_pool(topic_code)
+    asked_ids = list(state.get("asked_ids", []))
+    responses = list(state.get("responses", []))
+
+    current = state.get("current_qid")
+    if not current or current in asked_ids:
+        current = pool.select(float(state.get("theta", 0.0)), asked_ids, rng=rng)
+        state["current_qid"] = current
+
+    branches: dict[str, int | None] = {}
+    if current is not None and len(responses) + 1 < max_items():
+        exclude = asked_ids + [current]
+        for key, u in (("ok", 1), ("bad", 0)):
+            theta, _ = _estimate(pool, responses + [[current, u]])
+            branches[key] = pool.select(theta, exclude, rng=rng)
+    state["branches"] = branches
@@ -0,0 +1,203 @@
+# webapp/item_analysis.py
+from __future__ import annotations
+
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .cache_utils import bump_version, get_version
+from .models import Testattempts, Useranswers
+from .teacher_test_payload import get_test_payload, test_payload_version
+
+# Анализ заданий теста учителя по завершённым попыткам:
+#   p — доля верных ответов (пропуск = неверно), D — (верных в верхних 27% − в нижних 27%) / размер группы,
+#   частоты выбора каждого варианта, KR-20 по суммарным баллам попыток.
+# Всё, что зависит от числа попыток, считает БД: один GROUP BY по (вопрос, вариант) с разбиением
+# попыток на группы оконной функцией и один агрегат по баллам. Python обходит только вопросы теста.
+# Результат в cache до следующей закрытой попытки этого теста или правки вопросов.
+
+UPPER_LOWER_SHARE = 27
+
+TOO_EASY_P = 0.9
+TOO_HARD_P = 0.2
+LOW_DISCRIMINATION = 0.2
+
+_VERSION_KEY = "item_analysis:ver:{test_id}"
+_ENTRY_KEY = "item_analysis:{test_id}:{version}:{payload_version}"
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "ITEM_ANALYSIS_CACHE_TTL_SEC", 24 * 60 * 60))
+
+
+def _totals_cte() -> str:
+    attempts = Testattempts._meta.db_table
+    answers = Useranswers._meta.db_table
+    return f"""
+        WITH totals AS (
+            SELECT a.id AS attempt_id,
+                   COALESCE(SUM(CASE WHEN u.is_correct = %s THEN 1 ELSE 0 END), 0) AS total
+            FROM {attempts} a
+            LEFT JOIN {answers} u ON u.attempt_id = a.id
+            WHERE a.test_id = %s AND a.finished_at IS NOT NULL
+            GROUP BY a.id
+        )
+    """
+
+
+def _band_size(n: int) -> int:
+    return max(1, (n * UPPER_LOWER_SHARE + 50) // 100) if n else 0
+
+
+def _option_rows(test_id: int) -> list[tuple]:
+    """(question_id, answer_id, is_correct, picks, upper_picks, lower_picks)."""
+    answers = Useranswers._meta.db_table
+    share = UPPER_LOWER_SHARE
+    sql = _totals_cte() + f""",
+        ranked AS (
+            SELECT attempt_id,
+                   ROW_NUMBER() OVER (ORDER BY total DESC, attempt_id) AS pos,
+                   COUNT(*) OVER () AS n
+            FROM totals
+        ),
+        banded AS (
+            SELECT attempt_id,
+                   CASE WHEN pos <= k THEN 1 WHEN pos > n - k THEN -1 ELSE 0 END AS band
+            FROM (
+                SELECT attempt_id, pos, n,
+                       CASE WHEN (n * {share} + 50) / 100 < 1 THEN 1 ELSE (n * {share} + 50) / 100 END AS k
+                FROM ranked
+            ) x
+        )
+        SELECT u.question_id, u.answer_id, u.is_correct,
+               COUNT(*) AS picks,
+               SUM(CASE WHEN b.band = 1 THEN 1 ELSE 0 END) AS upper_picks,
+               SUM(CASE WHEN b.band = -1 THEN 1 ELSE 0 END) AS lower_picks
+        FROM {answers} u
+        JOIN banded b ON b.attempt_id = u.attempt_id
+        GROUP BY u.question_id, u.answer_id, u.is_correct
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [True, test_id])
+        return cursor.fetchall()
+
+
+def _score_moments(test_id: int) -> tuple[int, int, int]:
+    """Число попыток, сумма и сумма квадратов суммарных баллов — для дисперсии в KR-20."""
+    sql = _totals_cte() + "SELECT COUNT(*), COALESCE(SUM(total), 0), COALESCE(SUM(total * total), 0) FROM totals"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [True, test_id])
+        n, s, s2 = cursor.fetchone()
+    return int(n), int(s), int(s2)
+
+
+def _kr20(k: int, sum_pq: float, n: int, s: int, s2: int) -> float | None:
+    if k < 2 or n < 2:
+        return None
+    variance = s2 / n - (s / n) ** 2
+    if variance <= 0:
+        return None
+    return round(k / (k - 1) * (1 - sum_pq / variance), 3)
+
+
+def build_item_analysis(test_id: int) -> dict:
+    payload = get_test_payload(test_id)
+    n, score_sum, score_sq = _score_moments(test_id)
+    band = _band_size(n)
+
+    # (question_id, answer_id) -> [picks, upper, lower]; correct — по is_correct на момент ответа
+    picks: dict[tuple, list[int]] = {}
+    correct: dict[int, list[int]] = {}
+    if n:
+        for qid, aid, is_correct, total, upper, lower in _option_rows(test_id):
+            row = picks.setdefault((qid, aid), [0, 0, 0])
+            row[0] += total
+            row[1] += int(upper or 0)
+            row[2] += int(lower or 0)
+            if is_correct:
+                c = correct.setdefault(qid, [0, 0, 0])
+                c[0] += total
+                c[1] += int(upper or 0)
+                c[2] += int(lower or 0)
+
+    items = []
+    sum_pq = 0.0
+    for qid in payload["order"]:
+        q = payload["questions"][qid]
+        right, right_upper, right_lower = correct.get(qid, (0, 0, 0))
+        p = right / n if n else None
+        d = (right_upper - right_lower) / band if band else None
+        if p is not None:
+            sum_pq += p * (1 - p)
+
+        options = []
+        answered = 0
+        for a in q["answers"]:
+            total, upper, lower = picks.get((qid, a["id"]), (0, 0, 0))
+            answered += total
+            options.append({
+                "id": a["id"],
+                "answer_text": a["answer_text"],
+                "is_correct": a["is_correct"],
+                "picks": total,
+                "share": total / n if n else 0.0,
+                "upper": upper,
+                "lower": lower,
+                # дистрактор, который сильные выбирают чаще слабых, — вероятно, вопрос двусмысленный
+                "misleading": (not a["is_correct"]) and upper > lower,
+            })
+        other = picks.get((qid, None), (0, 0, 0))[0]
+
+        flags = []
+        if p is not None and p >= TOO_EASY_P:
+            flags.append("too_easy")
+        if p is not None and p <= TOO_HARD_P:
+            flags.append("too_hard")
+        if d is not None and d < LOW_DISCRIMINATION:
+            flags.append("low_discrimination")
+        if any(o["misleading"] for o in options):
+            flags.append("misleading_distractor")
+
+        items.append({
+            "id": qid,
+            "question_text": q["question_text"],
+            "p_value": p,
+            "discrimination": d,
+            "options": options,
+            "other": other,
+            "omitted": max(0, n - answered - other),
+            "flags": flags,
+        })
+
+    return {
+        "attempts": n,
+        "band_size": band,
+        "avg_correct": score_sum / n if n else 0.0,
+        "kr20": _kr20(len(items), sum_pq, n, score_sum, score_sq),
+        "items": items,
+    }
+
+
+def get_item_analysis(test_id: int) -> dict:
+    version = get_version(_VERSION_KEY.format(test_id=test_id))
+    key = _ENTRY_KEY.format(test_id=test_id, version=version, payload_version=test_payload_version(test_id))
+    data = cache.get(key)
+    if data is None:
+        data = build_item_analysis(test_id)
+        cache.set(key, data, timeout=_ttl())
+    return data
+
+
+def invalidate_item_analysis(test_ids: Iterable[int]) -> None:
+    """Вызывается при закрытии попыток; версия поднимается после коммита."""
+    test_ids = sorted(set(test_ids))
+    if not test_ids:
+        return
+
+    def bump() -> None:
+        for test_id in test_ids:
+            bump_version(_VERSION_KEY.format(test_id=test_id))
+
+    transaction.on_commit(bump)
@@ -0,0 +1,78 @@
+# webapp/leaderboard.py
+from __future__ import annotations
+
+from statistics import median
+
+from django.db.models import F, FloatField, Q, QuerySet, Sum, Window
+from django.db.models.functions import Cast, PercentRank, Rank
+
+from .models import StudentsGroups, TeacherStatsDaily
+
+# Рейтинг студентов группы — по свёртке TeacherStatsDaily (webapp/stats_rollup.py): она уже
+# материализована и пополняется при закрытии каждой попытки. Средний балл студента, место и
+# перцентиль считает БД (GROUP BY + RANK/PERCENT_RANK); Python видит только строки студентов.
+
+
+def _ranked(rows: QuerySet, partition: list | None = None) -> QuerySet:
+    """rows — строки свёртки; на выходе по строке на (группу, студента) со средним, местом и перцентилем."""
+    score = Cast(Sum("score_sum"), FloatField()) / Sum("attempts_count")
+    return (
+        rows.values("group_id", "student_id")
+        .annotate(
+            student_name=F("student__username"),
+            attempts=Sum("attempts_count"),
+            score=score,
+        )
+        .annotate(
+            rank=Window(Rank(), partition_by=partition, order_by=F("score").desc()),
+            percentile=Window(PercentRank(), partition_by=partition, order_by=F("score").asc()),
+        )
+        .order_by("group_id", "rank", "student_name")
+    )
+
+
+def _with_median(rows: list[dict]) -> float | None:
+    mid = median(r["score"] for r in rows) if rows else None
+    for r in rows:
+        r["score"] = round(r["score"], 1)
+        r["percentile"] = round(r["percentile"] * 100)
+        r["delta"] = round(r["score"] - mid, 1)
+    return mid
+
+
+def group_leaderboard(teacher_id: int, group_id: int, *, test_key: str | None = None) -> dict:
+    """Весь рейтинг группы (по всем тестам или по одному test_key) одним запросом."""
+    rows = TeacherStatsDaily.objects.filter(teacher_id=teacher_id, group_id=group_id)
+    if test_key is not None:
+        rows = rows.filter(test_key=test_key)
+    board = list(_ranked(rows))
+    mid = _with_median(board)
+    return {"rows": board, "median": round(mid, 1) if mid is not None else None}
+
+
+def student_standings(student_id: int) -> list[dict]:
+    """Место студента в каждой его группе: рейтинги групп одним запросом с PARTITION BY group_id."""
+    links = list(
+        StudentsGroups.objects.filter(student_id=student_id)
+        .values_list("group_id", "group__name", "group__teacher_id")
+    )
+    if not links:
+        return []
+    # строки группы — только её учителя: автор теста получает те же попытки со своим teacher_id
+    cond = Q()
+    for group_id, _, teacher_id in links:
+        cond |= Q(teacher_id=teacher_id, group_id=group_id)
+    rows = TeacherStatsDaily.objects.filter(cond)
+
+    boards: dict[int, list[dict]] = {}
+    for r in _ranked(rows, partition=[F("group_id")]):
+        boards.setdefault(r["group_id"], []).append(r)
+
+    out = []
+    for group_id, group_name, _ in links:
+        board = boards.get(group_id, [])
+        _with_median(board)
+        mine = next((r for r in board if r["student_id"] == student_id), None)
+        if mine is not None:
+            out.append({"group": group_name, "size": len(board), **mine})
+    return out
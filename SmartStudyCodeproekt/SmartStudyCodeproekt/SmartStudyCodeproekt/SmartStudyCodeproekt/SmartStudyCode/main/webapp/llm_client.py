@@ -0,0 +1,211 @@
+# webapp/llm_client.py
+from __future__ import annotations
+
+import random
+import threading
+import time
+from datetime import timedelta
+
+import openai
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from openai import OpenAI
+
+from .models import LLMBreakerState
+
+# Клиент OpenRouter — один на процесс: пул keep-alive соединений переиспользуется между
+# запросами и потоками воркера. Явные таймауты подключения и чтения, свои повторы с jitter
+# (повторы SDK выключены) и circuit breaker. Состояние breaker — строка llm_breaker_state в БД:
+# её видят все процессы и воркеры, и страница AIStatHelper не ставит задачу, пока провайдер лежит.
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+_BREAKER_NAME = "openrouter"
+
+_client: OpenAI | None = None
+_client_conf: tuple | None = None
+_client_lock = threading.Lock()
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def _client_settings() -> tuple:
+    key = (_setting("OPENROUTER_API_KEY", "") or "").strip()
+    if not key:
+        raise RuntimeError("OPENROUTER_API_KEY is empty in settings.py")
+    return (
+        key,
+        (_setting("OPENROUTER_BASE_URL", "") or OPENROUTER_BASE_URL).strip(),
+        (_setting("OPENROUTER_SITE_URL", "") or "http://127.0.0.1:8000").strip(),
+        (_setting("OPENROUTER_APP_TITLE", "") or "SmartCodeStudy").strip(),
+        float(_setting("OPENROUTER_CONNECT_TIMEOUT_SEC", 5)),
+        float(_setting("OPENROUTER_READ_TIMEOUT_SEC", 30)),
+    )
+
+
+def get_client() -> OpenAI:
+    """Общий клиент; пересоздаётся только если поменялись настройки (ключ, адрес, таймауты)."""
+    global _client, _client_conf
+    conf = _client_settings()
+    with _client_lock:
+        if _client is None or _client_conf != conf:
+            key, base_url, site_url, app_title, connect, read = conf
+            # старый клиент не закрываем: им могут пользоваться запросы в других потоках,
+            # его пул закроется сборщиком мусора
+            _client = OpenAI(
+                api_key=key,
+                base_url=base_url,
+                timeout=openai.Timeout(read, connect=connect),
+                max_retries=0,
+                default_headers={
+                    "HTTP-Referer": site_url,
+                    "X-Title": app_title,
+                },
+            )
+            _client_conf = conf
+        return _client
+
+
+# -------- circuit breaker --------
+
+def _breaker():
+    return LLMBreakerState.objects.filter(name=_BREAKER_NAME)
+
+
+def breaker_state() -> str:
+    """closed — работаем; open — отказываем сразу; half_open — cooldown прошёл, пускаем одну пробу."""
+    row = _breaker().values("opened_until", "tripped").first()
+    if row is None:
+        return "closed"
+    if row["opened_until"] and row["opened_until"] > timezone.now():
+        return "open"
+    return "half_open" if row["tripped"] else "closed"
+
+
+def circuit_open() -> bool:
+    return breaker_state() == "open"
+
+
+def _allow() -> bool:
+    state = breaker_state()
+    if state == "open":
+        return False
+    if state == "half_open":
+        # пробу получает один запрос (условный UPDATE); остальные ждут её результата
+        now = timezone.now()
+        probe_ttl = timedelta(seconds=int(_setting("OPENROUTER_READ_TIMEOUT_SEC", 30)) + 5)
+        return bool(
+            _breaker()
+            .filter(tripped=True)
+            .filter(Q(probe_until__isnull=True) | Q(probe_until__lt=now))
+            .update(probe_until=now + probe_ttl)
+        )
+    return True
+
+
+def _release_probe() -> None:
+    _breaker().filter(probe_until__isnull=False).update(probe_until=None)
+
+
+def _trip() -> None:
+    cooldown = timedelta(seconds=int(_setting("OPENROUTER_BREAKER_COOLDOWN_SEC", 30)))
+    LLMBreakerState.objects.update_or_create(name=_BREAKER_NAME, defaults={
+        "opened_until": timezone.now() + cooldown,
+        "tripped": True,
+        "failures": 0,
+        "window_started_at": None,
+        "probe_until": None,
+    })
+
+
+def _record_success() -> None:
+    _breaker().filter(Q(tripped=True) | Q(failures__gt=0)).update(
+        tripped=False, failures=0, window_started_at=None, probe_until=None,
+    )
+
+
+def _record_failure() -> None:
+    row, _ = LLMBreakerState.objects.get_or_create(name=_BREAKER_NAME)
+    if row.tripped:
+        # провалилась проба после cooldown — снова open
+        _trip()
+        return
+    now = timezone.now()
+    window = timedelta(seconds=int(_setting("OPENROUTER_BREAKER_WINDOW_SEC", 60)))
+    # в окне — +1; окно истекло — считаем заново
+    if not _breaker().filter(window_started_at__gte=now - window).update(failures=F("failures") + 1):
+        _breaker().update(failures=1, window_started_at=now)
+    failures = _breaker().values_list("failures", flat=True).first() or 0
+    if failures >= int(_setting("OPENROUTER_BREAKER_THRESHOLD", 5)):
+        _trip()
+
+
+# -------- запросы --------
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(e, openai.APIStatusError):
+        return e.status_code == 429 or e.status_code >= 500
+    return False
+
+
+def _backoff(attempt: int) -> float:
+    base = float(_setting("OPENROUTER_RETRY_BACKOFF_SEC", 0.5))
+    # экспонента с full jitter: повторы воркеров не бьют в провайдера одновременно
+    return random.uniform(0, min(base * 2 ** attempt, 8.0))
+
+
+def _accounted(stream):
+    """
+    Поток stream=True: breaker узнаёт исход, только когда ответ дочитан. Обрыв посреди ответа —
+    сбой провайдера; брошенный потребителем поток (закрыли SSE) исхода не даёт — проба освобождается.
+    """
+    try:
+        yield from stream
+    except GeneratorExit:
+        _release_probe()
+        raise
+    except Exception:
+        _record_failure()
+        raise
+    else:
+        _record_success()
+    finally:
+        stream.close()
+
+
+def chat_completion(**kwargs):
+    """
+    client.chat.completions.create с повторами временных ошибок (таймаут, обрыв, 429, 5xx).
+    Ошибки запроса (4xx) не повторяются и breaker не трогают. При open — CircuitOpenError без запроса.
+    С stream=True повторяется только открытие потока, успех или сбой засчитываются после чтения (_accounted).
+    """
+    if not _allow():
+        raise CircuitOpenError("AI service is temporarily unavailable, try again later")
+
+    client = get_client()
+    retries = int(_setting("OPENROUTER_MAX_RETRIES", 2))
+    for attempt in range(retries + 1):
+        try:
+            resp = client.chat.completions.create(**kwargs)
+        except Exception as e:
+            if not _retryable(e):
+                _release_probe()
+                raise
+            if attempt == retries:
+                _record_failure()
+                raise
+            time.sleep(_backoff(attempt))
+        else:
+            if kwargs.get("stream"):
+                return _accounted(resp)
+            _record_success()
+            return resp
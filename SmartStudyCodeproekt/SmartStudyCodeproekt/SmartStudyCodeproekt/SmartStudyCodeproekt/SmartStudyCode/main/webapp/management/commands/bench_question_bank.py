@@ -0,0 +1,83 @@
+# webapp/management/commands/bench_question_bank.py
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from webapp.models import AdaptiveQuestion
+from webapp.question_bank import question_bank
+
+
+def _pick_question_db(topic_code: str, level: int, asked_ids: list[int]):
+    # Старый путь из views._pick_question — только для сравнения.
+    q = (
+        AdaptiveQuestion.objects
+        .filter(topic_code=topic_code, level=level, is_active=True)
+        .exclude(id__in=asked_ids)
+        .order_by("?")
+        .first()
+    )
+    if q:
+        return q
+    return (
+        AdaptiveQuestion.objects
+        .filter(topic_code=topic_code, is_active=True)
+        .exclude(id__in=asked_ids)
+        .order_by("?")
+        .first()
+    )
+
+
+class Command(BaseCommand):
+    help = "Сравнивает выбор адаптивного вопроса: ORDER BY random() против in-memory банка."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--attempts", type=int, default=200, help="Сколько попыток симулировать")
+        parser.add_argument("--length", type=int, default=10, help="Вопросов в попытке")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def _run(self, pick, codes, attempts, length, rng):
+        started = time.perf_counter()
+        picked = 0
+        for _ in range(attempts):
+            code = rng.choice(codes)
+            level = 1
+            asked: list[int] = []
+            for _ in range(length):
+                q = pick(code, level, asked)
+                if q is None:
+                    break
+                asked.append(q.id)
+                picked += 1
+                level = max(1, min(3, level + rng.choice((-1, 0, 1))))
+        return time.perf_counter() - started, picked
+
+    def handle(self, *args, **opts):
+        codes = sorted(set(
+            AdaptiveQuestion.objects.filter(is_active=True).values_list("topic_code", flat=True)
+        ))
+        if not codes:
+            self.stderr.write("Нет активных AdaptiveQuestion — сначала запусти seed_adaptive.")
+            return
+
+        attempts, length = opts["attempts"], opts["length"]
+        question_bank.reset()
+
+        results = []
+        for name, pick in (("db", _pick_question_db), ("bank", question_bank.pick)):
+            with CaptureQueriesContext(connection) as ctx:
+                elapsed, picked = self._run(pick, codes, attempts, length, random.Random(opts["seed"]))
+            results.append((name, elapsed, picked, len(ctx.captured_queries)))
+
+        for name, elapsed, picked, queries in results:
+            per_pick = (elapsed / picked * 1e6) if picked else 0.0
+            self.stdout.write(
+                f"{name:>5}: {picked} picks, {elapsed * 1000:.1f} ms total, "
+                f"{per_pick:.1f} µs/pick, {queries} queries"
+            )
+
+        db_time, bank_time = results[0][1], results[1][1]
+        if bank_time > 0:
+            self.stdout.write(self.style.SUCCESS(f"speedup: x{db_time / bank_time:.1f}"))
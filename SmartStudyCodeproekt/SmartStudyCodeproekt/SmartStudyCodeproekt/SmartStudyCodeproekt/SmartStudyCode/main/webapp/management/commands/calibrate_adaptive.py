@@ -0,0 +1,189 @@
+# webapp/management/commands/calibrate_adaptive.py
+from datetime import timedelta
+from itertools import islice
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from webapp.models import (
+    AdaptiveAttemptAnswer,
+    AdaptiveCalibrationRun,
+    AdaptiveQuestion,
+    AdaptiveQuestionStats,
+)
+from webapp.question_bank import invalidate_question_bank
+
+# порядок колонок в накопителе: n, Σx, Σy, Σy², Σxy
+_N, _SX, _SY, _SYY, _SXY = range(5)
+
+# границы, чтобы 0% / 100% верных не давали бесконечную трудность
+_P_CLIP = (0.02, 0.98)
+_A_CLIP = (0.2, 3.0)
+
+
+def _chunks(it, size):
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _aggregate(chunk, acc: dict[int, np.ndarray]) -> None:
+    arr = np.asarray(chunk, dtype=np.float64)
+    qids = arr[:, 0].astype(np.int64)
+    x = arr[:, 1]
+    correct, total = arr[:, 2], arr[:, 3]
+    # y — доля верных в остальных вопросах попытки (без самого вопроса)
+    y = (correct - x) / (total - 1.0)
+
+    uq, inv = np.unique(qids, return_inverse=True)
+    sums = np.stack([
+        np.bincount(inv),
+        np.bincount(inv, weights=x),
+        np.bincount(inv, weights=y),
+        np.bincount(inv, weights=y * y),
+        np.bincount(inv, weights=x * y),
+    ], axis=1)
+
+    for qid, row in zip(uq.tolist(), sums):
+        if qid in acc:
+            acc[qid] += row
+        else:
+            acc[qid] = row.copy()
+
+
+def _parameters(stats: np.ndarray, with_discrimination: bool) -> tuple[np.ndarray, np.ndarray | None]:
+    n, sx, sy, syy, sxy = (stats[:, i] for i in range(5))
+    p = np.clip(sx / n, *_P_CLIP)
+    difficulty = -np.log(p / (1.0 - p))
+
+    if not with_discrimination:
+        return difficulty, None
+
+    # point-biserial r между x и y, затем a ≈ 1.7·r / sqrt(1 - r²)
+    cov = n * sxy - sx * sy
+    var = (n * sx - sx * sx) * (n * syy - sy * sy)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r = np.where(var > 0, cov / np.sqrt(var), 0.0)
+    r = np.clip(r, -0.95, 0.95)
+    discrimination = np.clip(1.7 * r / np.sqrt(1.0 - r * r), *_A_CLIP)
+    return difficulty, discrimination
+
+
+class Command(BaseCommand):
+    help = (
+        "Калибрует AdaptiveQuestion по истории ответов: доля верных -> irt_difficulty, "
+        "point-biserial -> irt_discrimination. Обрабатывает только попытки, завершённые с прошлого запуска."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--min-answers", type=int, default=30, help="Не калибровать вопросы с меньшим числом ответов")
+        parser.add_argument("--discrimination", action="store_true", help="Считать ещё и irt_discrimination")
+        parser.add_argument("--full", action="store_true", help="Сбросить накопленное и пересчитать всю историю")
+        parser.add_argument(
+            "--lag-sec", type=int, default=300,
+            help="Не брать попытки, завершённые позже now - lag: их транзакции могут быть ещё не закоммичены",
+        )
+
+    def handle(self, *args, **opts):
+        chunk_size = opts["chunk_size"]
+        # водяной знак с запасом: попытка с finished_at < until, закоммиченная уже после запуска,
+        # иначе навсегда осталась бы за прошлым окном
+        until = timezone.now() - timedelta(seconds=max(opts["lag_sec"], 0))
+
+        last_run = None if opts["full"] else AdaptiveCalibrationRun.objects.order_by("-finished_until", "-id").first()
+
+        answers = AdaptiveAttemptAnswer.objects.filter(
+            attempt__finished_at__isnull=False,
+            attempt__finished_at__lte=until,
+            attempt__total_questions__gte=2,
+        )
+        if last_run:
+            answers = answers.filter(attempt__finished_at__gt=last_run.finished_until)
+
+        rows = (
+            answers
+            .order_by("id")
+            .values_list("question_id", "is_correct", "attempt__correct_answers", "attempt__total_questions")
+            .iterator(chunk_size=chunk_size)
+        )
+
+        # память: одна пачка строк + по 5 чисел на вопрос банка
+        acc: dict[int, np.ndarray] = {}
+        processed = 0
+        for chunk in _chunks(rows, chunk_size):
+            _aggregate(chunk, acc)
+            processed += len(chunk)
+
+        with transaction.atomic():
+            if opts["full"]:
+                AdaptiveQuestionStats.objects.all().delete()
+
+            existing = AdaptiveQuestionStats.objects.in_bulk(list(acc.keys()))
+            stats_rows = []
+            for qid, row in acc.items():
+                st = existing.get(qid) or AdaptiveQuestionStats(question_id=qid)
+                st.answers_count += int(row[_N])
+                st.correct_count += int(row[_SX])
+                st.sum_rest += float(row[_SY])
+                st.sum_rest_sq += float(row[_SYY])
+                st.sum_rest_correct += float(row[_SXY])
+                st.updated_at = until
+                stats_rows.append(st)
+
+            AdaptiveQuestionStats.objects.bulk_create(
+                stats_rows,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=["question"],
+                update_fields=[
+                    "answers_count", "correct_count",
+                    "sum_rest", "sum_rest_sq", "sum_rest_correct", "updated_at",
+                ],
+            )
+
+            ready = [st for st in stats_rows if st.answers_count >= opts["min_answers"]]
+            updated = 0
+            mismatched = 0
+            if ready:
+                stats = np.asarray([
+                    (st.answers_count, st.correct_count, st.sum_rest, st.sum_rest_sq, st.sum_rest_correct)
+                    for st in ready
+                ], dtype=np.float64)
+                difficulty, discrimination = _parameters(stats, opts["discrimination"])
+
+                questions = AdaptiveQuestion.objects.in_bulk([st.question_id for st in ready])
+                to_update = []
+                for i, st in enumerate(ready):
+                    q = questions.get(st.question_id)
+                    if q is None:
+                        continue
+                    q.irt_difficulty = round(float(difficulty[i]), 4)
+                    if discrimination is not None:
+                        q.irt_discrimination = round(float(discrimination[i]), 4)
+                    # level 1/2/3 ~ b около -1/0/1; расхождение больше чем на уровень — повод проверить вопрос
+                    if abs(q.irt_difficulty - (q.level - 2)) > 1.0:
+                        mismatched += 1
+                    to_update.append(q)
+
+                fields = ["irt_difficulty"] + (["irt_discrimination"] if discrimination is not None else [])
+                AdaptiveQuestion.objects.bulk_update(to_update, fields, batch_size=1000)
+                updated = len(to_update)
+
+            AdaptiveCalibrationRun.objects.create(
+                finished_until=until,
+                answers_processed=processed,
+                questions_updated=updated,
+            )
+
+        if updated:
+            invalidate_question_bank()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Answers processed: {processed}, questions with new stats: {len(stats_rows)}, "
+            f"calibrated: {updated}, level mismatch: {mismatched}"
+        ))
@@ -0,0 +1,37 @@
+# webapp/management/commands/finalize_attempts.py
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from webapp.attempt_finalizer import finalize_expired_attempts
+
+
+class Command(BaseCommand):
+    help = (
+        "Закрывает брошенные попытки: тесты учителя после Tests.time_limit, адаптивные — после "
+        "TIME_LIMIT_SEC. Итоги считаются одним UPDATE на пачку. С --loop работает как воркер."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--margin-sec", type=int, default=60, help="Запас после дедлайна")
+        parser.add_argument(
+            "--abandon-hours", type=float, default=24,
+            help="Через сколько часов закрывать попытки тестов без time_limit",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--loop", action="store_true", help="Повторять каждые --interval секунд")
+        parser.add_argument("--interval", type=int, default=60)
+
+    def handle(self, *args, **opts):
+        while True:
+            started = time.perf_counter()
+            report = finalize_expired_attempts(
+                margin_sec=opts["margin_sec"],
+                abandon_after=timedelta(hours=opts["abandon_hours"]),
+                batch_size=opts["batch_size"],
+            )
+            self.stdout.write(self.style.SUCCESS(f"{report} ({time.perf_counter() - started:.2f}s)"))
+            if not opts["loop"]:
+                return
+            time.sleep(opts["interval"])
@@ -0,0 +1,37 @@
+# webapp/management/commands/import_adaptive_bank.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp.question_import import import_questions, read_bank_file
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает банк адаптивных вопросов из JSON/CSV: добавляет новые, обновляет изменённые "
+        "(по хэшу содержимого) и выключает пропавшие. Повторный запуск с тем же файлом ничего не меняет."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Файлы .json / .csv")
+        parser.add_argument("--keep-missing", action="store_true", help="Не выключать вопросы, которых нет в файле")
+        parser.add_argument("--dry-run", action="store_true", help="Только посчитать изменения")
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        items = []
+        try:
+            for path in opts["paths"]:
+                items.extend(read_bank_file(path))
+            report = import_questions(
+                items,
+                deactivate_missing=not opts["keep_missing"],
+                dry_run=opts["dry_run"],
+            )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        prefix = "[dry-run] " if opts["dry_run"] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}{len(items)} questions read, {report} ({time.perf_counter() - started:.2f}s)"
+        ))
@@ -0,0 +1,44 @@
+# webapp/management/commands/import_test_questions.py
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from webapp.models import Tests
+from webapp.teacher_question_import import ImportErrors, import_test_questions, parse_questions, validate_questions
+
+
+class Command(BaseCommand):
+    help = (
+        "Добавляет вопросы в тест учителя из CSV/JSON/Markdown. Сначала проверяются все строки; "
+        "если есть ошибки — ничего не пишется."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("test_id", type=int)
+        parser.add_argument("path", help="Файл .csv / .json / .md")
+        parser.add_argument("--dry-run", action="store_true", help="Только проверить файл")
+
+    def handle(self, *args, **opts):
+        try:
+            test = Tests.objects.get(id=opts["test_id"])
+        except Tests.DoesNotExist:
+            raise CommandError(f"Test {opts['test_id']} not found")
+
+        started = time.perf_counter()
+        path = Path(opts["path"])
+        try:
+            items = validate_questions(parse_questions(path.name, path.read_text(encoding="utf-8-sig")))
+        except ImportErrors as e:
+            raise CommandError("\n".join(e.errors))
+        except (OSError, UnicodeDecodeError) as e:
+            raise CommandError(str(e))
+
+        if opts["dry_run"]:
+            self.stdout.write(self.style.SUCCESS(f"[dry-run] {len(items)} questions are valid"))
+            return
+
+        created = import_test_questions(test, items)
+        self.stdout.write(self.style.SUCCESS(
+            f"{created} questions imported into '{test.title}' ({time.perf_counter() - started:.2f}s)"
+        ))
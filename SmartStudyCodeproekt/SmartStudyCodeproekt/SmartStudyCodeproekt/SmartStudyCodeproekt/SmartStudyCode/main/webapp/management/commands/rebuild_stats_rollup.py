@@ -0,0 +1,23 @@
+# webapp/management/commands/rebuild_stats_rollup.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from webapp.stats_rollup import rebuild_all
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересчитывает свёртку TeacherStatsDaily для teacher_statistics с нуля по всем завершённым попыткам. "
+        "Нужна после первого деплоя и если строки разошлись с историей."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        processed = rebuild_all(chunk_size=opts["chunk_size"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Attempts processed: {processed} ({time.perf_counter() - started:.2f}s)"
+        ))
@@ -0,0 +1,37 @@
+# webapp/management/commands/run_ai_report_worker.py
+import os
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+
+from webapp.ai_jobs import run_worker
+from webapp.report_cache import report_cache_counters
+
+
+class Command(BaseCommand):
+    help = (
+        "Воркер очереди отчётов AIStatHelper (ai_report_jobs). Можно запускать несколько процессов: "
+        "общее число задач в работе ограничивает AI_REPORT_CONCURRENCY, --threads — потоки этого процесса."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=2)
+        parser.add_argument("--interval", type=float, default=1.0, help="Пауза между опросами пустой очереди, сек")
+        parser.add_argument("--once", action="store_true", help="Разобрать очередь и выйти")
+        parser.add_argument("--worker-id", default=f"{socket.gethostname()}:{os.getpid()}")
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        processed = run_worker(
+            opts["worker_id"][:64],
+            threads=max(1, opts["threads"]),
+            interval=opts["interval"],
+            once=opts["once"],
+            log=self.stdout.write,
+        )
+        counters = report_cache_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f"Jobs processed: {processed}, shared report cache: {counters['hits']} hits / "
+            f"{counters['misses']} misses, hit rate {counters['hit_rate']} ({time.perf_counter() - started:.2f}s)"
+        ))
@@ -0,0 +1,32 @@
+# webapp/management/commands/run_ai_stub_server.py
+from django.core.management.base import BaseCommand
+
+from webapp.ai_stub import make_stub_server
+
+
+class Command(BaseCommand):
+    help = (
+        "Локальный stub LLM-сервера (OpenAI-совместимый /chat/completions) для работы без сети. "
+        "В settings: OPENROUTER_BASE_URL = \"http://127.0.0.1:<port>/v1\"."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--delay", type=float, default=0.0, help="Искусственная задержка ответа, сек")
+        parser.add_argument("--fail-next", type=int, default=0, help="Ответить ошибкой на столько первых запросов")
+        parser.add_argument("--fail-status", type=int, default=500)
+
+    def handle(self, *args, **opts):
+        server = make_stub_server(
+            opts["host"], opts["port"],
+            delay=opts["delay"], fail_next=opts["fail_next"], fail_status=opts["fail_status"],
+        )
+        host, port = server.server_address[:2]
+        self.stdout.write(self.style.SUCCESS(f"Stub LLM at http://{host}:{port}/v1"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
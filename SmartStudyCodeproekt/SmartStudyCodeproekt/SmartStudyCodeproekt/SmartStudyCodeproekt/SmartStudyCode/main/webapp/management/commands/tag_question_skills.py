@@ -0,0 +1,25 @@
+# webapp/management/commands/tag_question_skills.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from webapp.skills import backfill_skills
+
+
+class Command(BaseCommand):
+    help = (
+        "Размечает навыки у существующих вопросов (тесты учителей и банк адаптивных тестов). "
+        "Новые вопросы размечаются при записи; команда нужна после деплоя и после правки правил в webapp/skills.py (--force)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--force", action="store_true", help="Переразметить все вопросы, а не только неразмеченные")
+
+    def handle(self, *args, **opts):
+        started = time.perf_counter()
+        questions, bank = backfill_skills(batch_size=opts["batch_size"], force=opts["force"])
+        self.stdout.write(self.style.SUCCESS(
+            f"Teacher questions tagged: {questions}, bank questions tagged: {bank} "
+            f"({time.perf_counter() - started:.2f}s)"
+        ))
@@ -141,6 +141,15 @@ class TestSchedule(models.Model):
             models.UniqueConstraint(fields=["test", "group"], name="uniq_test_group_schedule")
         ]
 
+class AttemptQuestionSheet(models.Model):
+    # порядок вопросов попытки фиксируется на старте; cursor — сколько из них уже отвечено
+    attempt = models.OneToOneField(Testattempts, on_delete=models.CASCADE, primary_key=True, related_name="sheet")
+    question_ids = models.JSONField(default=list)
+    cursor = models.PositiveIntegerField(default=0)
+    class Meta:
+        db_table = "testattempt_sheets"
+
+
 class AdaptiveQuestion(models.Model):
     topic_code = models.CharField(max_length=64, db_index=True)
     level = models.PositiveSmallIntegerField(db_index=True)
@@ -151,6 +160,14 @@ class AdaptiveQuestion(models.Model):
     option_d = models.CharField(max_length=255)
     correct_option = models.CharField(max_length=1)
     is_active = models.BooleanField(default=True)
+    # ключ и хэш содержимого для import_adaptive_bank (webapp/question_import.py)
+    source_key = models.CharField(max_length=64, blank=True, default="", db_index=True)
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    # заполняет calibrate_adaptive по истории ответов; null — ещё не откалиброван
+    irt_difficulty = models.FloatField(null=True, blank=True)
+    irt_discrimination = models.FloatField(null=True, blank=True)
+    # навык для AIStatHelper (webapp/skills.py); пусто — ещё не размечен
+    skill = models.CharField(max_length=64, blank=True, default="", db_index=True)
     class Meta:
         db_table = "adaptive_questions"
         indexes = [
@@ -168,6 +185,11 @@ class AdaptiveAttempt(models.Model):
     score_percent = models.PositiveSmallIntegerField(default=0)
     class Meta:
         db_table = "adaptive_attempts"
+        indexes = [
+            # история попыток с курсором (webapp/services.py)
+            models.Index(fields=["-finished_at", "-id"]),
+            models.Index(fields=["user", "-finished_at", "-id"]),
+        ]
 
 
 class AdaptiveAttemptAnswer(models.Model):
@@ -181,6 +203,67 @@ class AdaptiveAttemptAnswer(models.Model):
         unique_together = (("attempt", "question"),)
 
 
+class AdaptiveQuestionStats(models.Model):
+    # накопленные суммы для калибровки: x — верный ответ (0/1), y — доля верных в остальных вопросах попытки
+    question = models.OneToOneField(AdaptiveQuestion, on_delete=models.CASCADE, primary_key=True, related_name="stats")
+    answers_count = models.PositiveIntegerField(default=0)
+    correct_count = models.PositiveIntegerField(default=0)
+    sum_rest = models.FloatField(default=0)
+    sum_rest_sq = models.FloatField(default=0)
+    sum_rest_correct = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    class Meta:
+        db_table = "adaptive_question_stats"
+
+
+class AdaptiveCalibrationRun(models.Model):
+    finished_until = models.DateTimeField()
+    answers_processed = models.PositiveIntegerField(default=0)
+    questions_updated = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        db_table = "adaptive_calibration_runs"
+
+
+class QuestionSkill(models.Model):
+    # навык вопроса теста учителя (webapp/skills.py); questions — legacy-таблица, поэтому отдельно
+    question = models.OneToOneField(
+        "Questions", on_delete=models.CASCADE, primary_key=True, related_name="skill_tag",
+    )
+    skill = models.CharField(max_length=64, db_index=True)
+    class Meta:
+        db_table = "question_skills"
+
+
+class SkillTaggingRun(models.Model):
+    # прогон backfill_skills, поменявший разметку; последний id входит в watermark снимка AIStatHelper
+    questions_tagged = models.PositiveIntegerField(default=0)
+    bank_tagged = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    class Meta:
+        db_table = "skill_tagging_runs"
+
+
+class TeacherStatsDaily(models.Model):
+    # свёртка завершённых попыток для teacher_statistics (webapp/stats_rollup.py);
+    # group_id = 0 — попытка вне группы, test_key — "T-<id>" / "B-<code>", как в фильтре страницы
+    teacher = models.ForeignKey("Users", on_delete=models.CASCADE, related_name="+")
+    group_id = models.IntegerField(default=0)
+    test_key = models.CharField(max_length=80)
+    student = models.ForeignKey("Users", on_delete=models.CASCADE, related_name="+")
+    day = models.DateField()
+    attempts_count = models.PositiveIntegerField(default=0)
+    score_sum = models.PositiveIntegerField(default=0)
+    class Meta:
+        db_table = "teacher_stats_daily"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["teacher", "group_id", "test_key", "student", "day"],
+                name="uniq_teacher_stats_daily",
+            )
+        ]
+
+
 class AIStatHelperReport(models.Model):
     student = models.ForeignKey(
         "Users",
@@ -193,6 +276,10 @@ class AIStatHelperReport(models.Model):
 
     snapshot_hash = models.CharField(max_length=64, db_index=True)
 
+    # по чему строился снимок (webapp/ai_stat_helper.py): пока watermark тот же — снимок не пересобираем
+    watermark = models.CharField(max_length=128, blank=True, default="")
+    snapshot_json = models.JSONField(default=dict)
+
     report_json = models.JSONField(default=dict)
 
     report_text = models.TextField(blank=True, default="")
@@ -201,4 +288,53 @@ class AIStatHelperReport(models.Model):
         indexes = [
             models.Index(fields=["student", "-created_at"]),
             models.Index(fields=["student", "snapshot_hash"]),
-        ]
\ No newline at end of file
+        ]
+
+
+class AIReportJob(models.Model):
+    # очередь генерации отчётов AIStatHelper (webapp/ai_jobs.py), разбирает run_ai_report_worker
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [(QUEUED, "queued"), (RUNNING, "running"), (DONE, "done"), (FAILED, "failed")]
+
+    student = models.ForeignKey("Users", on_delete=models.CASCADE, related_name="ai_report_jobs")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    snapshot_hash = models.CharField(max_length=64)
+    watermark = models.CharField(max_length=128, blank=True, default="")
+    snapshot_json = models.JSONField(default=dict)
+    tries = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    worker = models.CharField(max_length=64, blank=True, default="")
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    report = models.ForeignKey(AIStatHelperReport, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    class Meta:
+        db_table = "ai_report_jobs"
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["student", "-created_at"]),
+        ]
+        constraints = [
+            # у студента не больше одной задачи в работе — повторный «Анализ» её и возвращает
+            models.UniqueConstraint(
+                fields=["student"],
+                condition=models.Q(status__in=["queued", "running"]),
+                name="uniq_active_ai_report_job",
+            )
+        ]
+
+
+class LLMBreakerState(models.Model):
+    # circuit breaker клиента LLM (webapp/llm_client.py): одна строка на провайдера, общая для всех процессов
+    name = models.CharField(max_length=32, primary_key=True)
+    failures = models.PositiveIntegerField(default=0)
+    window_started_at = models.DateTimeField(null=True, blank=True)
+    # open, пока не наступило opened_until; tripped — после cooldown ждём удачную пробу (half_open)
+    opened_until = models.DateTimeField(null=True, blank=True)
+    tripped = models.BooleanField(default=False)
+    probe_until = models.DateTimeField(null=True, blank=True)
+    class Meta:
+        db_table = "llm_breaker_state"
@@ -0,0 +1,160 @@
+# webapp/question_bank.py
+from __future__ import annotations
+
+import random
+import threading
+import time
+from typing import Iterable, NamedTuple
+
+from django.db import transaction
+
+from .cache_utils import bump_version, get_version
+from .models import AdaptiveQuestion
+
+# Версия банка лежит в общем cache: любая правка AdaptiveQuestion её поднимает,
+# и каждый процесс перечитывает свою копию при следующем обращении.
+BANK_VERSION_KEY = "adaptive_bank:version"
+
+# Страховка, если cache не общий между процессами (LocMemCache по умолчанию).
+BANK_TTL_SEC = 5 * 60
+
+# Сколько раз пробуем случайный id, прежде чем фильтровать список целиком.
+_REJECTION_TRIES = 8
+
+
+class BankQuestion(NamedTuple):
+    id: int
+    topic_code: str
+    level: int
+    text: str
+    options: tuple[str, str, str, str]
+    correct_option: str
+    difficulty: float | None = None
+    discrimination: float | None = None
+
+
+class QuestionBank:
+    """
+    Process-local копия активных AdaptiveQuestion, индекс (topic_code, level) -> ids.
+    Выбор вопроса — случайный id с отбрасыванием уже заданных, без запросов в БД.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._by_id: dict[int, BankQuestion] = {}
+        self._by_level: dict[tuple[str, int], list[int]] = {}
+        self._by_topic: dict[str, list[int]] = {}
+        self._version: int | None = None
+        self._loaded_at = 0.0
+        # растёт при каждой перезагрузке — по нему зависимые кэши (irt) понимают, что устарели
+        self.generation = 0
+
+    def _current_version(self) -> int:
+        return get_version(BANK_VERSION_KEY)
+
+    def _ensure_loaded(self) -> None:
+        version = self._current_version()
+        if self._version == version and time.monotonic() - self._loaded_at < BANK_TTL_SEC:
+            return
+
+        with self._lock:
+            if self._version == version and time.monotonic() - self._loaded_at < BANK_TTL_SEC:
+                return
+            self._load(version)
+
+    def _load(self, version: int) -> None:
+        rows = (
+            AdaptiveQuestion.objects
+            .filter(is_active=True)
+            .order_by("id")
+            .values_list(
+                "id", "topic_code", "level", "text",
+                "option_a", "option_b", "option_c", "option_d", "correct_option",
+                "irt_difficulty", "irt_discrimination",
+            )
+        )
+
+        by_id: dict[int, BankQuestion] = {}
+        by_level: dict[tuple[str, int], list[int]] = {}
+        by_topic: dict[str, list[int]] = {}
+
+        for qid, code, level, text, a, b, c, d, correct, irt_b, irt_a in rows.iterator(chunk_size=2000):
+            by_id[qid] = BankQuestion(
+                id=qid,
+                topic_code=code,
+                level=int(level),
+                text=text,
+                options=(a, b, c, d),
+                correct_option=(correct or "").strip().upper(),
+                difficulty=irt_b,
+                discrimination=irt_a,
+            )
+            by_level.setdefault((code, int(level)), []).append(qid)
+            by_topic.setdefault(code, []).append(qid)
+
+        # Подменяем ссылки целиком — читатели без lock видят либо старый, либо новый индекс.
+        self._by_id = by_id
+        self._by_level = by_level
+        self._by_topic = by_topic
+        self._version = version
+        self._loaded_at = time.monotonic()
+        self.generation += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._version = None
+            self._loaded_at = 0.0
+
+    def get(self, qid: int) -> BankQuestion | None:
+        self._ensure_loaded()
+        return self._by_id.get(qid)
+
+    def topic_questions(self, topic_code: str) -> list[BankQuestion]:
+        self._ensure_loaded()
+        by_id = self._by_id
+        return [by_id[qid] for qid in self._by_topic.get(topic_code, ())]
+
+    def pick(self, topic_code: str, level: int, asked_ids: Iterable[int]) -> BankQuestion | None:
+        """
+        Случайный вопрос уровня level, которого нет в asked_ids.
+        Если уровень исчерпан — случайный вопрос из всей темы (как раньше в _pick_question).
+        """
+        self._ensure_loaded()
+        asked = asked_ids if isinstance(asked_ids, (set, frozenset)) else set(asked_ids)
+
+        qid = _sample_without(self._by_level.get((topic_code, level), ()), asked)
+        if qid is None:
+            qid = _sample_without(self._by_topic.get(topic_code, ()), asked)
+        if qid is None:
+            return None
+        return self._by_id.get(qid)
+
+
+def _sample_without(ids, asked: set[int]) -> int | None:
+    if not ids:
+        return None
+
+    # asked_ids короче TEST_LEN, поэтому обычно хватает одной-двух попыток.
+    for _ in range(_REJECTION_TRIES):
+        qid = random.choice(ids)
+        if qid not in asked:
+            return qid
+
+    rest = [x for x in ids if x not in asked]
+    return random.choice(rest) if rest else None
+
+
+question_bank = QuestionBank()
+
+
+def _bump_bank_version() -> None:
+    bump_version(BANK_VERSION_KEY)
+    question_bank.reset()
+
+
+def invalidate_question_bank() -> None:
+    """
+    Поднимает версию банка после коммита: иначе параллельный _ensure_loaded успеет
+    перечитать старые строки и закэшировать их под новой версией.
+    """
+    transaction.on_commit(_bump_bank_version)
@@ -0,0 +1,266 @@
+# webapp/question_import.py
+from __future__ import annotations
+
+import csv
+import hashlib
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable
+
+from django.db import transaction
+
+from .models import AdaptiveQuestion, AdaptiveQuestionStats
+from .question_bank import invalidate_question_bank
+from .skills import infer_skill
+
+OPTIONS = ("A", "B", "C", "D")
+CSV_COLUMNS = ("topic_code", "level", "text", "option_a", "option_b", "option_c", "option_d", "correct_option")
+
+_BATCH = 2000
+
+
+@dataclass
+class ImportReport:
+    created: int = 0
+    updated: int = 0
+    reactivated: int = 0
+    deactivated: int = 0
+    unchanged: int = 0
+    topics: list[str] = field(default_factory=list)
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.created or self.updated or self.reactivated or self.deactivated)
+
+    def __str__(self) -> str:
+        return (
+            f"topics={len(self.topics)} created={self.created} updated={self.updated} "
+            f"reactivated={self.reactivated} deactivated={self.deactivated} unchanged={self.unchanged}"
+        )
+
+
+def _norm_text(text: str) -> str:
+    return " ".join((text or "").split())
+
+
+def source_key(topic_code: str, text: str) -> str:
+    """Ключ вопроса по умолчанию: тема + текст. Поменяли текст — это уже другой вопрос."""
+    raw = f"{topic_code}\n{_norm_text(text)}".encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()
+
+
+def content_hash(item: dict) -> str:
+    raw = json.dumps(
+        [item["topic_code"], item["level"], _norm_text(item["text"]), list(item["options"]), item["correct_option"]],
+        ensure_ascii=False,
+    ).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+def _clean_item(raw: dict, row_no: int) -> dict:
+    topic_code = str(raw.get("topic_code") or "").strip()
+    text = str(raw.get("text") or "").strip()
+    options = raw.get("options")
+    if options is None:
+        options = [raw.get(f"option_{x.lower()}") for x in OPTIONS]
+    options = [str(x or "").strip() for x in options]
+
+    correct = raw.get("correct_option", raw.get("correct"))
+    if isinstance(correct, int) or (isinstance(correct, str) and correct.strip().isdigit()):
+        correct = OPTIONS[int(correct)] if 0 <= int(correct) < 4 else ""
+    correct = str(correct or "").strip().upper()
+
+    try:
+        level = int(raw.get("level") or 0)
+    except (TypeError, ValueError):
+        level = 0
+
+    if not topic_code or not text:
+        raise ValueError(f"Row {row_no}: topic_code and text are required")
+    if len(options) != 4 or any(not x for x in options):
+        raise ValueError(f"Row {row_no}: question must have exactly 4 non-empty options: {text}")
+    if correct not in OPTIONS:
+        raise ValueError(f"Row {row_no}: correct option must be A..D or 0..3: {text}")
+    if level not in (1, 2, 3):
+        raise ValueError(f"Row {row_no}: level must be 1..3: {text}")
+
+    item = {
+        "topic_code": topic_code,
+        "level": level,
+        "text": text,
+        "options": tuple(options),
+        "correct_option": correct,
+    }
+    item["source_key"] = str(raw.get("key") or "").strip() or source_key(topic_code, text)
+    item["content_hash"] = content_hash(item)
+    return item
+
+
+def items_from_seed_data(data: dict) -> list[dict]:
+    """Формат seed_adaptive.DATA: {code: {"levels": {level: [(text, options, correct_i), ...]}}}."""
+    items = []
+    for code, meta in data.items():
+        for level, questions in meta["levels"].items():
+            for q_text, options, correct_i in questions:
+                items.append({
+                    "topic_code": code,
+                    "level": level,
+                    "text": q_text,
+                    "options": options,
+                    "correct": correct_i,
+                })
+    return items
+
+
+def read_bank_file(path: str | Path) -> list[dict]:
+    """JSON (список вопросов или формат DATA) либо CSV с колонками CSV_COLUMNS (+ key)."""
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        with path.open(newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            missing = [c for c in CSV_COLUMNS if c not in (reader.fieldnames or [])]
+            if missing:
+                raise ValueError(f"CSV is missing columns: {', '.join(missing)}")
+            return list(reader)
+
+    with path.open(encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        return items_from_seed_data(data)
+    if isinstance(data, list):
+        return data
+    raise ValueError("JSON must be a list of questions or an object in seed DATA format")
+
+
+def _row_item(row: tuple) -> dict:
+    _id, code, level, text, a, b, c, d, correct, _key, _hash, _active = row
+    return {
+        "topic_code": code,
+        "level": int(level),
+        "text": text,
+        "options": (a, b, c, d),
+        "correct_option": (correct or "").strip().upper(),
+    }
+
+
+def import_questions(
+    raw_items: Iterable[dict],
+    *,
+    deactivate_missing: bool = True,
+    dry_run: bool = False,
+) -> ImportReport:
+    """
+    Синхронизирует AdaptiveQuestion с банком вопросов: новые — bulk_create, изменённые —
+    bulk_update, пропавшие из банка темы — is_active=False. Ничего не удаляет, поэтому
+    история ответов студентов не трогается. Повторный запуск с тем же файлом ничего не меняет.
+    """
+    items: dict[tuple[str, str], dict] = {}
+    for i, raw in enumerate(raw_items, start=1):
+        item = _clean_item(raw, i)
+        items[(item["topic_code"], item["source_key"])] = item
+
+    report = ImportReport(topics=sorted({code for code, _ in items}))
+
+    existing_rows = (
+        AdaptiveQuestion.objects
+        .filter(topic_code__in=report.topics)
+        .order_by("id")
+        .values_list(
+            "id", "topic_code", "level", "text",
+            "option_a", "option_b", "option_c", "option_d", "correct_option",
+            "source_key", "content_hash", "is_active",
+        )
+    )
+
+    existing: dict[tuple[str, str], tuple[int, str, bool, bool]] = {}
+    to_deactivate: list[int] = []
+    for row in existing_rows.iterator(chunk_size=_BATCH):
+        qid, code, text = row[0], row[1], row[3]
+        key = row[9] or source_key(code, text)
+        stored_hash = row[10] or content_hash(_row_item(row))
+        if (code, key) in existing:
+            # дубликаты старого seed — оставляем первый, остальные выключаем
+            if row[11]:
+                to_deactivate.append(qid)
+            continue
+        # строки старого seed без key/hash — дописываем их, даже если содержимое не менялось
+        needs_backfill = not (row[9] and row[10])
+        existing[(code, key)] = (qid, stored_hash, bool(row[11]), needs_backfill)
+
+    to_create: list[AdaptiveQuestion] = []
+    to_update: list[AdaptiveQuestion] = []
+    to_backfill: list[AdaptiveQuestion] = []
+    to_reactivate: list[int] = []
+    for k, item in items.items():
+        found = existing.get(k)
+        if found is not None and found[1] == item["content_hash"]:
+            qid, _, was_active, needs_backfill = found
+            if was_active:
+                report.unchanged += 1
+            else:
+                to_reactivate.append(qid)
+            if needs_backfill:
+                to_backfill.append(AdaptiveQuestion(
+                    id=qid, source_key=item["source_key"], content_hash=item["content_hash"],
+                ))
+            continue
+
+        obj = AdaptiveQuestion(
+            topic_code=item["topic_code"],
+            level=item["level"],
+            text=item["text"],
+            option_a=item["options"][0],
+            option_b=item["options"][1],
+            option_c=item["options"][2],
+            option_d=item["options"][3],
+            correct_option=item["correct_option"],
+            is_active=True,
+            source_key=item["source_key"],
+            content_hash=item["content_hash"],
+            skill=infer_skill(item["text"]),
+        )
+        if found is None:
+            to_create.append(obj)
+        else:
+            # после правки содержимого старая калибровка уже не про этот вопрос
+            obj.id = found[0]
+            obj.irt_difficulty = None
+            obj.irt_discrimination = None
+            to_update.append(obj)
+
+    if deactivate_missing:
+        to_deactivate.extend(
+            qid for k, (qid, _, active, _) in existing.items() if active and k not in items
+        )
+
+    report.created = len(to_create)
+    report.updated = len(to_update)
+    report.reactivated = len(to_reactivate)
+    report.deactivated = len(to_deactivate)
+
+    if dry_run:
+        return report
+
+    with transaction.atomic():
+        AdaptiveQuestion.objects.bulk_create(to_create, batch_size=_BATCH)
+        AdaptiveQuestion.objects.bulk_update(
+            to_update,
+            [
+                "level", "text", "option_a", "option_b", "option_c", "option_d", "correct_option",
+                "is_active", "source_key", "content_hash", "irt_difficulty", "irt_discrimination", "skill",
+            ],
+            batch_size=500,
+        )
+        AdaptiveQuestion.objects.bulk_update(to_backfill, ["source_key", "content_hash"], batch_size=500)
+        # иначе calibrate_adaptive продолжит старые суммы и вернёт вопросу прежнюю калибровку
+        updated_ids = [obj.id for obj in to_update]
+        for start in range(0, len(updated_ids), _BATCH):
+            AdaptiveQuestionStats.objects.filter(question_id__in=updated_ids[start:start + _BATCH]).delete()
+        for ids, active in ((to_reactivate, True), (to_deactivate, False)):
+            for start in range(0, len(ids), _BATCH):
+                AdaptiveQuestion.objects.filter(id__in=ids[start:start + _BATCH]).update(is_active=active)
+
+    if report.changed:
+        invalidate_question_bank()
+    return report
@@ -0,0 +1,92 @@
+# webapp/report_cache.py
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Callable
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .cache_utils import counter_stats, incr
+
+# Общие для студентов отчёты AIStatHelper. В LLM уходит не снимок студента, а его «профиль»:
+# без имени, с числами, округлёнными до корзин. У студентов с похожими слабыми темами профиль
+# совпадает, и отчёт генерируется один раз; имя подставляется уже после генерации.
+# Хранится в cache: TTL продлевается при каждом попадании (cache.touch), поэтому первыми
+# истекают давно не запрошенные профили; при переполнении backend вытесняет по LRU
+# (LocMemCache — MAX_ENTRIES, Redis — maxmemory-policy allkeys-lru).
+
+# поднять при изменении корзин или промпта — старые записи перестанут находиться
+PROFILE_VERSION = 1
+
+_ENTRY_KEY = "ai_report:{version}:{digest}"
+_HITS_KEY = "ai_report:hits"
+_MISSES_KEY = "ai_report:misses"
+
+# число ответов/попыток -> нижняя граница корзины
+_COUNT_BUCKETS = (0, 1, 3, 5, 10, 20, 50, 100, 200, 500)
+# доля ошибок, % -> шаг корзины
+_RATE_STEP = 10
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "AI_REPORT_CACHE_TTL_SEC", 7 * 24 * 60 * 60))
+
+
+def _bucket(n: int) -> int:
+    return max(b for b in _COUNT_BUCKETS if b <= max(int(n), 0))
+
+
+def report_profile(snapshot: dict) -> dict:
+    """Обезличенный, округлённый вид снимка: то, от чего на самом деле зависит отчёт."""
+    stats = snapshot.get("stats") or {}
+    return {
+        "teacher_python_attempts": _bucket(stats.get("teacher_python_attempts") or 0),
+        "basic_python_attempts": _bucket(stats.get("basic_python_attempts") or 0),
+        # порядок тем сохраняется: он задаёт приоритеты в плане
+        "weak_skills": [
+            {
+                "skill": s.get("skill"),
+                "answers": _bucket(s.get("total") or 0),
+                "wrong_rate": int(float(s.get("wrong_rate") or 0) // _RATE_STEP * _RATE_STEP),
+            }
+            for s in snapshot.get("weak_skills") or []
+        ],
+    }
+
+
+def _entry_key(profile: dict, model: str) -> str:
+    raw = json.dumps({"model": model, "profile": profile}, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return _ENTRY_KEY.format(version=PROFILE_VERSION, digest=hashlib.sha256(raw).hexdigest())
+
+
+def cached_report(profile: dict, model: str) -> dict | None:
+    """Отчёт по профилю из cache (попадание продлевает TTL); счётчики hit/miss — здесь."""
+    key = _entry_key(profile, model)
+    report = cache.get(key)
+    if report is None:
+        incr(_MISSES_KEY)
+        return None
+    incr(_HITS_KEY)
+    cache.touch(key, _ttl())
+    return report
+
+
+def store_report(profile: dict, model: str, report: dict) -> None:
+    cache.set(_entry_key(profile, model), report, timeout=_ttl())
+
+
+def get_shared_report(profile: dict, model: str, build: Callable[[], dict | None]) -> dict | None:
+    """Отчёт по профилю из cache или build() — запрос к LLM; None (неразобранный ответ) не кэшируется."""
+    report = cached_report(profile, model)
+    if report is not None:
+        return report
+    report = build()
+    if report is not None:
+        store_report(profile, model, report)
+    return report
+
+
+def report_cache_counters() -> dict:
+    return counter_stats(_HITS_KEY, _MISSES_KEY)
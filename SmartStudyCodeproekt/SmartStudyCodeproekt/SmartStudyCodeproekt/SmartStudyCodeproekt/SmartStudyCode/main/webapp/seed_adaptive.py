@@ -1,8 +1,5 @@
 # webapp/seed_adaptive_en.py
-from django.db import transaction
-from webapp.models import AdaptiveQuestion
-
-IDX_TO_OPT = {0: "A", 1: "B", 2: "C", 3: "D"}
+from webapp.question_import import import_questions, items_from_seed_data
 
 DATA = {
   "python-basics": {
@@ -151,36 +148,10 @@ DATA = {
 }
 
 def seed_adaptive(clear_existing: bool = True) -> None:
-    topic_codes = list(DATA.keys())
-
-    if clear_existing:
-        deleted, _ = AdaptiveQuestion.objects.filter(topic_code__in=topic_codes).delete()
-        print(f"🧹 Deleted old adaptive questions (and related rows): {deleted}")
-
-    created = 0
-    with transaction.atomic():
-        for code, meta in DATA.items():
-            for level, questions in meta["levels"].items():
-                for q_text, options, correct_i in questions:
-                    if len(options) != 4:
-                        raise ValueError(f"Question must have exactly 4 options: {q_text}")
-                    if correct_i not in (0, 1, 2, 3):
-                        raise ValueError(f"correct_i must be 0..3: {q_text}")
-
-                    AdaptiveQuestion.objects.create(
-                        topic_code=code,
-                        level=int(level),
-                        text=q_text,
-                        option_a=options[0],
-                        option_b=options[1],
-                        option_c=options[2],
-                        option_d=options[3],
-                        correct_option=IDX_TO_OPT[correct_i],
-                        is_active=True,
-                    )
-                    created += 1
-
-    print(f"✅ Seed done! Added questions: {created}")
+    # clear_existing: вопросы тем из DATA, которых нет в DATA, выключаются (is_active=False).
+    # Ничего не удаляется — история ответов студентов сохраняется.
+    report = import_questions(items_from_seed_data(DATA), deactivate_missing=clear_existing)
+    print(f"✅ Seed done! {report}")
 
 if __name__ == "__main__":
     seed_adaptive(clear_existing=True)
\ No newline at end of file
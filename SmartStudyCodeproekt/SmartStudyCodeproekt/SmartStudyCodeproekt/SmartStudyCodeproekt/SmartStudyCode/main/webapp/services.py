@@ -0,0 +1,232 @@
+# webapp/services.py
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import (
+    Case, CharField, Count, F, IntegerField, Max, OuterRef, Q, QuerySet, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce
+
+from .models import AdaptiveAttempt, StudentsGroups, Testattempts
+
+# История попыток: тесты учителя и базовые (адаптивные) одним UNION ALL с общим набором колонок.
+# Сортировка и курсор — (finished_at, kind, id) по убыванию; страница — один запрос.
+# Используется на teacher_statistics, student_progress и teacher_student_profile.
+
+HISTORY_PAGE_SIZE = 30
+
+TEACHER = "teacher"
+BASIC = "basic"
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_COLUMNS = ("kind", "row_id", "done_at", "score_value", "title", "topic", "author", "student_ref", "student_name", "group_name")
+
+
+@dataclass
+class HistoryPage:
+    items: list[dict] = field(default_factory=list)
+    next_cursor: str | None = None
+
+
+def encode_cursor(done_at: datetime, kind: str, row_id: int) -> str:
+    if done_at.tzinfo is None:
+        done_at = done_at.replace(tzinfo=dt_timezone.utc)
+    micros = (done_at - _EPOCH) // timedelta(microseconds=1)
+    return f"{micros}.{kind}.{row_id}"
+
+
+def decode_cursor(raw: str | None) -> tuple[datetime, str, int] | None:
+    """Битый курсор — просто первая страница."""
+    try:
+        micros, kind, row_id = (raw or "").split(".")
+        if kind not in (TEACHER, BASIC):
+            return None
+        return _EPOCH + timedelta(microseconds=int(micros)), kind, int(row_id)
+    except ValueError:
+        return None
+
+
+def _after_cursor(kind: str, cursor: tuple[datetime, str, int] | None) -> Q:
+    """
+    (finished_at, kind, id) < cursor для ветки с постоянным kind — условие только
+    по (finished_at, id), его закрывает индекс.
+    """
+    if cursor is None:
+        return Q()
+    done_at, cur_kind, row_id = cursor
+    if kind < cur_kind:
+        return Q(finished_at__lte=done_at)
+    if kind > cur_kind:
+        return Q(finished_at__lt=done_at)
+    return Q(finished_at__lt=done_at) | Q(finished_at=done_at, id__lt=row_id)
+
+
+def teacher_test_attempts(teacher_id: int, *, group_id: int | None = None, student_id: int | None = None,
+                          test_id: int | None = None) -> QuerySet:
+    """Попытки тестов учителя: его группы или его тесты — как на странице статистики."""
+    qs = Testattempts.objects.filter(Q(schedule__group__teacher_id=teacher_id) | Q(test__created_by_id=teacher_id))
+    if group_id is not None:
+        qs = qs.filter(schedule__group_id=group_id)
+    if student_id is not None:
+        qs = qs.filter(user_id=student_id)
+    if test_id is not None:
+        qs = qs.filter(test_id=test_id)
+    return qs
+
+
+def _teacher_links(teacher_id: int, group_id: int | None = None) -> QuerySet:
+    links = StudentsGroups.objects.filter(group__teacher_id=teacher_id)
+    if group_id is not None:
+        links = links.filter(group_id=group_id)
+    return links
+
+
+def teacher_basic_attempts(teacher_id: int, *, group_id: int | None = None, student_id: int | None = None,
+                           topic_code: str | None = None) -> QuerySet:
+    """Базовые попытки студентов из групп учителя."""
+    # членство — подзапросом: студент может состоять в двух группах учителя, JOIN задвоил бы попытки
+    qs = AdaptiveAttempt.objects.filter(
+        user__role="student", user_id__in=_teacher_links(teacher_id, group_id).values("student_id"),
+    )
+    if student_id is not None:
+        qs = qs.filter(user_id=student_id)
+    if topic_code is not None:
+        qs = qs.filter(topic_code=topic_code)
+    return qs
+
+
+def teacher_group_name(teacher_id: int, group_id: int | None = None) -> Subquery:
+    """Группа студента у этого учителя (первая по id) — одна строка на попытку."""
+    links = _teacher_links(teacher_id, group_id).filter(student_id=OuterRef("user_id")).order_by("group_id")
+    return Subquery(links.values("group__name")[:1], output_field=CharField())
+
+
+def _teacher_score():
+    """score; для старых попыток без него — процент из correct/total (половина вверх)."""
+    return Coalesce(
+        F("score"),
+        Case(
+            When(
+                total_questions__gt=0,
+                then=(F("correct_answers") * 200 + F("total_questions")) / (F("total_questions") * 2),
+            ),
+            default=Value(0),
+        ),
+        output_field=IntegerField(),
+    )
+
+
+def _teacher_rows(qs: QuerySet, cursor) -> QuerySet:
+    return (
+        qs.filter(finished_at__isnull=False)
+        .filter(_after_cursor(TEACHER, cursor))
+        .annotate(
+            kind=Value(TEACHER, output_field=CharField()),
+            row_id=F("id"),
+            done_at=F("finished_at"),
+            score_value=_teacher_score(),
+            title=F("test__title"),
+            topic=F("test__topic__name"),
+            author=F("test__created_by__username"),
+            student_ref=F("user_id"),
+            student_name=F("user__username"),
+            group_name=F("schedule__group__name"),
+        )
+        .values_list(*_COLUMNS)
+    )
+
+
+def _basic_rows(qs: QuerySet, cursor, *, group_name=None) -> QuerySet:
+    if group_name is None:
+        group_name = Value(None, output_field=CharField())
+    return (
+        qs.filter(finished_at__isnull=False)
+        .filter(_after_cursor(BASIC, cursor))
+        .annotate(
+            kind=Value(BASIC, output_field=CharField()),
+            row_id=F("id"),
+            done_at=F("finished_at"),
+            score_value=F("score_percent"),
+            title=F("topic_code"),
+            topic=F("topic_code"),
+            author=Value("System", output_field=CharField()),
+            student_ref=F("user_id"),
+            student_name=F("user__username"),
+            group_name=group_name,
+        )
+        .values_list(*_COLUMNS)
+    )
+
+
+def teacher_history(
+    teacher_id: int,
+    *,
+    group_id: int | None = None,
+    student_id: int | None = None,
+    test_key: str | None = None,
+    cursor: str | None = None,
+    limit: int = HISTORY_PAGE_SIZE,
+) -> HistoryPage:
+    """
+    Страница истории для teacher_statistics. test_key — "T-<id>" / "B-<code>" (фильтр страницы).
+    Возвращает limit строк и курсор следующей страницы.
+    """
+    after = decode_cursor(cursor)
+    test_id = int(test_key[2:]) if test_key and test_key.startswith("T-") else None
+    topic_code = test_key[2:] if test_key and test_key.startswith("B-") else None
+
+    branches = []
+    if topic_code is None:
+        branches.append(_teacher_rows(
+            teacher_test_attempts(teacher_id, group_id=group_id, student_id=student_id, test_id=test_id), after,
+        ))
+    if test_id is None:
+        branches.append(_basic_rows(
+            teacher_basic_attempts(teacher_id, group_id=group_id, student_id=student_id, topic_code=topic_code),
+            after, group_name=teacher_group_name(teacher_id, group_id),
+        ))
+
+    return _page(branches, limit)
+
+
+def _page(branches: list[QuerySet], limit: int) -> HistoryPage:
+    qs = branches[0] if len(branches) == 1 else branches[0].union(*branches[1:], all=True)
+    rows = list(qs.order_by("-done_at", "-kind", "-row_id")[:limit + 1])
+
+    page = HistoryPage(items=[dict(zip(_COLUMNS, row)) for row in rows[:limit]])
+    if len(rows) > limit:
+        last = page.items[-1]
+        page.next_cursor = encode_cursor(last["done_at"], last["kind"], last["row_id"])
+    return page
+
+
+def student_history(student_id: int, *, cursor: str | None = None, limit: int = HISTORY_PAGE_SIZE) -> HistoryPage:
+    """Все завершённые попытки студента, страница — один запрос."""
+    after = decode_cursor(cursor)
+    return _page([
+        _teacher_rows(Testattempts.objects.filter(user_id=student_id), after),
+        _basic_rows(AdaptiveAttempt.objects.filter(user_id=student_id), after),
+    ], limit)
+
+
+def student_summary(student_id: int) -> dict:
+    """Число попыток, средний и лучший балл — два агрегата в SQL, без выгрузки истории."""
+    aggregates = (
+        Testattempts.objects
+        .filter(user_id=student_id, finished_at__isnull=False)
+        .annotate(score_value=_teacher_score())
+        .aggregate(n=Count("id"), total=Sum("score_value"), best=Max("score_value")),
+        AdaptiveAttempt.objects
+        .filter(user_id=student_id, finished_at__isnull=False)
+        .aggregate(n=Count("id"), total=Sum("score_percent"), best=Max("score_percent")),
+    )
+    attempts = sum(a["n"] for a in aggregates)
+    score_sum = sum(int(a["total"] or 0) for a in aggregates)
+    bests = [int(a["best"]) for a in aggregates if a["best"] is not None]
+    return {
+        "total_attempts": attempts,
+        "avg_score": round(score_sum / attempts, 1) if attempts else 0,
+        "best_score": max(bests) if bests else 0,
+    }
@@ -0,0 +1,27 @@
+# webapp/signals.py
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import AdaptiveQuestion, Questions
+from .question_bank import invalidate_question_bank
+from .skills import infer_skill, tag_questions
+
+
+@receiver(post_save, sender=AdaptiveQuestion)
+@receiver(post_delete, sender=AdaptiveQuestion)
+def adaptive_question_changed(sender, **kwargs) -> None:
+    invalidate_question_bank()
+
+
+@receiver(pre_save, sender=AdaptiveQuestion)
+def adaptive_question_skill(sender, instance: AdaptiveQuestion, **kwargs) -> None:
+    # bulk-импорт банка ставит skill сам (webapp/question_import.py)
+    instance.skill = infer_skill(instance.text)
+
+
+@receiver(post_save, sender=Questions)
+def question_saved(sender, instance: Questions, **kwargs) -> None:
+    # создание и правка вопроса во views; bulk-импорт размечает сам (webapp/teacher_question_import.py)
+    update_fields = kwargs.get("update_fields")
+    if update_fields is None or "question_text" in update_fields:
+        tag_questions([(instance.id, instance.question_text)])
@@ -0,0 +1,96 @@
+# webapp/skills.py
+from __future__ import annotations
+
+import re
+from collections import defaultdict
+from typing import Iterable
+
+from django.db import transaction
+
+from .models import AdaptiveQuestion, Questions, QuestionSkill, SkillTaggingRun
+
+# Навык (тема Python) вопроса — простая эвристика по ключевым словам. Считается один раз при
+# записи вопроса: Questions — строка в question_skills, AdaptiveQuestion — поле skill.
+# Снимок AIStatHelper потом группирует ответы по готовому навыку в SQL.
+
+OTHER_SKILL = "Другое"
+
+_SKILL_RULES: list[tuple[str, list[str]]] = [
+    ("Переменные и типы данных", ["variable", "переменн", "type", "тип", "int", "float", "str", "bool", "cast", "преобраз"]),
+    ("Операторы и выражения", ["оператор", "operator", "арифмет", "+", "-", "*", "/", "//", "%", "**", "and", "or", "not"]),
+    ("Условия if/elif/else", ["if", "elif", "else", "услови", "condition", "сравнен", "==", "!=", ">=", "<="]),
+    ("Циклы for/while", ["for", "while", "loop", "цикл", "range", "итерац"]),
+    ("Строки", ["string", "строк", "split", "join", "replace", "strip", "format", "f-string", "find"]),
+    ("Списки и индексация", ["list", "спис", "index", "индекс", "append", "pop", "slice", "срез"]),
+    ("Словари и множества", ["dict", "словар", "set", "множ", "key", "value", "items", "get("]),
+    ("Функции", ["def ", "return", "function", "функц", "аргумент", "параметр"]),
+    ("Исключения", ["try", "except", "finally", "raise", "ошибк", "exception"]),
+    ("Файлы", ["open(", "file", "файл", "read(", "write(", "with open"]),
+    ("Ввод/вывод", ["print", "input("]),
+]
+
+_BATCH = 1000
+
+
+def infer_skill(question_text: str | None) -> str:
+    text = (question_text or "").strip().lower()
+    if not text:
+        return OTHER_SKILL
+    text = re.sub(r"\s+", " ", text)
+    for skill, keys in _SKILL_RULES:
+        for k in keys:
+            if k in text:
+                return skill
+    return OTHER_SKILL
+
+
+def tag_questions(questions: Iterable[tuple[int, str]]) -> int:
+    """(question_id, question_text) -> upsert в question_skills пачками; возвращает число строк."""
+    rows = [QuestionSkill(question_id=qid, skill=infer_skill(text)) for qid, text in questions]
+    QuestionSkill.objects.bulk_create(
+        rows,
+        batch_size=_BATCH,
+        update_conflicts=True,
+        unique_fields=["question"],
+        update_fields=["skill"],
+    )
+    return len(rows)
+
+
+def backfill_skills(*, batch_size: int = _BATCH, force: bool = False) -> tuple[int, int]:
+    """
+    Размечает уже существующие вопросы: (вопросов учителей, вопросов банка).
+    Без force — только неразмеченные. Пачки по id, на пачку — один upsert или UPDATE на каждый навык.
+    """
+    questions = Questions.objects.all() if force else Questions.objects.filter(skill_tag__isnull=True)
+    tagged = 0
+    last_id = 0
+    while True:
+        batch = list(
+            questions.filter(id__gt=last_id).order_by("id").values_list("id", "question_text")[:batch_size]
+        )
+        if not batch:
+            break
+        tagged += tag_questions(batch)
+        last_id = batch[-1][0]
+
+    bank = AdaptiveQuestion.objects.all() if force else AdaptiveQuestion.objects.filter(skill="")
+    updated = 0
+    last_id = 0
+    while True:
+        batch = list(bank.filter(id__gt=last_id).order_by("id").values_list("id", "text")[:batch_size])
+        if not batch:
+            break
+        by_skill: dict[str, list[int]] = defaultdict(list)
+        for qid, text in batch:
+            by_skill[infer_skill(text)].append(qid)
+        with transaction.atomic():
+            for skill, ids in by_skill.items():
+                AdaptiveQuestion.objects.filter(id__in=ids).update(skill=skill)
+        updated += len(batch)
+        last_id = batch[-1][0]
+
+    if tagged or updated:
+        # навыки уже отвеченных вопросов могли поменяться — снимки AIStatHelper надо пересобрать
+        SkillTaggingRun.objects.create(questions_tagged=tagged, bank_tagged=updated)
+    return tagged, updated
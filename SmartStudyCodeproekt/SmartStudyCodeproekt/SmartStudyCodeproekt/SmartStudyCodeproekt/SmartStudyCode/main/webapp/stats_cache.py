@@ -0,0 +1,56 @@
+# webapp/stats_cache.py
+from __future__ import annotations
+
+from typing import Callable, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .cache_utils import bump_version, counter_stats, get_version, incr
+
+# Посчитанные карточки и первая страница истории teacher_statistics — в cache по учителю
+# и набору фильтров (stats_test, stats_group, stats_student). У каждого учителя своя версия:
+# закрытие попытки или перевод студента поднимает версию только затронутых учителей.
+_VERSION_KEY = "teacher_stats:ver:{teacher_id}"
+_ENTRY_KEY = "teacher_stats:{teacher_id}:{version}:{test}:{group}:{student}"
+_HITS_KEY = "teacher_stats:hits"
+_MISSES_KEY = "teacher_stats:misses"
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "TEACHER_STATS_CACHE_TTL_SEC", 10 * 60))
+
+
+def get_teacher_stats(teacher_id: int, filters: tuple[str, str, str], build: Callable[[], dict]) -> dict:
+    """filters — (test, group, student) в том виде, в каком они лежат в session."""
+    version = get_version(_VERSION_KEY.format(teacher_id=teacher_id))
+    test, group, student = (str(x) for x in filters)
+    key = _ENTRY_KEY.format(teacher_id=teacher_id, version=version, test=test, group=group, student=student)
+
+    data = cache.get(key)
+    if data is not None:
+        incr(_HITS_KEY)
+        return data
+
+    incr(_MISSES_KEY)
+    data = build()
+    cache.set(key, data, timeout=_ttl())
+    return data
+
+
+def invalidate_teacher_stats(teacher_ids: Iterable[int]) -> None:
+    """После коммита: иначе параллельный запрос успеет положить в cache данные до изменения."""
+    teacher_ids = sorted(set(teacher_ids))
+    if not teacher_ids:
+        return
+
+    def bump() -> None:
+        for teacher_id in teacher_ids:
+            bump_version(_VERSION_KEY.format(teacher_id=teacher_id))
+
+    transaction.on_commit(bump)
+
+
+def cache_counters() -> dict:
+    return counter_stats(_HITS_KEY, _MISSES_KEY)
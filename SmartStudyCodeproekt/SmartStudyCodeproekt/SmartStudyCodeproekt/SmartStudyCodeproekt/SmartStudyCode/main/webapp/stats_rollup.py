@@ -0,0 +1,250 @@
+# webapp/stats_rollup.py
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Iterable
+
+from django.db import connection, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncWeek
+from django.utils import timezone
+
+from .item_analysis import invalidate_item_analysis
+from .models import AdaptiveAttempt, StudentsGroups, TeacherStatsDaily, Testattempts
+from .stats_cache import invalidate_teacher_stats
+
+# teacher_statistics читает не попытки, а строки TeacherStatsDaily:
+# (teacher, group, test_key, student, day) -> attempts_count, score_sum.
+#
+# Строки пополняются в той же транзакции, что закрывает попытку (UPDATE ... WHERE finished_at IS NULL
+# срабатывает ровно один раз), поэтому простое прибавление не задваивает попытки.
+# rebuild_stats_rollup пересчитывает всё с нуля.
+
+Key = tuple[int, int, str, int, date]
+
+_BATCH = 1000
+
+
+def teacher_test_key(test_id: int) -> str:
+    return f"T-{test_id}"
+
+
+def basic_test_key(topic_code: str) -> str:
+    return f"B-{topic_code}"
+
+
+def _day(dt: datetime) -> date:
+    return timezone.localdate(dt) if timezone.is_aware(dt) else dt.date()
+
+
+def _add(deltas: dict, key: Key, score) -> None:
+    n, s = deltas.get(key, (0, 0))
+    deltas[key] = (n + 1, s + int(score or 0))
+
+
+def teacher_attempt_deltas(attempt_ids: Iterable[int]) -> dict[Key, tuple[int, int]]:
+    """Попытка идёт в статистику автора теста и учителя группы, которой тест назначен."""
+    rows = (
+        Testattempts.objects
+        .filter(id__in=list(attempt_ids), finished_at__isnull=False)
+        .values_list(
+            "user_id", "test_id", "test__created_by_id",
+            "schedule__group_id", "schedule__group__teacher_id",
+            "finished_at", "score",
+        )
+    )
+    deltas: dict[Key, tuple[int, int]] = {}
+    for student_id, test_id, author_id, group_id, group_teacher_id, finished_at, score in rows:
+        for teacher_id in {author_id, group_teacher_id} - {None}:
+            _add(deltas, (teacher_id, group_id or 0, teacher_test_key(test_id), student_id, _day(finished_at)), score)
+    return deltas
+
+
+def _memberships(student_ids: Iterable[int], teacher_id: int | None = None) -> dict[int, list[tuple[int, int]]]:
+    links = StudentsGroups.objects.filter(student_id__in=list(student_ids))
+    if teacher_id is not None:
+        links = links.filter(group__teacher_id=teacher_id)
+    out: dict[int, list[tuple[int, int]]] = defaultdict(list)
+    for student_id, group_id, teacher in links.values_list("student_id", "group_id", "group__teacher_id"):
+        out[student_id].append((teacher, group_id))
+    return out
+
+
+def adaptive_attempt_deltas(attempts: Iterable[tuple], teacher_id: int | None = None) -> dict[Key, tuple[int, int]]:
+    """attempts — (user_id, topic_code, finished_at, score_percent); попытка идёт учителям групп студента."""
+    attempts = list(attempts)
+    groups = _memberships({a[0] for a in attempts}, teacher_id)
+    deltas: dict[Key, tuple[int, int]] = {}
+    for student_id, topic_code, finished_at, score in attempts:
+        for teacher, group_id in groups.get(student_id, ()):
+            _add(deltas, (teacher, group_id, basic_test_key(topic_code), student_id, _day(finished_at)), score)
+    return deltas
+
+
+def apply_deltas(deltas: dict[Key, tuple[int, int]]) -> None:
+    """INSERT ... ON CONFLICT DO UPDATE с прибавлением — один запрос на пачку ключей."""
+    if not deltas:
+        return
+    invalidate_teacher_stats(key[0] for key in deltas)
+    table = TeacherStatsDaily._meta.db_table
+    items = list(deltas.items())
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), _BATCH):
+            chunk = items[start:start + _BATCH]
+            values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+            params = []
+            for (teacher_id, group_id, test_key, student_id, day), (n, s) in chunk:
+                params += [
+                    teacher_id, group_id, test_key, student_id,
+                    connection.ops.adapt_datefield_value(day), n, s,
+                ]
+            cursor.execute(
+                f"""
+                INSERT INTO {table} (teacher_id, group_id, test_key, student_id, day, attempts_count, score_sum)
+                VALUES {values}
+                ON CONFLICT (teacher_id, group_id, test_key, student_id, day) DO UPDATE SET
+                    attempts_count = {table}.attempts_count + EXCLUDED.attempts_count,
+                    score_sum = {table}.score_sum + EXCLUDED.score_sum
+                """,
+                params,
+            )
+
+
+def record_teacher_attempts(attempt_ids: Iterable[int]) -> None:
+    """Вызывать в транзакции, которая закрыла попытки."""
+    deltas = teacher_attempt_deltas(attempt_ids)
+    apply_deltas(deltas)
+    invalidate_item_analysis({int(key[2][2:]) for key in deltas})
+
+
+def record_adaptive_attempts(attempt_ids: Iterable[int]) -> None:
+    rows = (
+        AdaptiveAttempt.objects
+        .filter(id__in=list(attempt_ids), finished_at__isnull=False)
+        .values_list("user_id", "topic_code", "finished_at", "score_percent")
+    )
+    apply_deltas(adaptive_attempt_deltas(rows))
+
+
+def refresh_basic_rollup(teacher_id: int, student_ids: Iterable[int]) -> None:
+    """
+    После перевода студентов между группами: базовые тесты считаются по текущей группе,
+    поэтому их строки у этого учителя пересобираются из истории студентов.
+    """
+    student_ids = list(student_ids)
+    if not student_ids:
+        return
+    invalidate_teacher_stats([teacher_id])
+    with transaction.atomic():
+        TeacherStatsDaily.objects.filter(
+            teacher_id=teacher_id,
+            student_id__in=student_ids,
+            test_key__startswith="B-",
+        ).delete()
+        rows = (
+            AdaptiveAttempt.objects
+            .filter(user_id__in=student_ids, finished_at__isnull=False)
+            .values_list("user_id", "topic_code", "finished_at", "score_percent")
+        )
+        apply_deltas(adaptive_attempt_deltas(rows, teacher_id=teacher_id))
+
+
+def rebuild_all(chunk_size: int = 5000) -> int:
+    """Пересчёт с нуля по всей истории; возвращает число учтённых попыток."""
+    processed = 0
+    with transaction.atomic():
+        # учителя, у которых строки пропадут совсем, тоже должны сбросить cache
+        invalidate_teacher_stats(TeacherStatsDaily.objects.values_list("teacher_id", flat=True).distinct())
+        TeacherStatsDaily.objects.all().delete()
+
+        ids = (
+            Testattempts.objects
+            .filter(finished_at__isnull=False)
+            .order_by("id")
+            .values_list("id", flat=True)
+            .iterator(chunk_size=chunk_size)
+        )
+        chunk: list[int] = []
+        for attempt_id in ids:
+            chunk.append(attempt_id)
+            if len(chunk) >= chunk_size:
+                record_teacher_attempts(chunk)
+                processed += len(chunk)
+                chunk = []
+        if chunk:
+            record_teacher_attempts(chunk)
+            processed += len(chunk)
+
+        rows = (
+            AdaptiveAttempt.objects
+            .filter(finished_at__isnull=False)
+            .order_by("id")
+            .values_list("user_id", "topic_code", "finished_at", "score_percent")
+            .iterator(chunk_size=chunk_size)
+        )
+        batch: list[tuple] = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                apply_deltas(adaptive_attempt_deltas(batch))
+                processed += len(batch)
+                batch = []
+        if batch:
+            apply_deltas(adaptive_attempt_deltas(batch))
+            processed += len(batch)
+    return processed
+
+
+def _daily_rows(teacher_id: int, group_id: int | None, student_id: int | None, test_key: str | None):
+    rows = TeacherStatsDaily.objects.filter(teacher_id=teacher_id)
+    if group_id is not None:
+        rows = rows.filter(group_id=group_id)
+    if student_id is not None:
+        rows = rows.filter(student_id=student_id)
+    if test_key is not None:
+        rows = rows.filter(test_key=test_key)
+    return rows
+
+
+def teacher_summary(teacher_id: int, *, group_id: int | None = None, student_id: int | None = None,
+                    test_key: str | None = None) -> dict:
+    """Итоги для карточек teacher_statistics — один агрегатный запрос по свёртке."""
+    agg = _daily_rows(teacher_id, group_id, student_id, test_key).aggregate(
+        attempts=Sum("attempts_count"),
+        score_sum=Sum("score_sum"),
+        students=Count("student_id", distinct=True),
+        tests=Count("test_key", distinct=True),
+    )
+    attempts = int(agg["attempts"] or 0)
+    return {
+        "total_attempts": attempts,
+        "avg_score": (int(agg["score_sum"] or 0) / attempts) if attempts else 0.0,
+        "students_count": agg["students"],
+        "tests_count": agg["tests"],
+    }
+
+
+def teacher_trend(teacher_id: int, *, since: date, until: date, bucket: str = "day",
+                  group_id: int | None = None, student_id: int | None = None,
+                  test_key: str | None = None) -> dict:
+    """
+    Ряд для графика: по дню или неделе (с понедельника) — число попыток и средний балл.
+    Один GROUP BY по свёртке; ответ — столбцами, чтобы учебный год по дням оставался маленьким.
+    """
+    period = TruncWeek("day") if bucket == "week" else F("day")
+    rows = (
+        _daily_rows(teacher_id, group_id, student_id, test_key)
+        .filter(day__gte=since, day__lte=until)
+        .annotate(period=period)
+        .values("period")
+        .annotate(attempts=Sum("attempts_count"), score_sum=Sum("score_sum"))
+        .order_by("period")
+        .values_list("period", "attempts", "score_sum")
+    )
+    out = {"bucket": bucket, "t": [], "n": [], "avg": []}
+    for period, attempts, score_sum in rows:
+        out["t"].append(period.isoformat() if hasattr(period, "isoformat") else str(period))
+        out["n"].append(int(attempts))
+        out["avg"].append(round(int(score_sum) / attempts, 1) if attempts else 0.0)
+    return out
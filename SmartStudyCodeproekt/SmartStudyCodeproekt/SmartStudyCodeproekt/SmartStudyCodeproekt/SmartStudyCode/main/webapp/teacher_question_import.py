@@ -0,0 +1,193 @@
+# webapp/teacher_question_import.py
+from __future__ import annotations
+
+import csv
+import io
+import json
+import re
+from pathlib import Path
+
+from django.db import transaction
+
+from .models import Answers, Questions, Tests
+from .skills import tag_questions
+from .teacher_test_payload import invalidate_test_payload
+
+# Импорт вопросов в тест учителя из файла. Формат тот же, что у формы add_questions:
+# текст вопроса, ровно 4 ответа, один верный.
+#
+# CSV:  question,answer1,answer2,answer3,answer4,correct   (correct — 1..4 или A..D)
+# JSON: [{"question": "...", "answers": ["..", "..", "..", ".."], "correct": 1}, ...]
+# Markdown:
+#   What is 2 + 2?
+#   - [ ] 3
+#   - [x] 4
+#   - [ ] 5
+#   - [ ] 22
+
+ANSWERS_PER_QUESTION = 4
+MAX_QUESTIONS = 5000
+CSV_COLUMNS = ("question", "answer1", "answer2", "answer3", "answer4", "correct")
+# принимаемые суффиксы — и для разбора, и для подсказки/accept в форме
+MARKDOWN_FORMATS = (".md", ".markdown", ".txt")
+FORMATS = (".csv", ".json") + MARKDOWN_FORMATS
+
+_BATCH = 1000
+_MD_ANSWER = re.compile(r"^\s*[-*+]\s*\[([ xX])\]\s*(.*)$")
+_MD_NUMBER = re.compile(r"^\s*(?:#+\s*)?(?:\d+[.)]\s+)?")
+
+
+class ImportErrors(ValueError):
+    """Все ошибки файла сразу — по одной строке на вопрос."""
+
+    def __init__(self, errors: list[str]) -> None:
+        super().__init__("\n".join(errors))
+        self.errors = errors
+
+
+def _parse_csv(text: str) -> list[dict]:
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [c for c in CSV_COLUMNS if c not in (reader.fieldnames or [])]
+    if missing:
+        raise ImportErrors([f"CSV is missing columns: {', '.join(missing)}"])
+    return [
+        {
+            "question": row.get("question"),
+            "answers": [row.get(f"answer{i}") for i in range(1, ANSWERS_PER_QUESTION + 1)],
+            "correct": row.get("correct"),
+        }
+        for row in reader
+    ]
+
+
+def _parse_json(text: str) -> list[dict]:
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise ImportErrors([f"Invalid JSON: {e}"])
+    if isinstance(data, dict):
+        data = data.get("questions")
+    if not isinstance(data, list):
+        raise ImportErrors(["JSON must be a list of questions or {\"questions\": [...]}"])
+    return data
+
+
+def _parse_markdown(text: str) -> list[dict]:
+    rows: list[dict] = []
+    current = None
+    for line in text.splitlines():
+        m = _MD_ANSWER.match(line)
+        if m:
+            if current is None:
+                current = {"question": "", "answers": [], "correct": None}
+                rows.append(current)
+            current["answers"].append(m.group(2))
+            if m.group(1).lower() == "x":
+                # несколько [x] — ошибка, её покажет валидация
+                current["correct"] = len(current["answers"]) if current["correct"] is None else "many"
+            continue
+
+        line = line.strip()
+        if not line:
+            continue
+        if current is None or current["answers"]:
+            current = {"question": "", "answers": [], "correct": None}
+            rows.append(current)
+        part = _MD_NUMBER.sub("", line, count=1)
+        current["question"] = f"{current['question']}\n{part}".strip()
+    return rows
+
+
+def parse_questions(name: str, text: str) -> list[dict]:
+    suffix = Path(name or "").suffix.lower()
+    if suffix == ".csv":
+        return _parse_csv(text)
+    if suffix == ".json":
+        return _parse_json(text)
+    if suffix in MARKDOWN_FORMATS:
+        return _parse_markdown(text)
+    raise ImportErrors([f"Unsupported file type {suffix or name!r}: use {', '.join(FORMATS)}"])
+
+
+def _correct_index(raw) -> int | None:
+    if isinstance(raw, bool):
+        return None
+    if isinstance(raw, int):
+        return raw if 1 <= raw <= ANSWERS_PER_QUESTION else None
+    raw = str(raw or "").strip().upper()
+    if raw.isdigit():
+        return _correct_index(int(raw))
+    if len(raw) == 1 and "A" <= raw <= "D":
+        return ord(raw) - ord("A") + 1
+    return None
+
+
+def _clean_row(raw, row_no: int) -> dict:
+    if not isinstance(raw, dict):
+        raise ValueError(f"Row {row_no}: expected an object with question, answers and correct")
+
+    question = str(raw.get("question") or raw.get("question_text") or "").strip()
+    answers = raw.get("answers")
+    if answers is None:
+        answers = [raw.get(f"answer{i}") for i in range(1, ANSWERS_PER_QUESTION + 1)]
+    if not isinstance(answers, list):
+        raise ValueError(f"Row {row_no}: answers must be a list")
+    answers = [str(a or "").strip() for a in answers]
+    correct = _correct_index(raw.get("correct"))
+
+    if not question:
+        raise ValueError(f"Row {row_no}: question text is required")
+    if len(answers) != ANSWERS_PER_QUESTION or any(not a for a in answers):
+        raise ValueError(f"Row {row_no}: question must have exactly 4 non-empty answers: {question[:60]}")
+    if correct is None:
+        raise ValueError(f"Row {row_no}: exactly one correct answer (1..4 or A..D) is required: {question[:60]}")
+
+    return {"question": question, "answers": answers, "correct": correct}
+
+
+def validate_questions(raw_rows: list) -> list[dict]:
+    """Проверяет все строки до записи; при любой ошибке — ImportErrors со списком по строкам."""
+    if not raw_rows:
+        raise ImportErrors(["File contains no questions"])
+    if len(raw_rows) > MAX_QUESTIONS:
+        raise ImportErrors([f"Too many questions: {len(raw_rows)} (max {MAX_QUESTIONS})"])
+
+    items, errors = [], []
+    for i, raw in enumerate(raw_rows, start=1):
+        try:
+            items.append(_clean_row(raw, i))
+        except ValueError as e:
+            errors.append(str(e))
+    if errors:
+        raise ImportErrors(errors)
+    return items
+
+
+def import_test_questions(test: Tests, items: list[dict]) -> int:
+    """Два bulk INSERT (вопросы, затем ответы) в одной транзакции вместо 5 INSERT на вопрос."""
+    with transaction.atomic():
+        questions = Questions.objects.bulk_create(
+            [
+                Questions(
+                    test=test,
+                    question_text=item["question"],
+                    difficulty=test.difficulty,
+                    type="single_choice",
+                    time_limit=test.time_limit,
+                )
+                for item in items
+            ],
+            batch_size=_BATCH,
+        )
+        Answers.objects.bulk_create(
+            [
+                Answers(question_id=q.id, answer_text=text, is_correct=(i == item["correct"]))
+                for q, item in zip(questions, items)
+                for i, text in enumerate(item["answers"], start=1)
+            ],
+            batch_size=_BATCH * ANSWERS_PER_QUESTION,
+        )
+        # bulk_create не шлёт post_save — навыки размечаем тем же пакетом
+        tag_questions((q.id, q.question_text) for q in questions)
+    invalidate_test_payload(test.id)
+    return len(questions)
@@ -0,0 +1,115 @@
+# webapp/teacher_test_payload.py
+from __future__ import annotations
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+
+from .cache_utils import bump_version, get_version
+from .models import Answers, Questions, Tests
+
+# Вопросы и ответы теста одним объектом в cache: на старте экзамена вся группа
+# читает его, а не Questions/Answers. Ключ включает версию — правка теста её поднимает.
+# Запись живёт минимум до конца ближайшего назначенного экзамена, а при промахе payload
+# пересобирает один запрос (lock через cache.add), остальные ждут его результата.
+_VERSION_KEY = "test_payload:ver:{test_id}"
+_PAYLOAD_KEY = "test_payload:{test_id}:{version}"
+_LOCK_KEY = "test_payload:lock:{test_id}:{version}"
+
+# сколько держим lock и сколько ждём чужую сборку, прежде чем собрать самим
+_LOCK_SEC = 30
+_WAIT_SEC = 2.0
+_WAIT_STEP_SEC = 0.05
+
+
+def _ttl() -> int:
+    return int(getattr(settings, "TEST_PAYLOAD_TTL_SEC", 12 * 60 * 60))
+
+
+def _timeout(test_id: int) -> int:
+    """TTL, но не меньше, чем до конца последнего назначенного экзамена (scheduled_at + time_limit)."""
+    minutes, scheduled_at = (
+        Tests.objects.filter(id=test_id)
+        .annotate(last=Max("schedules__scheduled_at"))
+        .values_list("time_limit", "last")
+        .first()
+    ) or (None, None)
+    if scheduled_at is None:
+        return _ttl()
+    duration = timedelta(minutes=minutes) if minutes and minutes > 0 else timedelta(seconds=_ttl())
+    until = (scheduled_at + duration - timezone.now()).total_seconds()
+    return max(_ttl(), int(until))
+
+
+def _version(test_id: int) -> int:
+    return get_version(_VERSION_KEY.format(test_id=test_id))
+
+
+def test_payload_version(test_id: int) -> int:
+    """Для cache, производных от вопросов теста (webapp/item_analysis.py)."""
+    return _version(test_id)
+
+
+def build_test_payload(test_id: int) -> dict:
+    """
+    {"order": [qid, ...], "questions": {qid: {"id", "question_text", "answers": [{"id", "answer_text", "is_correct"}]}}}
+    is_correct остаётся на сервере — шаблон его не показывает.
+    """
+    questions: dict[int, dict] = {}
+    for qid, text in Questions.objects.filter(test_id=test_id).order_by("id").values_list("id", "question_text"):
+        questions[qid] = {"id": qid, "question_text": text, "answers": []}
+
+    answers = (
+        Answers.objects
+        .filter(question__test_id=test_id)
+        .order_by("question_id", "id")
+        .values_list("id", "question_id", "answer_text", "is_correct")
+    )
+    for aid, qid, text, is_correct in answers:
+        q = questions.get(qid)
+        if q is not None and len(q["answers"]) < 4:
+            q["answers"].append({"id": aid, "answer_text": text, "is_correct": bool(is_correct)})
+
+    return {"order": list(questions.keys()), "questions": questions}
+
+
+def prewarm_test_payload(test_id: int, version: int | None = None) -> dict:
+    version = _version(test_id) if version is None else version
+    payload = build_test_payload(test_id)
+    cache.set(_PAYLOAD_KEY.format(test_id=test_id, version=version), payload, timeout=_timeout(test_id))
+    return payload
+
+
+def get_test_payload(test_id: int, *, refresh: bool = False) -> dict:
+    version = _version(test_id)
+    key = _PAYLOAD_KEY.format(test_id=test_id, version=version)
+    if refresh:
+        return prewarm_test_payload(test_id, version)
+    payload = cache.get(key)
+    if payload is not None:
+        return payload
+
+    lock = _LOCK_KEY.format(test_id=test_id, version=version)
+    if cache.add(lock, 1, timeout=_LOCK_SEC):
+        try:
+            return prewarm_test_payload(test_id, version)
+        finally:
+            cache.delete(lock)
+
+    # payload уже собирает другой запрос
+    deadline = time.monotonic() + _WAIT_SEC
+    while time.monotonic() < deadline:
+        time.sleep(_WAIT_STEP_SEC)
+        payload = cache.get(key)
+        if payload is not None:
+            return payload
+    return build_test_payload(test_id)
+
+
+def invalidate_test_payload(test_id: int) -> None:
+    """Вызывать после любых изменений вопросов/ответов теста; старый ключ просто истечёт."""
+    bump_version(_VERSION_KEY.format(test_id=test_id))
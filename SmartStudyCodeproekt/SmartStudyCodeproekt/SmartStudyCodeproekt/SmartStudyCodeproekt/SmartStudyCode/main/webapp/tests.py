@@ -1,3 +1,1442 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import threading
+import time
+import zipfile
+from datetime import date, timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+import openai
+from django.apps import apps
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+try:
+    import numpy as np
+
+    from . import irt
+except ImportError:  # numpy не установлен — тесты IRT пропускаются
+    np = irt = None
+
+from .ai_jobs import claim_jobs, complete_job, run_job, start_stream_job
+from .ai_stat_helper import (
+    _SummaryReader,
+    build_ai_stat_snapshot,
+    generate_ai_stat_report,
+    snapshot_hash,
+    snapshot_watermark,
+)
+from .ai_stub import make_stub_server
+from .attempt_finalizer import _score_sql, finalize_expired_attempts, rounded_percent
+from .exports import _csv_safe
+from .item_analysis import get_item_analysis
+from .question_bank import BANK_VERSION_KEY, question_bank
+from .question_import import import_questions
+from .llm_client import CircuitOpenError, breaker_state, chat_completion, get_client
+from .leaderboard import group_leaderboard, student_standings
+from .report_cache import report_cache_counters, report_profile
+from .skills import backfill_skills
+from .services import HISTORY_PAGE_SIZE, decode_cursor, encode_cursor, teacher_history
+from .stats_rollup import rebuild_all, record_adaptive_attempts, teacher_summary
+from .teacher_test_payload import _LOCK_KEY, _PAYLOAD_KEY, get_test_payload
+from .views import _record_adaptive_answer
+from .models import (
+    AdaptiveAttempt,
+    AdaptiveAttemptAnswer,
+    AdaptiveQuestion,
+    AdaptiveQuestionStats,
+    AIReportJob,
+    AIStatHelperReport,
+    Answers,
+    AttemptQuestionSheet,
+    Groups,
+    LLMBreakerState,
+    Questions,
+    QuestionSkill,
+    StudentsGroups,
+    TeacherStatsDaily,
+    Testattempts,
+    Tests,
+    TestSchedule,
+    Topics,
+    Useranswers,
+    Users,
+)
+
+
+class WebappTestCase(TestCase):
+    """
+    Таблицы с managed = False тестовая БД не создаёт (как и managed-таблицы без миграций) —
+    создаём недостающие один раз перед тестами.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        existing = set(connection.introspection.table_names())
+        missing = [
+            m for m in apps.get_app_config("webapp").get_models()
+            if m._meta.db_table not in existing
+        ]
+        if missing:
+            with connection.schema_editor() as editor:
+                for model in missing:
+                    editor.create_model(model)
+        super().setUpClass()
+
+    @staticmethod
+    def make_user(username: str, role: str) -> Users:
+        return Users.objects.create(
+            username=username,
+            email=f"{username}@example.com",
+            password_hash=make_password("pass"),
+            role=role,
+        )
+
+    def login(self, user: Users) -> None:
+        session = self.client.session
+        session["user_id"] = user.id
+        session["role"] = user.role
+        session.save()
+
+
+class TeacherTestCase(WebappTestCase):
+    """Тест учителя из QUESTIONS вопросов, назначенный группе студента; попытка уже начата."""
+
+    QUESTIONS = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = cls.make_user("teacher", "teacher")
+        cls.student = cls.make_user("student", "student")
+        topic = Topics.objects.create(name="Python")
+        cls.test = Tests.objects.create(
+            title="Quiz", topic=topic, difficulty="easy", time_limit=30, created_by=cls.teacher,
+        )
+        for i in range(cls.QUESTIONS):
+            q = Questions.objects.create(
+                test=cls.test, question_text=f"Q{i}", difficulty="easy", type="single_choice",
+            )
+            for j in range(4):
+                Answers.objects.create(question=q, answer_text=f"A{j}", is_correct=(j == 0))
+        group = Groups.objects.create(name="G1", teacher=cls.teacher)
+        StudentsGroups.objects.create(student=cls.student, group=group)
+        cls.schedule = TestSchedule.objects.create(
+            test=cls.test, group=group, scheduled_at=timezone.now() - timedelta(minutes=1),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.login(self.student)
+        self.client.get(reverse("teacher_test_start", args=[self.schedule.id]))
+        self.attempt = Testattempts.objects.get(user=self.student)
+        self.take_url = reverse("teacher_test_take", args=[self.attempt.id])
+        self.finish_url = reverse("teacher_test_finish", args=[self.attempt.id])
+
+    def _correct_answer_id(self) -> int:
+        sheet = AttemptQuestionSheet.objects.get(attempt=self.attempt)
+        qid = sheet.question_ids[sheet.cursor]
+        return Answers.objects.get(question_id=qid, is_correct=True).id
+
+
+class TeacherTestTakeQueriesTests(TeacherTestCase):
+    def test_start_materializes_sheet(self):
+        sheet = AttemptQuestionSheet.objects.get(attempt=self.attempt)
+        expected = list(Questions.objects.filter(test=self.test).order_by("id").values_list("id", flat=True))
+        self.assertEqual(sheet.question_ids, expected)
+        self.assertEqual(sheet.cursor, 0)
+
+    def test_each_step_runs_constant_queries(self):
+        # session, user, attempt+sheet; вопрос и ответы — из payload в cache
+        for step in range(self.QUESTIONS):
+            answer_id = self._correct_answer_id()
+            with self.assertNumQueries(3):
+                response = self.client.get(self.take_url)
+            self.assertEqual(response.context["q_index"], step + 1)
+
+            # + ключ ответа из Answers, savepoint, блокировка попытки, сдвиг cursor,
+            # update ответа, insert, release
+            with self.assertNumQueries(10):
+                self.client.post(self.take_url, {"answer_id": answer_id})
+
+        self.assertRedirects(self.client.get(self.take_url), self.finish_url, fetch_redirect_response=False)
+
+    def test_edit_question_invalidates_payload(self):
+        self.client.get(self.take_url)
+        question = Questions.objects.filter(test=self.test).order_by("id").first()
+
+        self.login(self.teacher)
+        self.client.post(reverse("edit_question", args=[question.id]), {"question_text": "Edited", "correct_index": 1})
+
+        self.login(self.student)
+        response = self.client.get(self.take_url)
+        self.assertEqual(response.context["question"]["question_text"], "Edited")
+        self.assertTrue(response.context["answers"][1]["is_correct"])
+
+    @override_settings(TEST_PAYLOAD_TTL_SEC=1)
+    def test_prewarm_lasts_until_scheduled_exam(self):
+        cache.clear()
+        self.login(self.teacher)
+        when = timezone.localtime(timezone.now() + timedelta(days=2)).strftime("%Y-%m-%dT%H:%M")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("schedule_test", args=[self.test.id]),
+                {"group_id": self.schedule.group_id, "scheduled_at": when},
+            )
+        # экзамен через двое суток: запись переживает TTL и на старте ещё в cache
+        time.sleep(1.1)
+        with self.assertNumQueries(0):
+            get_test_payload(self.test.id)
+
+    def test_payload_miss_is_rebuilt_once(self):
+        cache.clear()
+        # payload уже собирает другой запрос — этот дожидается его результата, а не идёт в БД
+        cache.add(_LOCK_KEY.format(test_id=self.test.id, version=0), 1)
+        built = {"order": [], "questions": {}}
+        threading.Timer(0.1, cache.set, args=(_PAYLOAD_KEY.format(test_id=self.test.id, version=0), built)).start()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_test_payload(self.test.id), built)
+
+    def test_grading_ignores_stale_payload_key(self):
+        self.client.get(self.take_url)
+        answer_id = self._correct_answer_id()
+        # ключ поменяли в обход views — payload в cache остался прежним
+        Answers.objects.filter(id=answer_id).update(is_correct=False)
+        self.client.post(self.take_url, {"answer_id": answer_id})
+        self.assertFalse(Useranswers.objects.get(attempt=self.attempt).is_correct)
+
+    def test_double_submit_does_not_skip_question(self):
+        answer_id = self._correct_answer_id()
+        self.client.post(self.take_url, {"answer_id": answer_id})
+        self.client.post(self.take_url, {"answer_id": answer_id})
+        self.assertEqual(AttemptQuestionSheet.objects.get(attempt=self.attempt).cursor, 1)
+
+    def test_finished_attempt_uses_stored_totals(self):
+        for _ in range(2):
+            self.client.post(self.take_url, {"answer_id": self._correct_answer_id()})
+
+        # третий вопрос листа удалён посреди попытки — лист проходит мимо него без ответа
+        sheet = AttemptQuestionSheet.objects.get(attempt=self.attempt)
+        self.login(self.teacher)
+        self.client.post(reverse("delete_question", args=[sheet.question_ids[2]]))
+        self.login(self.student)
+        self.client.get(self.take_url)
+        self.client.post(self.take_url, {"answer_id": self._correct_answer_id()})
+        self.assertEqual(AttemptQuestionSheet.objects.get(attempt=self.attempt).cursor, 4)
+
+        response = self.client.get(self.finish_url)
+        self.assertEqual(response.context["correct"], 3)
+        self.assertEqual(response.context["answered"], 3)
+        self.assertEqual(response.context["total"], self.QUESTIONS)
+
+        Useranswers.objects.filter(attempt=self.attempt, is_correct=True).update(is_correct=False)
+        # session, user, attempt+sheet, число ответов — итоги сохранённые, без пересчёта
+        with self.assertNumQueries(4):
+            response = self.client.get(self.finish_url)
+        self.assertEqual(response.context["correct"], 3)
+        self.assertEqual(response.context["answered"], 3)
+        self.assertEqual(response.context["score_percent"], 60)
+
+
+class TeacherTestJsonDeliveryTests(TeacherTestCase):
+    def setUp(self):
+        super().setUp()
+        self.payload_url = reverse("teacher_test_payload", args=[self.attempt.id])
+        self.answers_url = reverse("teacher_test_answers", args=[self.attempt.id])
+
+    def _post(self, answers, finish=False):
+        return self.client.post(
+            self.answers_url,
+            json.dumps({"answers": answers, "finish": finish}),
+            content_type="application/json",
+        )
+
+    def _batch(self, correct=True):
+        rows = Answers.objects.filter(question__test=self.test, is_correct=correct).order_by("question_id", "id")
+        batch = {}
+        for a in rows:
+            batch.setdefault(a.question_id, a.id)
+        return [{"question_id": q, "answer_id": a} for q, a in batch.items()]
+
+    def test_payload_has_all_questions_without_flags(self):
+        data = self.client.get(self.payload_url).json()
+        self.assertEqual(len(data["questions"]), self.QUESTIONS)
+        self.assertNotIn("is_correct", json.dumps(data["questions"]))
+        self.assertEqual(data["answered"], {})
+
+    def test_batches_are_idempotent(self):
+        batch = self._batch()
+        self._post(batch[:2])
+        self._post(batch[:2])
+        self.assertEqual(Useranswers.objects.filter(attempt=self.attempt).count(), 2)
+
+        # ответ можно поменять, строка при этом не дублируется
+        wrong = self._batch(correct=False)
+        self._post(wrong[:1])
+        self.assertEqual(Useranswers.objects.filter(attempt=self.attempt).count(), 2)
+        self.assertEqual(Useranswers.objects.filter(attempt=self.attempt, is_correct=True).count(), 1)
+
+        sheet = AttemptQuestionSheet.objects.get(attempt=self.attempt)
+        self.assertEqual(sheet.cursor, 2)
+        self.assertEqual(set(sheet.question_ids[:2]), {b["question_id"] for b in batch[:2]})
+
+    def test_finish_in_last_batch(self):
+        data = self._post(self._batch(), finish=True).json()
+        self.assertTrue(data["finished"])
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.correct_answers, self.QUESTIONS)
+        self.assertEqual(self.attempt.score, 100)
+        self.assertEqual(self._post(self._batch()).status_code, 409)
+
+    def test_foreign_answer_is_rejected(self):
+        other = Answers.objects.filter(question__test=self.test).order_by("id")
+        first_q = other.first().question_id
+        foreign = other.exclude(question_id=first_q).first()
+        data = self._post([{"question_id": first_q, "answer_id": foreign.id}]).json()
+        self.assertEqual(data["saved"], 0)
+        self.assertEqual(len(data["rejected"]), 1)
+
+    def test_deadline_is_enforced(self):
+        Testattempts.objects.filter(id=self.attempt.id).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(self.client.get(self.payload_url).status_code, 409)
+        self.assertEqual(self._post(self._batch()).status_code, 409)
+        self.assertFalse(Useranswers.objects.filter(attempt=self.attempt).exists())
+        self.attempt.refresh_from_db()
+        self.assertIsNotNone(self.attempt.finished_at)
+
+
+class FinalizeExpiredAttemptsTests(TeacherTestCase):
+    def _answer_first(self, n):
+        for _ in range(n):
+            self.client.post(self.take_url, {"answer_id": self._correct_answer_id()})
+
+    def test_closes_only_expired_attempts(self):
+        self._answer_first(2)
+        report = finalize_expired_attempts()
+        self.assertEqual(report.teacher, 0)
+
+        Testattempts.objects.filter(id=self.attempt.id).update(started_at=timezone.now() - timedelta(hours=1))
+        report = finalize_expired_attempts()
+        self.assertEqual(report.teacher, 1)
+
+        self.attempt.refresh_from_db()
+        self.assertIsNotNone(self.attempt.finished_at)
+        self.assertEqual(self.attempt.total_questions, self.QUESTIONS)
+        self.assertEqual(self.attempt.correct_answers, 2)
+        self.assertEqual(self.attempt.score, 40)
+
+        # повторный запуск и страница итогов ничего не меняют
+        finished_at = self.attempt.finished_at
+        self.assertEqual(finalize_expired_attempts().teacher, 0)
+        response = self.client.get(self.finish_url)
+        self.assertEqual(response.context["score_percent"], 40)
+        self.attempt.refresh_from_db()
+        self.assertEqual(self.attempt.finished_at, finished_at)
+
+    def test_closes_abandoned_adaptive_attempts(self):
+        questions = [
+            AdaptiveQuestion.objects.create(
+                topic_code="python", level=1, text=f"Q{i}",
+                option_a="a", option_b="b", option_c="c", option_d="d", correct_option="A",
+            )
+            for i in range(4)
+        ]
+        old = AdaptiveAttempt.objects.create(user=self.student, topic_code="python")
+        fresh = AdaptiveAttempt.objects.create(user=self.student, topic_code="python")
+        for i, q in enumerate(questions):
+            AdaptiveAttemptAnswer.objects.create(attempt=old, question=q, chosen_option="A", is_correct=i < 3)
+        AdaptiveAttempt.objects.filter(id=old.id).update(started_at=timezone.now() - timedelta(hours=1))
+
+        report = finalize_expired_attempts()
+        self.assertEqual(report.adaptive, 1)
+
+        old.refresh_from_db()
+        fresh.refresh_from_db()
+        self.assertIsNotNone(old.finished_at)
+        self.assertEqual((old.total_questions, old.correct_answers, old.score_percent), (4, 3, 75))
+        self.assertIsNone(fresh.finished_at)
+
+    def test_sql_and_python_round_the_same(self):
+        # 5/8 = 62.5%, 1/8 = 12.5%: округление половины вверх в обоих путях
+        cases = [(0, 0), (1, 3), (2, 3), (1, 8), (5, 8), (7, 8), (4, 4)]
+        with connection.cursor() as cursor:
+            for correct, total in cases:
+                cursor.execute(f"SELECT {_score_sql(str(correct), str(total))}")
+                self.assertEqual(cursor.fetchone()[0], rounded_percent(correct, total), (correct, total))
+        self.assertEqual(rounded_percent(5, 8), 63)
+        self.assertEqual(rounded_percent(1, 8), 13)
+
+
+class ImportTestQuestionsTests(TeacherTestCase):
+    MARKDOWN = (
+        "1. What is 2 + 2?\n"
+        "- [ ] 3\n- [x] 4\n- [ ] 5\n- [ ] 22\n\n"
+        "2. Python is\n"
+        "- [x] a language\n- [ ] a snake only\n- [ ] a database\n- [ ] an OS\n"
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.login(self.teacher)
+
+    def _upload(self, name, content):
+        return self.client.post(
+            reverse("import_questions_file", args=[self.test.id]),
+            {"file": SimpleUploadedFile(name, content.encode("utf-8"))},
+        )
+
+    def test_markdown_import_in_constant_queries(self):
+        # session, user, test, savepoint, insert вопросов, insert ответов, upsert навыков, release
+        with self.assertNumQueries(8):
+            response = self._upload("bank.md", self.MARKDOWN)
+        self.assertRedirects(response, reverse("add_questions", args=[self.test.id]), fetch_redirect_response=False)
+
+        q = Questions.objects.get(test=self.test, question_text="What is 2 + 2?")
+        self.assertEqual(Answers.objects.get(question=q, is_correct=True).answer_text, "4")
+        self.assertEqual(QuestionSkill.objects.get(question=q).skill, "Операторы и выражения")
+        self.assertEqual(Questions.objects.filter(test=self.test).count(), self.QUESTIONS + 2)
+
+    def test_csv_errors_are_reported_per_row_and_nothing_is_written(self):
+        content = (
+            "question,answer1,answer2,answer3,answer4,correct\n"
+            "Ok?,a,b,c,d,B\n"
+            ",a,b,c,d,1\n"
+            "No answer?,a,b,,d,1\n"
+            "Bad correct?,a,b,c,d,7\n"
+        )
+        response = self._upload("bank.csv", content)
+        self.assertEqual(response.status_code, 400)
+        errors = response.context["import_errors"]
+        self.assertEqual([e.split(":")[0] for e in errors], ["Row 2", "Row 3", "Row 4"])
+        self.assertEqual(Questions.objects.filter(test=self.test).count(), self.QUESTIONS)
+
+    def test_unsupported_type_lists_accepted_suffixes(self):
+        response = self._upload("bank.xml", self.MARKDOWN)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(".csv, .json, .md, .markdown, .txt", response.context["import_errors"][0])
+        self.assertContains(response, 'accept=".csv,.json,.md,.markdown,.txt"', status_code=400)
+        self.assertEqual(self._upload("bank.txt", self.MARKDOWN).status_code, 302)
+
+    def test_import_invalidates_payload(self):
+        # payload теста уже в cache после teacher_test_start в setUp
+        self._upload("bank.json", json.dumps([{"question": "New", "answers": ["a", "b", "c", "d"], "correct": 1}]))
+        new_id = Questions.objects.get(test=self.test, question_text="New").id
+        self.assertIn(new_id, get_test_payload(self.test.id)["questions"])
+
+
+class QuestionSkillTests(TeacherTestCase):
+    def _answer_all(self, correct):
+        for i in range(self.QUESTIONS):
+            sheet = AttemptQuestionSheet.objects.get(attempt=self.attempt)
+            qid = sheet.question_ids[sheet.cursor]
+            answer = Answers.objects.filter(question_id=qid, is_correct=(i < correct)).first()
+            self.client.post(self.take_url, {"answer_id": answer.id})
+        self.client.get(self.finish_url)
+
+    def test_skill_is_stored_on_write(self):
+        q = Questions.objects.filter(test=self.test).first()
+        self.login(self.teacher)
+        self.client.post(reverse("edit_question", args=[q.id]), {"question_text": "Цикл while"})
+        self.assertEqual(QuestionSkill.objects.get(question=q).skill, "Циклы for/while")
+
+        bank = AdaptiveQuestion.objects.create(
+            topic_code="python-basics", level=1, text="try except",
+            option_a="a", option_b="b", option_c="c", option_d="d", correct_option="A",
+        )
+        self.assertEqual(bank.skill, "Исключения")
+
+    def test_snapshot_groups_by_stored_skill(self):
+        Questions.objects.filter(test=self.test).update(question_text="while loop")
+        QuestionSkill.objects.filter(question__test=self.test).update(skill="Циклы for/while")
+        self._answer_all(correct=3)
+
+        # 2 GROUP BY по ответам + 2 COUNT попыток
+        with self.assertNumQueries(4):
+            snapshot = build_ai_stat_snapshot(self.student)
+        self.assertEqual(snapshot["weak_skills"], [
+            {"skill": "Циклы for/while", "wrong": 2, "total": 5, "wrong_rate": 40.0},
+        ])
+
+    def test_backfill_tags_untagged_rows(self):
+        QuestionSkill.objects.all().delete()
+        AdaptiveQuestion.objects.create(
+            topic_code="python-basics", level=1, text="input()",
+            option_a="a", option_b="b", option_c="c", option_d="d", correct_option="A",
+        )
+        AdaptiveQuestion.objects.update(skill="")
+
+        self.assertEqual(backfill_skills(batch_size=2), (self.QUESTIONS, 1))
+        self.assertEqual(QuestionSkill.objects.count(), self.QUESTIONS)
+        self.assertEqual(AdaptiveQuestion.objects.get().skill, "Ввод/вывод")
+        self.assertEqual(backfill_skills(), (0, 0))
+
+    def test_forced_retag_changes_watermark(self):
+        watermark = snapshot_watermark(self.student)
+        self.assertEqual(backfill_skills(), (0, 0))
+        self.assertEqual(snapshot_watermark(self.student), watermark)
+
+        call_command("tag_question_skills", "--force", stdout=io.StringIO())
+        self.assertNotEqual(snapshot_watermark(self.student), watermark)
+
+
+class AIStatSnapshotTests(WebappTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = cls.make_user("student", "student")
+        AdaptiveAttempt.objects.create(user=cls.student, topic_code="python-basics", finished_at=timezone.now())
+
+    def setUp(self):
+        self.login(self.student)
+        snapshot = build_ai_stat_snapshot(self.student)
+        self.report = AIStatHelperReport.objects.create(
+            student=self.student, snapshot_hash=snapshot_hash(snapshot), snapshot_json=snapshot,
+            watermark=snapshot_watermark(self.student), report_json={"summary": "ok"},
+        )
+
+    def test_hash_ignores_generation_time(self):
+        snapshot = build_ai_stat_snapshot(self.student)
+        moved = {**snapshot, "stats": {**snapshot["stats"], "generated_at": "01.01.2000 00:00"}}
+        self.assertEqual(snapshot_hash(moved), snapshot_hash(snapshot))
+
+    def test_unchanged_watermark_skips_snapshot(self):
+        # session, user, последний отчёт, прогон разметки и 2 агрегата watermark, последняя задача очереди —
+        # без запросов к ответам
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse("student_ai_stat_helper"))
+        self.assertFalse(response.context["is_stale"])
+        self.assertEqual(response.context["report"], {"summary": "ok"})
+
+    def test_new_attempt_rebuilds_snapshot(self):
+        # не-Python попытка: содержимое то же, отчёт не устарел; GET ничего не пишет
+        AdaptiveAttempt.objects.create(user=self.student, topic_code="logic-structures", finished_at=timezone.now())
+        old_watermark = self.report.watermark
+        response = self.client.get(reverse("student_ai_stat_helper"))
+        self.assertFalse(response.context["is_stale"])
+        self.report.refresh_from_db()
+        self.assertEqual(self.report.watermark, old_watermark)
+
+        AdaptiveAttempt.objects.create(user=self.student, topic_code="python-basics", finished_at=timezone.now())
+        response = self.client.get(reverse("student_ai_stat_helper"))
+        self.assertTrue(response.context["is_stale"])
+
+
+class StubLLMTestCase(WebappTestCase):
+    """Локальный stub LLM (webapp/ai_stub.py) на свободном порту на время класса."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = make_stub_server()
+        threading.Thread(target=cls.stub.serve_forever, daemon=True).start()
+        cls.stub_url = f"http://127.0.0.1:{cls.stub.server_address[1]}/v1"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.stub.shutdown()
+        cls.stub.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.stub.delay, self.stub.fail_next, self.stub.fail_status = 0.0, 0, 500
+        self.stub.fail_stream_after = 0
+        self.stub.requests = self.stub.completions = 0
+
+
+class AIReportJobTests(StubLLMTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = cls.make_user("student", "student")
+        AdaptiveAttempt.objects.create(user=cls.student, topic_code="python-basics", finished_at=timezone.now())
+
+    def setUp(self):
+        super().setUp()
+        self.login(self.student)
+        self.url = reverse("student_ai_stat_helper")
+        self.status_url = reverse("student_ai_stat_helper_status")
+
+    def _analyze(self):
+        return self.client.post(self.url, {"action": "analyze"})
+
+    def test_analyze_enqueues_and_worker_builds_report(self):
+        self.assertRedirects(self._analyze(), self.url)
+        self.assertEqual(self.client.get(self.status_url).json()["status"], AIReportJob.QUEUED)
+        self.assertTrue(self.client.get(self.url).context["job_active"])
+        self.assertEqual(self.client.post(self.status_url).status_code, 405)
+
+        with self.settings(OPENROUTER_BASE_URL=self.stub_url, OPENROUTER_API_KEY="stub"):
+            ids = claim_jobs("test", limit=4)
+            self.assertEqual(len(ids), 1)
+            self.assertEqual(run_job(ids[0]), AIReportJob.DONE)
+
+        self.assertEqual(self.client.get(self.status_url).json()["status"], AIReportJob.DONE)
+        response = self.client.get(self.url)
+        self.assertFalse(response.context["job_active"])
+        self.assertTrue(response.context["has_report"])
+        self.assertIn("stub", response.context["report"]["summary"])
+        # watermark снимка сохраняет готовый отчёт
+        report = AIStatHelperReport.objects.get(student=self.student)
+        self.assertEqual(report.watermark, snapshot_watermark(self.student))
+
+    def test_repeated_analyze_reuses_active_job(self):
+        self._analyze()
+        self._analyze()
+        self.assertEqual(AIReportJob.objects.count(), 1)
+
+    @override_settings(AI_REPORT_DAILY_QUOTA=2)
+    def test_daily_quota(self):
+        for _ in range(2):
+            self._analyze()
+            AIReportJob.objects.update(status=AIReportJob.DONE)
+        response = self._analyze()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("2", response.context["error"])
+        self.assertEqual(AIReportJob.objects.count(), 2)
+
+    @override_settings(AI_REPORT_CONCURRENCY=2)
+    def test_global_concurrency_cap(self):
+        others = [self.make_user(f"s{i}", "student") for i in range(3)]
+        for student in [self.student, *others]:
+            AIReportJob.objects.create(student=student, snapshot_hash="h")
+        self.assertEqual(len(claim_jobs("a", limit=4)), 2)
+        self.assertEqual(claim_jobs("b", limit=4), [])
+
+        # генерация в запросе (SSE) занимает тот же слот: при полном лимите задача ждёт воркера
+        late = self.make_user("late", "student")
+        self.assertIsNone(start_stream_job(late, snapshot={}, snapshot_hash="h", watermark=""))
+        self.assertEqual(AIReportJob.objects.get(student=late).status, AIReportJob.QUEUED)
+        AIReportJob.objects.filter(status=AIReportJob.RUNNING).update(status=AIReportJob.DONE)
+        self.assertIsNotNone(start_stream_job(late, snapshot={}, snapshot_hash="h", watermark=""))
+        self.assertEqual(len(claim_jobs("c", limit=4)), 1)
+
+    @override_settings(AI_REPORT_JOB_MAX_TRIES=1)
+    def test_failed_job_is_reported(self):
+        self._analyze()
+        with self.settings(OPENROUTER_API_KEY=""):
+            self.assertEqual(run_job(claim_jobs("test", limit=1)[0]), AIReportJob.FAILED)
+        self.assertIn("OPENROUTER_API_KEY", self.client.get(self.status_url).json()["error"])
+        self.assertIn("OPENROUTER_API_KEY", self.client.get(self.url).context["error"])
+
+
+class SharedReportCacheTests(StubLLMTestCase):
+    @staticmethod
+    def _snapshot(name, wrong, total):
+        return {
+            "stats": {"student": name, "generated_at": "", "teacher_python_attempts": 4, "basic_python_attempts": 1},
+            "weak_skills": [
+                {"skill": "Циклы for/while", "wrong": wrong, "total": total, "wrong_rate": round(wrong / total * 100, 1)},
+            ],
+        }
+
+    def test_similar_profiles_share_one_llm_call(self):
+        anna, boris = self.make_user("anna", "student"), self.make_user("boris", "student")
+        with self.settings(OPENROUTER_BASE_URL=self.stub_url, OPENROUTER_API_KEY="stub"):
+            first, _ = generate_ai_stat_report(student=anna, snapshot=self._snapshot("anna", 6, 12))
+            calls = self.stub.completions
+            # 50% и 54% ошибок, 12 и 13 ответов — одни корзины
+            second, text = generate_ai_stat_report(student=boris, snapshot=self._snapshot("boris", 7, 13))
+
+        self.assertEqual(self.stub.completions, calls)
+        self.assertTrue(first["summary"].startswith("anna,"))
+        self.assertTrue(second["summary"].startswith("boris,"))
+        self.assertNotIn("anna", text)
+        self.assertEqual(second["weak_topics"], first["weak_topics"])
+        self.assertEqual(report_cache_counters(), {"hits": 1, "misses": 1, "hit_rate": 0.5})
+
+    def test_different_bucket_misses(self):
+        self.assertNotEqual(
+            report_profile(self._snapshot("a", 6, 12)),
+            report_profile(self._snapshot("a", 9, 12)),
+        )
+        self.assertEqual(report_profile(self._snapshot("a", 6, 12)), report_profile(self._snapshot("b", 6, 12)))
+
+
+@override_settings(
+    OPENROUTER_API_KEY="stub", OPENROUTER_MAX_RETRIES=1, OPENROUTER_RETRY_BACKOFF_SEC=0.01,
+    OPENROUTER_BREAKER_THRESHOLD=2, OPENROUTER_BREAKER_COOLDOWN_SEC=1,
+)
+class LLMClientTests(StubLLMTestCase):
+    def setUp(self):
+        super().setUp()
+        stub_settings = self.settings(OPENROUTER_BASE_URL=self.stub_url)
+        stub_settings.enable()
+        self.addCleanup(stub_settings.disable)
+
+    def _ask(self):
+        return chat_completion(model="stub", messages=[{"role": "user", "content": "{}"}])
+
+    def _trip_breaker(self):
+        self.stub.fail_next = 100
+        for _ in range(2):
+            with self.assertRaises(openai.InternalServerError):
+                self._ask()
+        self.assertEqual(breaker_state(), "open")
+
+    def test_client_is_shared(self):
+        self.assertIs(get_client(), get_client())
+
+    def test_settings_change_replaces_client_without_closing(self):
+        old = get_client()
+        with self.settings(OPENROUTER_READ_TIMEOUT_SEC=7):
+            self.assertIsNot(get_client(), old)
+        # запрос в другом потоке мог ещё держать старый клиент
+        self.assertFalse(old.is_closed())
+
+    def test_transient_error_is_retried(self):
+        self.stub.fail_next = 1
+        self.assertEqual(self._ask().choices[0].finish_reason, "stop")
+        self.assertEqual((self.stub.requests, self.stub.completions), (2, 1))
+        self.assertEqual(breaker_state(), "closed")
+
+    def test_client_error_is_not_retried(self):
+        self.stub.fail_next, self.stub.fail_status = 1, 400
+        with self.assertRaises(openai.BadRequestError):
+            self._ask()
+        self.assertEqual(self.stub.requests, 1)
+        self.assertEqual(breaker_state(), "closed")
+
+    @override_settings(OPENROUTER_READ_TIMEOUT_SEC=0.2, OPENROUTER_MAX_RETRIES=0)
+    def test_read_timeout(self):
+        self.stub.delay = 1.0
+        started = time.perf_counter()
+        with self.assertRaises(openai.APITimeoutError):
+            self._ask()
+        self.assertLess(time.perf_counter() - started, 0.9)
+
+    def test_breaker_fails_fast_and_recovers(self):
+        self._trip_breaker()
+        # состояние в БД, а не в cache процесса — его видят все воркеры
+        cache.clear()
+        self.assertTrue(LLMBreakerState.objects.get().tripped)
+        sent = self.stub.requests
+        with self.assertRaises(CircuitOpenError):
+            self._ask()
+        self.assertEqual(self.stub.requests, sent)
+
+        # после cooldown проходит одна проба; удачная закрывает breaker
+        time.sleep(1.1)
+        self.stub.fail_next = 0
+        self.assertEqual(breaker_state(), "half_open")
+        self._ask()
+        self.assertEqual(breaker_state(), "closed")
+
+    def test_stream_counts_only_when_read(self):
+        self._trip_breaker()
+        time.sleep(1.1)
+        self.stub.fail_next, self.stub.fail_stream_after = 0, 2
+        stream = chat_completion(model="stub", messages=[{"role": "user", "content": "{}"}], stream=True)
+        # поток открыт, но не дочитан — проба breaker не закрыла
+        self.assertEqual(breaker_state(), "half_open")
+        with self.assertRaises(openai.APIError):
+            list(stream)
+        self.assertEqual(breaker_state(), "open")
+
+        time.sleep(1.1)
+        self.stub.fail_stream_after = 0
+        list(chat_completion(model="stub", messages=[{"role": "user", "content": "{}"}], stream=True))
+        self.assertEqual(breaker_state(), "closed")
+
+    def test_open_breaker_keeps_last_report(self):
+        student = self.make_user("student", "student")
+        AIStatHelperReport.objects.create(student=student, snapshot_hash="old", report_json={"summary": "last good"})
+        self._trip_breaker()
+
+        self.login(student)
+        response = self.client.post(reverse("student_ai_stat_helper"), {"action": "analyze"})
+        self.assertIn("unavailable", response.context["error"])
+        self.assertEqual(response.context["report"], {"summary": "last good"})
+        self.assertFalse(AIReportJob.objects.exists())
+
+
+class AIReportStreamTests(StubLLMTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = cls.make_user("student", "student")
+        AdaptiveAttempt.objects.create(user=cls.student, topic_code="python-basics", finished_at=timezone.now())
+
+    def setUp(self):
+        super().setUp()
+        self.login(self.student)
+        self.start_url = reverse("student_ai_stat_helper_start")
+        stub_settings = self.settings(OPENROUTER_BASE_URL=self.stub_url, OPENROUTER_API_KEY="stub")
+        stub_settings.enable()
+        self.addCleanup(stub_settings.disable)
+
+    @staticmethod
+    def _events(response):
+        events = []
+        for block in b"".join(response.streaming_content).decode("utf-8").split("\n\n"):
+            lines = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+            if lines:
+                events.append((lines["event"], json.loads(lines["data"])))
+        return events
+
+    def _stream(self):
+        data = self.client.post(self.start_url).json()
+        return self.client.get(data["stream_url"])
+
+    def test_summary_streams_before_report_is_saved(self):
+        response = self._stream()
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = self._events(response)
+
+        kinds = [e for e, _ in events]
+        self.assertEqual(kinds[-1], "done")
+        self.assertGreater(kinds.count("summary"), 2)
+        streamed = "".join(data["text"] for e, data in events if e == "summary")
+
+        report = AIStatHelperReport.objects.get(student=self.student)
+        self.assertEqual(streamed.strip(), report.report_json["summary"])
+        self.assertEqual(AIReportJob.objects.get().status, AIReportJob.DONE)
+
+    def test_cached_profile_skips_llm(self):
+        self._events(self._stream())
+        AIStatHelperReport.objects.all().delete()
+        sent = self.stub.requests
+        self.assertEqual(self._events(self._stream())[-1][0], "done")
+        self.assertEqual(self.stub.requests, sent)
+
+    def test_get_only_attaches_to_started_job(self):
+        url = reverse("student_ai_stat_helper_stream")
+        self.assertEqual(self._events(self.client.get(url)), [("busy", {})])
+        self.assertFalse(AIReportJob.objects.exists())
+
+        data = self.client.post(self.start_url).json()
+        self._events(self.client.get(data["stream_url"]))
+        # повторный GET той же задачи ничего не генерирует
+        sent = self.stub.requests
+        self.assertEqual(self._events(self.client.get(data["stream_url"])), [("busy", {})])
+        self.assertEqual(self.stub.requests, sent)
+        self.assertEqual(self.client.get(self.start_url).status_code, 405)
+
+    def test_start_requires_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.cookies = self.client.cookies
+        self.assertEqual(client.post(self.start_url).status_code, 403)
+        self.assertFalse(AIReportJob.objects.exists())
+
+    def test_active_job_is_busy(self):
+        self.client.post(reverse("student_ai_stat_helper"), {"action": "analyze"})
+        AIReportJob.objects.update(status=AIReportJob.RUNNING)
+        self.assertEqual(self.client.post(self.start_url).json(), {"busy": True})
+
+    def test_disconnect_returns_job_to_queue(self):
+        response = self._stream()
+        chunks = iter(response.streaming_content)
+        next(chunks)
+        next(chunks)
+        response.close()
+        self.assertEqual(AIReportJob.objects.get().status, AIReportJob.QUEUED)
+
+    def test_broken_stream_counts_as_failure(self):
+        self.stub.fail_stream_after = 3
+        events = self._events(self._stream())
+        self.assertEqual(events[-1][0], "error")
+        self.assertEqual(LLMBreakerState.objects.get().failures, 1)
+        self.assertEqual(AIReportJob.objects.get().status, AIReportJob.QUEUED)
+
+    def test_unattached_job_goes_back_to_queue(self):
+        self.client.post(self.start_url)
+        self.assertEqual(claim_jobs("test", limit=4), [])
+        AIReportJob.objects.update(started_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(len(claim_jobs("test", limit=4)), 1)
+
+    def test_superseded_run_does_not_overwrite(self):
+        self.client.post(reverse("student_ai_stat_helper"), {"action": "analyze"})
+        job_id = claim_jobs("slow", limit=1)[0]
+        job = AIReportJob.objects.select_related("student").get(id=job_id)
+        # requeue_stale вернул задачу, её взял другой воркер
+        AIReportJob.objects.filter(id=job_id).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(claim_jobs("fast", limit=1), [job_id])
+
+        self.assertIsNone(complete_job(job, {"summary": "late"}, "late"))
+        self.assertEqual(AIReportJob.objects.get().worker, "fast")
+        self.assertFalse(AIStatHelperReport.objects.exists())
+        self.assertEqual(run_job(job_id), AIReportJob.DONE)
+
+    def test_summary_reader(self):
+        reader = _SummaryReader()
+        self.assertEqual(reader.feed('{"summ'), "")
+        self.assertEqual(reader.feed('ary": "a\\nb \\u04'), "a\nb ")
+        self.assertEqual(reader.feed('1f'), "П")
+        self.assertFalse(reader.closed)
+        self.assertEqual(reader.feed('\\"x\\"", "weak'), '"x"')
+        self.assertTrue(reader.closed)
+        self.assertEqual(reader.feed('"summary": "again"'), "")
+
+        # по одному символу — тот же текст
+        text = '{"weak": [], "summary" : "a\\u0431\\\\c", "plan": []}'
+        reader = _SummaryReader()
+        self.assertEqual("".join(reader.feed(ch) for ch in text), "aб\\c")
+        self.assertTrue(reader.closed)
+
+
+class StatsRollupTests(TeacherTestCase):
+    def _finish_with(self, correct):
+        for _ in range(correct):
+            self.client.post(self.take_url, {"answer_id": self._correct_answer_id()})
+        self.client.get(self.finish_url)
+
+    def _adaptive(self, student, score, days_ago=0):
+        return AdaptiveAttempt.objects.create(
+            user=student, topic_code="python", total_questions=10, correct_answers=score // 10,
+            score_percent=score, finished_at=timezone.now() - timedelta(days=days_ago),
+        )
+
+    def test_finish_updates_rollup_once(self):
+        self._finish_with(3)
+        self.client.get(self.finish_url)
+
+        row = TeacherStatsDaily.objects.get()
+        self.assertEqual((row.teacher_id, row.student_id, row.test_key), (self.teacher.id, self.student.id, f"T-{self.test.id}"))
+        self.assertEqual((row.attempts_count, row.score_sum), (1, 60))
+
+        self.login(self.teacher)
+        response = self.client.get(reverse("teacher_statistics"))
+        self.assertEqual(response.context["total_attempts"], 1)
+        self.assertEqual(response.context["avg_score"], 60)
+        self.assertEqual(response.context["students_count"], 1)
+
+    def test_rebuild_matches_incremental_rollup(self):
+        self._finish_with(2)
+        self._adaptive(self.student, 80)
+        self._adaptive(self.student, 40, days_ago=3)
+        # попытки созданы уже закрытыми — в свёртку их добавляем так же, как adaptive_finish
+        record_adaptive_attempts(AdaptiveAttempt.objects.values_list("id", flat=True))
+
+        def snapshot():
+            return sorted(TeacherStatsDaily.objects.values_list(
+                "teacher_id", "group_id", "test_key", "student_id", "day", "attempts_count", "score_sum",
+            ))
+
+        incremental = snapshot()
+        self.assertEqual(rebuild_all(), 3)
+        self.assertEqual(snapshot(), incremental)
+
+        summary = teacher_summary(self.teacher.id)
+        self.assertEqual(summary["total_attempts"], 3)
+        self.assertEqual(summary["tests_count"], 2)
+        self.assertEqual(teacher_summary(self.teacher.id, test_key="B-python")["avg_score"], 60)
+
+    def test_moving_student_reattributes_basic_attempts(self):
+        self._adaptive(self.student, 70)
+        rebuild_all()
+        old_group = StudentsGroups.objects.get(student=self.student).group_id
+        new_group = Groups.objects.create(name="G2", teacher=self.teacher)
+
+        self.login(self.teacher)
+        self.client.post(reverse("teacher_students"), {"group_id": new_group.id, "selected_students": [self.student.id]})
+
+        self.assertEqual(teacher_summary(self.teacher.id, group_id=new_group.id)["total_attempts"], 1)
+        self.assertEqual(teacher_summary(self.teacher.id, group_id=old_group)["total_attempts"], 0)
+
+
+class ScoreTrendTests(WebappTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = cls.make_user("teacher", "teacher")
+        cls.student = cls.make_user("student", "student")
+        cls.monday = date(2025, 9, 1)
+        # пн: 2 попытки (60, 80), вт: 1 (100), следующий пн: 1 (40) — последняя в другой группе
+        for day, group_id, n, total in [(0, 1, 2, 140), (1, 1, 1, 100), (7, 2, 1, 40)]:
+            TeacherStatsDaily.objects.create(
+                teacher=cls.teacher, group_id=group_id, test_key="T-1", student=cls.student,
+                day=cls.monday + timedelta(days=day), attempts_count=n, score_sum=total,
+            )
+
+    def _trend(self, **params):
+        self.login(self.teacher)
+        return self.client.get(reverse("teacher_statistics_trend"), {"from": "2025-08-01", "to": "2025-12-31", **params})
+
+    def test_daily_and_weekly_buckets(self):
+        data = self._trend().json()
+        self.assertEqual(data["t"], ["2025-09-01", "2025-09-02", "2025-09-08"])
+        self.assertEqual((data["n"], data["avg"]), ([2, 1, 1], [70.0, 100.0, 40.0]))
+
+        data = self._trend(bucket="week").json()
+        self.assertEqual(data["t"], ["2025-09-01", "2025-09-08"])
+        self.assertEqual((data["n"], data["avg"]), ([3, 1], [80.0, 40.0]))
+
+    def test_filters_and_validation(self):
+        self.assertEqual(self._trend(group=2).json()["n"], [1])
+        self.assertEqual(self._trend(bucket="month").status_code, 400)
+        self.assertEqual(self._trend(**{"from": "2020-01-01"}).status_code, 400)
+
+
+class TeacherStatsCacheTests(TeacherTestCase):
+    def _stats(self, **params):
+        self.login(self.teacher)
+        return self.client.get(reverse("teacher_statistics"), params)
+
+    def test_second_view_is_served_from_cache(self):
+        first = self._stats()
+        with CaptureQueriesContext(connection) as ctx:
+            second = self._stats()
+        self.assertEqual(second.context["history"], first.context["history"])
+        # попадание — ни свёртки, ни таблиц попыток
+        tables = " ".join(q["sql"] for q in ctx.captured_queries)
+        for table in ("teacher_stats_daily", "testattempts", "adaptive_attempt"):
+            self.assertNotIn(table, tables.lower())
+
+        counters = self.client.get(reverse("teacher_statistics_cache")).json()
+        self.assertEqual((counters["hits"], counters["misses"]), (1, 1))
+
+    def test_finished_attempt_invalidates_cache(self):
+        self.assertEqual(self._stats().context["total_attempts"], 0)
+
+        self.login(self.student)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(self.finish_url)
+
+        self.assertEqual(self._stats().context["total_attempts"], 1)
+
+    def test_membership_change_invalidates_cache(self):
+        AdaptiveAttempt.objects.create(
+            user=self.student, topic_code="python", total_questions=10, correct_answers=7,
+            score_percent=70, finished_at=timezone.now(),
+        )
+        rebuild_all()
+        new_group = Groups.objects.create(name="G2", teacher=self.teacher)
+        self.assertEqual(self._stats(group=new_group.id, apply=1).context["total_attempts"], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("teacher_students"), {"group_id": new_group.id, "selected_students": [self.student.id]})
+
+        self.assertEqual(self._stats(group=new_group.id, apply=1).context["total_attempts"], 1)
+
+
+class TeacherExportTests(TeacherTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.post(self.take_url, {"answer_id": self._correct_answer_id()})
+        self.client.get(self.finish_url)
+        self.login(self.teacher)
+
+    def _export(self, **params):
+        response = self.client.get(reverse("teacher_statistics_export"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def test_csv_attempts_and_answers(self):
+        rows = list(csv.reader(io.StringIO(self._export(data="attempts").decode("utf-8-sig"))))
+        self.assertEqual(rows[0][:3], ["kind", "attempt_id", "student_id"])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][3], self.student.username)
+        self.assertEqual(rows[1][-1], "20")
+
+        rows = list(csv.reader(io.StringIO(self._export(data="answers").decode("utf-8-sig"))))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][-1], "1")
+        # правильный вариант teacher-теста берётся из answers
+        self.assertEqual(rows[1][-2], "A0")
+
+    def test_csv_neutralises_formulas(self):
+        for value in ("=1+1", "@SUM(A1)", "\t=1+1", "\r=1+1"):
+            self.assertEqual(_csv_safe(value), "'" + value)
+        self.assertEqual(_csv_safe("-5"), "-5")
+        self.assertEqual(_csv_safe("text"), "text")
+
+    def test_xlsx_is_valid_zip(self):
+        with zipfile.ZipFile(io.BytesIO(self._export(data="attempts", format="xlsx"))) as zf:
+            self.assertIn("xl/workbook.xml", zf.namelist())
+            sheet = zf.read("xl/worksheets/sheet1.xml").decode("utf-8")
+        self.assertIn(self.student.username, sheet)
+        self.assertEqual(sheet.count("<row>"), 2)
+
+    def test_unknown_export_is_rejected(self):
+        response = self.client.get(reverse("teacher_statistics_export"), {"format": "pdf"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_student_in_two_groups_exported_once(self):
+        StudentsGroups.objects.create(student=self.student, group=Groups.objects.create(name="G2", teacher=self.teacher))
+        AdaptiveAttempt.objects.create(user=self.student, topic_code="python-basics", finished_at=timezone.now())
+        rows = list(csv.reader(io.StringIO(self._export(data="attempts").decode("utf-8-sig"))))
+        self.assertEqual([row[0] for row in rows[1:]], ["teacher", "basic"])
+        self.assertEqual(rows[2][4], "G1")
+
+
+class ItemAnalysisTests(TeacherTestCase):
+    # строки — попытки, столбцы — вопросы; 1 — верный вариант A0, 0 — дистрактор A1
+    MATRIX = [
+        [1, 1, 1, 1, 1],
+        [1, 1, 1, 1, 0],
+        [1, 1, 0, 0, 0],
+        [1, 0, 0, 0, 1],
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        questions = list(Questions.objects.filter(test=cls.test).order_by("id"))
+        for i, row in enumerate(cls.MATRIX):
+            attempt = Testattempts.objects.create(
+                user=cls.make_user(f"ia{i}", "student"), test=cls.test, schedule=cls.schedule,
+                started_at=timezone.now(), finished_at=timezone.now(), score=sum(row) * 20,
+            )
+            for q, ok in zip(questions, row):
+                answer = Answers.objects.get(question=q, answer_text="A0" if ok else "A1")
+                Useranswers.objects.create(attempt=attempt, question=q, answer=answer, is_correct=bool(ok))
+
+    def test_statistics(self):
+        analysis = get_item_analysis(self.test.id)
+        self.assertEqual((analysis["attempts"], analysis["band_size"]), (4, 1))
+        self.assertEqual([x["p_value"] for x in analysis["items"]], [1.0, 0.75, 0.5, 0.5, 0.5])
+        # верхняя группа — первая попытка, нижняя — последняя (при равных баллах — большая id)
+        self.assertEqual([x["discrimination"] for x in analysis["items"]], [0.0, 1.0, 1.0, 1.0, 0.0])
+        self.assertEqual(analysis["items"][0]["flags"], ["too_easy", "low_discrimination"])
+        self.assertAlmostEqual(analysis["kr20"], 0.556, places=3)
+
+        last = analysis["items"][4]["options"]
+        self.assertEqual([o["picks"] for o in last], [2, 2, 0, 0])
+        self.assertFalse(any(o["misleading"] for o in last))
+
+    def test_cached_until_next_attempt_finishes(self):
+        get_item_analysis(self.test.id)
+        with self.assertNumQueries(0):
+            get_item_analysis(self.test.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(self.finish_url)
+        self.assertEqual(get_item_analysis(self.test.id)["attempts"], 5)
+
+    def test_page_is_author_only(self):
+        url = reverse("test_item_analysis", args=[self.test.id])
+        self.login(self.teacher)
+        self.assertContains(self.client.get(url), "KR-20")
+
+        self.login(self.make_user("stranger", "teacher"))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class AttemptHistoryTests(TeacherTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = cls.make_user("other", "student")
+        StudentsGroups.objects.create(student=cls.other, group=cls.schedule.group)
+        now = timezone.now()
+        # одинаковые finished_at у пар попыток — проверка tie-break по (kind, id)
+        for i in range(12):
+            done = now - timedelta(minutes=i // 2)
+            Testattempts.objects.create(
+                user=cls.other, test=cls.test, schedule=cls.schedule,
+                started_at=done, finished_at=done, score=i,
+            )
+            AdaptiveAttempt.objects.create(
+                user=cls.other, topic_code="python-basics", finished_at=done, score_percent=i,
+            )
+
+    def test_pages_cover_history_once_in_order(self):
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(1):
+                page = teacher_history(self.teacher.id, cursor=cursor, limit=5)
+            seen += [(row["done_at"], row["kind"], row["row_id"]) for row in page.items]
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 24)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_filters_match_stats_page(self):
+        basic = teacher_history(self.teacher.id, test_key="B-python-basics", limit=100).items
+        self.assertEqual({row["kind"] for row in basic}, {"basic"})
+        self.assertEqual(len(basic), 12)
+        teacher = teacher_history(self.teacher.id, test_key=f"T-{self.test.id}", limit=100).items
+        self.assertEqual(len(teacher), 12)
+        self.assertEqual(teacher[0]["group_name"], "G1")
+
+    def test_student_in_two_groups_listed_once(self):
+        StudentsGroups.objects.create(student=self.other, group=Groups.objects.create(name="G2", teacher=self.teacher))
+        basic = teacher_history(self.teacher.id, test_key="B-python-basics", limit=100).items
+        self.assertEqual(len(basic), 12)
+        self.assertEqual({row["group_name"] for row in basic}, {"G1"})
+
+    def test_cursor_roundtrip(self):
+        done = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(done, "basic", 7)), (done, "basic", 7))
+        self.assertIsNone(decode_cursor("garbage"))
+
+    def test_statistics_page_links_older_history(self):
+        self.login(self.teacher)
+        response = self.client.get(reverse("teacher_statistics"))
+        self.assertEqual(len(response.context["history"]), 24)
+        self.assertIsNone(response.context["history_next_cursor"])
+
+
+class LeaderboardTests(WebappTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = cls.make_user("teacher", "teacher")
+        author = cls.make_user("author", "teacher")
+        cls.group = Groups.objects.create(name="G1", teacher=cls.teacher)
+        today = timezone.localdate()
+        cls.students = []
+        # средние: 90, 70, 70, 40; у первого две попытки по разным тестам
+        for name, rows in [("s90", [("T-1", 1, 80), ("B-python", 1, 100)]), ("s70a", [("T-1", 2, 140)]),
+                           ("s70b", [("T-1", 1, 70)]), ("s40", [("T-1", 1, 40)])]:
+            student = cls.make_user(name, "student")
+            StudentsGroups.objects.create(student=student, group=cls.group)
+            cls.students.append(student)
+            for test_key, n, total in rows:
+                for teacher in (cls.teacher, author):
+                    TeacherStatsDaily.objects.create(
+                        teacher=teacher, group_id=cls.group.id, test_key=test_key, student=student,
+                        day=today, attempts_count=n, score_sum=total,
+                    )
+
+    def test_group_board_ranks_in_sql(self):
+        with self.assertNumQueries(1):
+            board = group_leaderboard(self.teacher.id, self.group.id)
+        rows = board["rows"]
+        self.assertEqual([r["student_name"] for r in rows], ["s90", "s70a", "s70b", "s40"])
+        self.assertEqual([r["rank"] for r in rows], [1, 2, 2, 4])
+        self.assertEqual([r["percentile"] for r in rows], [100, 33, 33, 0])
+        self.assertEqual(board["median"], 70)
+        self.assertEqual([r["delta"] for r in rows], [20, 0, 0, -30])
+
+        per_test = group_leaderboard(self.teacher.id, self.group.id, test_key="T-1")["rows"]
+        self.assertEqual(per_test[0]["score"], 80)
+
+    def test_student_standing(self):
+        (standing,) = student_standings(self.students[3].id)
+        self.assertEqual((standing["group"], standing["rank"], standing["size"]), ("G1", 4, 4))
+        self.assertEqual(standing["delta"], -30)
+
+    def test_page_is_group_teacher_only(self):
+        url = reverse("teacher_group_leaderboard", args=[self.group.id])
+        self.login(self.teacher)
+        response = self.client.get(url, {"test": "T-1"})
+        self.assertEqual(response.context["selected_test"], "T-1")
+        self.assertEqual(len(response.context["rows"]), 4)
+
+        self.login(self.make_user("stranger", "teacher"))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class StudentProgressPagesTests(WebappTestCase):
+    ATTEMPTS = 40
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = cls.make_user("teacher", "teacher")
+        cls.student = cls.make_user("student", "student")
+        topic = Topics.objects.create(name="Python")
+        test = Tests.objects.create(title="Quiz", topic=topic, difficulty="easy", time_limit=30, created_by=cls.teacher)
+        group = Groups.objects.create(name="G1", teacher=cls.teacher)
+        StudentsGroups.objects.create(student=cls.student, group=group)
+        now = timezone.now()
+        for i in range(cls.ATTEMPTS // 2):
+            done = now - timedelta(hours=i)
+            Testattempts.objects.create(user=cls.student, test=test, started_at=done, finished_at=done, score=50)
+            AdaptiveAttempt.objects.create(user=cls.student, topic_code="python-basics", finished_at=done, score_percent=90)
+        # старая попытка без score — процент из correct/total
+        Testattempts.objects.create(
+            user=cls.student, test=test, started_at=now, finished_at=now,
+            total_questions=4, correct_answers=3,
+        )
+
+    def test_student_progress_is_bounded(self):
+        self.login(self.student)
+        # session, user, 2 агрегата, страница истории, группы студента, рейтинг групп
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse("student_progress"))
+        self.assertEqual(response.context["total_attempts"], self.ATTEMPTS + 1)
+        self.assertEqual(response.context["best_result"], 90.0)
+        self.assertEqual(response.context["avg_score"], round((20 * 50 + 20 * 90 + 75) / 41, 1))
+        self.assertEqual(len(response.context["history"]), HISTORY_PAGE_SIZE)
+        self.assertEqual(response.context["history"][0]["score"], 75)
+
+        cursor = response.context["history_next_cursor"]
+        older = self.client.get(reverse("student_progress"), {"cursor": cursor})
+        self.assertEqual(len(older.context["history"]), self.ATTEMPTS + 1 - HISTORY_PAGE_SIZE)
+        self.assertIsNone(older.context["history_next_cursor"])
+
+    def test_teacher_student_profile_is_bounded(self):
+        self.login(self.teacher)
+        url = reverse("teacher_student_profile", args=[self.student.id])
+        # session, user, student, группа, 2 агрегата, страница истории
+        with self.assertNumQueries(7):
+            response = self.client.get(url)
+        self.assertEqual(response.context["total_attempts"], self.ATTEMPTS + 1)
+        self.assertEqual(response.context["best_score"], 90)
+        self.assertEqual(len(response.context["history"]), HISTORY_PAGE_SIZE)
+
+
+class AdaptiveBankTests(WebappTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.question = AdaptiveQuestion.objects.create(
+            topic_code="python-basics", level=1, text="Цикл while",
+            option_a="a", option_b="b", option_c="c", option_d="d", correct_option="A",
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bank_version_bumps_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            self.question.text = "Цикл for"
+            self.question.save()
+            self.assertIsNone(cache.get(BANK_VERSION_KEY))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(cache.get(BANK_VERSION_KEY), 1)
+        self.assertEqual(question_bank.get(self.question.id).text, "Цикл for")
+
+    def test_reanswer_moves_counters_by_delta(self):
+        student = self.make_user("student", "student")
+        attempt = AdaptiveAttempt.objects.create(user=student, topic_code="python-basics")
+
+        def counters():
+            attempt.refresh_from_db()
+            return attempt.total_questions, attempt.correct_answers
+
+        _record_adaptive_answer(attempt.id, self.question.id, "A", True)
+        self.assertEqual(counters(), (1, 1))
+        # повторный ответ на тот же вопрос: total не растёт, correct сдвигается на разницу
+        _record_adaptive_answer(attempt.id, self.question.id, "B", False)
+        self.assertEqual(counters(), (1, 0))
+        _record_adaptive_answer(attempt.id, self.question.id, "C", False)
+        self.assertEqual(counters(), (1, 0))
+        self.assertEqual(AdaptiveAttemptAnswer.objects.get(attempt=attempt).chosen_option, "C")
+
+
+    def test_identical_reimport_writes_nothing(self):
+        items = [
+            {"topic_code": "python-basics", "level": level, "text": f"Вопрос {level}",
+             "options": ["a", "b", "c", "d"], "correct": level}
+            for level in (1, 2, 3)
+        ]
+        first = import_questions(items)
+        self.assertEqual(first.created, 3)
+
+        with CaptureQueriesContext(connection) as ctx:
+            second = import_questions(items)
+        writes = [
+            q["sql"] for q in ctx.captured_queries
+            if q["sql"].lstrip().upper().startswith(("INSERT", "UPDATE", "DELETE"))
+        ]
+        self.assertEqual(writes, [])
+        self.assertEqual((second.created, second.updated, second.reactivated, second.unchanged), (0, 0, 0, 3))
+
+
+@skipUnless(irt, "numpy не установлен")
+@override_settings(IRT_MODEL="2pl", IRT_MIN_ITEMS=2, IRT_MAX_ITEMS=4, IRT_SE_TARGET=0.5)
+class IRTEngineTests(SimpleTestCase):
+    def _pool(self, b):
+        return irt.ItemPool(range(1, len(b) + 1), [1.0] * len(b), b)
+
+    @override_settings(IRT_RANDOMESQUE_K=1)
+    def test_select_most_informative(self):
+        pool = self._pool([-1.0, 0.0, 1.0])
+        self.assertEqual(pool.select(0.0, []), 2)
+        self.assertEqual(pool.select(0.9, []), 3)
+        self.assertEqual(pool.select(0.9, [3]), 2)
+        self.assertIsNone(pool.select(0.0, [1, 2, 3]))
+
+    @override_settings(IRT_RANDOMESQUE_K=2)
+    def test_select_is_randomesque(self):
+        pool = self._pool([-2.0, -0.1, 0.1, 2.0])
+        rng = np.random.default_rng(0)
+        picks = {pool.select(0.0, [], rng) for _ in range(50)}
+        self.assertEqual(picks, {2, 3})
+        self.assertEqual({pool.select(0.0, [2], rng) for _ in range(50)}, {1, 3})
+
+    def test_bench_is_reproducible_with_seed(self):
+        def run():
+            out = io.StringIO()
+            call_command("bench_irt", items=200, students=20, seed=7, stdout=out)
+            # время выбора от запуска к запуску разное — сравниваем длину теста и точность
+            return [line for line in out.getvalue().splitlines() if not line.startswith("select")]
+
+        self.assertEqual(run(), run())
+
+    def test_estimate_theta(self):
+        self.assertEqual(irt.estimate_theta(np.array([]), np.array([]), np.array([])), (0.0, 1.0))
+        a, b = np.ones(4), np.zeros(4)
+        up, se_up = irt.estimate_theta(a, b, np.ones(4))
+        down, se_down = irt.estimate_theta(a, b, np.zeros(4))
+        self.assertGreater(up, 0.5)
+        self.assertAlmostEqual(up, -down, places=6)
+        self.assertAlmostEqual(se_up, se_down, places=6)
+        self.assertLess(se_up, 1.0)
+
+    def test_should_stop(self):
+        def state(n, se):
+            return {"responses": [[i, 1] for i in range(n)], "se": se}
+
+        self.assertFalse(irt.should_stop(state(1, 0.1)))
+        self.assertTrue(irt.should_stop(state(2, 0.4)))
+        self.assertFalse(irt.should_stop(state(3, 0.6)))
+        self.assertTrue(irt.should_stop(state(4, 0.9)))
+
+
+@skipUnless(np is not None, "numpy не установлен")
+class CalibrateAdaptiveTests(WebappTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = cls.make_user("student", "student")
+        cls.questions = [
+            AdaptiveQuestion.objects.create(
+                topic_code="python-basics", level=1, text=f"Вопрос {i}",
+                option_a="a", option_b="b", option_c="c", option_d="d", correct_option="A",
+            )
+            for i in range(2)
+        ]
+
+    def _attempt(self, minutes_ago, questions=None):
+        attempt = AdaptiveAttempt.objects.create(
+            user=self.student, topic_code="python-basics", total_questions=2, correct_answers=1,
+            finished_at=timezone.now() - timedelta(minutes=minutes_ago),
+        )
+        for q, ok in zip(questions or self.questions, (True, False)):
+            AdaptiveAttemptAnswer.objects.create(attempt=attempt, question=q, chosen_option="A", is_correct=ok)
+
+    def _answers(self):
+        return AdaptiveQuestionStats.objects.get(question=self.questions[0]).answers_count
+
+    def test_incremental_window_with_lag(self):
+        self._attempt(minutes_ago=10)
+        # завершена внутри lag — её транзакция могла быть ещё открыта
+        self._attempt(minutes_ago=1)
+
+        call_command("calibrate_adaptive", "--lag-sec", "300", stdout=io.StringIO())
+        self.assertEqual(self._answers(), 1)
+
+        # следующий запуск добирает попытку из окна lag, уже учтённые не считаются повторно
+        call_command("calibrate_adaptive", "--lag-sec", "0", stdout=io.StringIO())
+        self.assertEqual(self._answers(), 2)
+        call_command("calibrate_adaptive", "--lag-sec", "0", stdout=io.StringIO())
+        self.assertEqual(self._answers(), 2)
+
+    def test_reimported_edit_resets_stats(self):
+        items = [
+            {"topic_code": "python-basics", "level": 1, "key": f"k{i}", "text": f"Импорт {i}",
+             "options": ["a", "b", "c", "d"], "correct": 0}
+            for i in range(2)
+        ]
+        import_questions(items, deactivate_missing=False)
+        imported = list(AdaptiveQuestion.objects.filter(source_key__in=["k0", "k1"]).order_by("source_key"))
+        self._attempt(minutes_ago=10, questions=imported)
+        call_command("calibrate_adaptive", "--lag-sec", "0", stdout=io.StringIO())
+
+        items[0]["correct"] = 1
+        self.assertEqual(import_questions(items, deactivate_missing=False).updated, 1)
+        self.assertFalse(AdaptiveQuestionStats.objects.filter(question=imported[0]).exists())
+
+        self._attempt(minutes_ago=0, questions=imported)
+        call_command("calibrate_adaptive", "--lag-sec", "0", stdout=io.StringIO())
+        counts = dict(
+            AdaptiveQuestionStats.objects.filter(question__in=imported).values_list("question_id", "answers_count")
+        )
+        # после правки — только новые ответы; неизменённый вопрос копит дальше
+        self.assertEqual(counts, {imported[0].id: 1, imported[1].id: 2})
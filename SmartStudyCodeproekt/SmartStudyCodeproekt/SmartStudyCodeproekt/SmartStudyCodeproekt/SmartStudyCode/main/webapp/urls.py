@@ -34,7 +34,9 @@ urlpatterns = [
     path("teacher/tests/", views.teacher_tests, name="teacher_tests"),
     path("teacher/tests/create/", views.create_test, name="create_test"),
     path("teacher/tests/create/questions/<int:test_id>/", views.add_questions, name="add_questions"),
+    path("teacher/tests/<int:test_id>/import/", views.import_questions_file, name="import_questions_file"),
     path("teacher/tests/preview/<int:test_id>/", views.test_preview, name="test_preview"),
+    path("teacher/tests/<int:test_id>/analysis/", views.test_item_analysis, name="test_item_analysis"),
     path("teacher/questions/<int:question_id>/edit/", views.edit_question, name="edit_question"),
     path("teacher/questions/<int:question_id>/delete/", views.delete_question, name="delete_question"),
     path("teacher/tests/<int:test_id>/delete/", views.delete_test, name="delete_test"),
@@ -49,6 +51,10 @@ urlpatterns = [
     # Учитель: статистика
     path("teacher/statistics/", views.teacher_statistics, name="teacher_statistics"),
     path("teacher/statistics/students/", views.teacher_statistics_students, name="teacher_statistics_students"),
+    path("teacher/groups/<int:group_id>/leaderboard/", views.teacher_group_leaderboard, name="teacher_group_leaderboard"),
+    path("teacher/statistics/trend/", views.teacher_statistics_trend, name="teacher_statistics_trend"),
+    path("teacher/statistics/export/", views.teacher_statistics_export, name="teacher_statistics_export"),
+    path("teacher/statistics/cache/", views.teacher_statistics_cache, name="teacher_statistics_cache"),
 
     # Студент: профиль / группа / прогресс / тесты
     path("student/profile/", views.student_profile, name="student_profile"),
@@ -58,6 +64,8 @@ urlpatterns = [
     path("student/teacher-tests/<int:schedule_id>/", views.student_teacher_test_info, name="student_teacher_test_info"),
     path("student/teacher-tests/<int:schedule_id>/start/", views.teacher_test_start, name="teacher_test_start"),
     path("student/teacher-tests/attempt/<int:attempt_id>/take/", views.teacher_test_take, name="teacher_test_take"),
+    path("student/teacher-tests/attempt/<int:attempt_id>/payload/", views.teacher_test_payload, name="teacher_test_payload"),
+    path("student/teacher-tests/attempt/<int:attempt_id>/answers/", views.teacher_test_answers, name="teacher_test_answers"),
     path("student/teacher-tests/attempt/<int:attempt_id>/finish/", views.teacher_test_finish, name="teacher_test_finish"),
 
     # Студент: базовые адаптивные тесты
@@ -70,4 +78,7 @@ urlpatterns = [
     path("teacher/basic-attempts/<int:attempt_id>/preview/", views.teacher_basic_attempt_preview, name="teacher_basic_attempt_preview"),
 
     path("student/ai-stat-helper/", views.student_ai_stat_helper, name="student_ai_stat_helper"),
+    path("student/ai-stat-helper/status/", views.student_ai_stat_helper_status, name="student_ai_stat_helper_status"),
+    path("student/ai-stat-helper/start/", views.student_ai_stat_helper_start, name="student_ai_stat_helper_start"),
+    path("student/ai-stat-helper/stream/", views.student_ai_stat_helper_stream, name="student_ai_stat_helper_stream"),
 ]
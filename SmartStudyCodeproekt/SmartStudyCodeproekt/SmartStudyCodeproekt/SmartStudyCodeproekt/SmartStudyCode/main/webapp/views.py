@@ -2,15 +2,26 @@
 from __future__ import annotations
 
 # Imports
+from contextlib import closing
 from urllib.parse import unquote
-from datetime import datetime, timezone as dt_timezone
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 from django.conf import settings
-from .models import AIStatHelperReport
-from .ai_stat_helper import build_ai_stat_snapshot, generate_ai_stat_report, snapshot_hash
+from .models import AIReportJob, AIStatHelperReport
+from .ai_jobs import (
+    ACTIVE as AI_JOB_ACTIVE,
+    AIReportQuotaExceeded,
+    attach_stream_job,
+    enqueue_report_job,
+    latest_job,
+    start_stream_job,
+    stream_job,
+)
+from .ai_stat_helper import current_snapshot
+from .llm_client import CircuitOpenError, circuit_open
 from django.contrib.auth.hashers import check_password, make_password
 from django.db import IntegrityError, transaction
-from django.db.models import Avg, Count, Prefetch, Q
-from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.db.models import Count, F, Prefetch, Q
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 from django.utils import timezone
@@ -18,16 +29,44 @@ from django.utils import translation
 from django.views.decorators.http import require_http_methods
 import hashlib, json
 
+from .attempt_finalizer import rounded_percent
 from .auth_utils import login_user, logout_user, require_role
+from .exports import EXPORTS, FORMATS
+from .item_analysis import get_item_analysis
+from .leaderboard import group_leaderboard, student_standings
+from .question_bank import BankQuestion, question_bank
+from .teacher_test_payload import get_test_payload, invalidate_test_payload, prewarm_test_payload
+from .services import student_history, student_summary, teacher_history
+from .stats_cache import cache_counters, get_teacher_stats, invalidate_teacher_stats
+from .stats_rollup import (
+    record_adaptive_attempts,
+    record_teacher_attempts,
+    refresh_basic_rollup,
+    teacher_summary,
+    teacher_trend,
+)
+from .teacher_question_import import (
+    FORMATS as IMPORT_FORMATS,
+    ImportErrors,
+    import_test_questions,
+    parse_questions,
+    validate_questions,
+)
+
+try:
+    from . import irt
+except ImportError:  # numpy не установлен — доступен только движок streak
+    irt = None
 from .models import (
     AdaptiveAttempt,
     AdaptiveAttemptAnswer,
-    AdaptiveQuestion,
     Answers,
+    AttemptQuestionSheet,
     Groups,
     Profiles,
     Questions,
     StudentsGroups,
+    TeacherStatsDaily,
     Testattempts,
     Tests,
     TestSchedule,
@@ -54,7 +93,13 @@ DIFFICULTY_MAP = {
 LEVEL_NAME = {1: "Beginner", 2: "Medium", 3: "Advanced"}
 
 TEST_LEN = 10
-TIME_LIMIT_SEC = 10 * 60
+TIME_LIMIT_SEC = int(getattr(settings, "ADAPTIVE_TIME_LIMIT_SEC", 10 * 60))
+
+# самый длинный период графика динамики teacher_statistics, дней (два года)
+TREND_MAX_DAYS = 731
+
+# "streak" — уровни 1..3 и фиксированные TEST_LEN вопросов, "irt" — webapp/irt.py
+ADAPTIVE_ENGINE = getattr(settings, "ADAPTIVE_ENGINE", "streak")
 
 
 # Общие helpers
@@ -86,7 +131,7 @@ def _attempt_duration_sec(attempt: Testattempts) -> int | None:
     return tl * 60
 
 
-def _attempt_remaining_sec(attempt: Testattempts) -> int | None:
+def _attempt_remaining_sec(attempt: Testattempts, grace_sec: int = 0) -> int | None:
     started = attempt.started_at
     if started is None:
         started = timezone.now()
@@ -99,7 +144,30 @@ def _attempt_remaining_sec(attempt: Testattempts) -> int | None:
 
     now = timezone.now()
     elapsed = int((now - started).total_seconds())
-    return max(0, duration - elapsed)
+    return max(0, duration + grace_sec - elapsed)
+
+
+def _history_items(page) -> list[dict]:
+    """Строки services.*_history -> словари для шаблонов истории."""
+    items = []
+    for row in page.items:
+        title = row["title"]
+        topic = row["topic"]
+        if row["kind"] == "basic":
+            title = topic = TOPIC_TITLES.get(row["title"], row["title"])
+        items.append({
+            "kind": row["kind"],
+            "attempt_id": row["row_id"],  # <-- нужно для Preview
+            "title": title or "Teacher test",
+            "topic": topic or "",
+            "author": row["author"] or "—",
+            "student": row["student_name"] or "—",
+            "student_id": row["student_ref"],
+            "group": row["group_name"],
+            "dt": _aware(row["done_at"]),
+            "score": int(row["score_value"] or 0),
+        })
+    return items
 
 
 # Главная / Auth
@@ -388,6 +456,8 @@ def teacher_students(request: HttpRequest) -> HttpResponse:
                     for sid in allowed_ids:
                         StudentsGroups.objects.get_or_create(student_id=sid, group=group)
 
+                    refresh_basic_rollup(teacher.id, allowed_ids)
+
         return redirect("teacher_students")
 
     students_qs = (
@@ -455,6 +525,8 @@ def teacher_groups(request: HttpRequest) -> HttpResponse:
                 for sid in selected_ids_int:
                     StudentsGroups.objects.get_or_create(student_id=sid, group=ungrouped)
 
+                refresh_basic_rollup(teacher.id, selected_ids_int)
+
             return redirect(f"{request.path}?group_id={ungrouped.id}")
 
         if action == "restore":
@@ -475,6 +547,8 @@ def teacher_groups(request: HttpRequest) -> HttpResponse:
                 for sid in selected_ids_int:
                     StudentsGroups.objects.get_or_create(student_id=sid, group=target)
 
+                refresh_basic_rollup(teacher.id, selected_ids_int)
+
             return redirect(f"{request.path}?group_id={target.id}")
 
         return redirect("teacher_groups")
@@ -614,6 +688,7 @@ def add_questions(request: HttpRequest, test_id: int) -> HttpResponse:
                 "test": test,
                 "questions": questions,
                 "error": "Fill question and all answers",
+                "import_accept": ",".join(IMPORT_FORMATS),
             })
 
         if correct not in (1, 2, 3, 4):
@@ -631,6 +706,8 @@ def add_questions(request: HttpRequest, test_id: int) -> HttpResponse:
             for i, txt in enumerate(answers_text, start=1):
                 Answers.objects.create(question=q, answer_text=txt, is_correct=(i == correct))
 
+        invalidate_test_payload(test.id)
+
         return redirect("add_questions", test_id=test.id)
 
     questions = (
@@ -640,7 +717,44 @@ def add_questions(request: HttpRequest, test_id: int) -> HttpResponse:
         .order_by("id")
     )
 
-    return render(request, "webapp/add_questions.html", {"test": test, "questions": questions})
+    return render(request, "webapp/add_questions.html", {
+        "test": test,
+        "questions": questions,
+        "import_accept": ",".join(IMPORT_FORMATS),
+    })
+
+
+IMPORT_MAX_BYTES = 2 * 1024 * 1024
+
+
+@require_role("teacher")
+@require_http_methods(["POST"])
+def import_questions_file(request: HttpRequest, test_id: int) -> HttpResponse:
+    teacher: Users = request.current_user
+    test = get_object_or_404(Tests, id=test_id, created_by=teacher)
+
+    upload = request.FILES.get("file")
+    try:
+        if upload is None:
+            raise ImportErrors(["Choose a file to import"])
+        if upload.size > IMPORT_MAX_BYTES:
+            raise ImportErrors([f"File is too large (max {IMPORT_MAX_BYTES // (1024 * 1024)} MB)"])
+        try:
+            text = upload.read().decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise ImportErrors(["File must be UTF-8 encoded"])
+        items = validate_questions(parse_questions(upload.name, text))
+    except ImportErrors as e:
+        questions = Questions.objects.filter(test=test).prefetch_related("answers_set").order_by("id")
+        return render(request, "webapp/add_questions.html", {
+            "test": test,
+            "questions": questions,
+            "import_errors": e.errors,
+            "import_accept": ",".join(IMPORT_FORMATS),
+        }, status=400)
+
+    import_test_questions(test, items)
+    return redirect("add_questions", test_id=test.id)
 
 
 @require_role("teacher")
@@ -667,6 +781,14 @@ def test_preview(request: HttpRequest, test_id: int) -> HttpResponse:
     return render(request, "webapp/test_preview.html", {"test": test, "questions": questions})
 
 
+@require_role("teacher")
+@require_http_methods(["GET"])
+def test_item_analysis(request: HttpRequest, test_id: int) -> HttpResponse:
+    teacher: Users = request.current_user
+    test = get_object_or_404(Tests, id=test_id, created_by=teacher)
+    return render(request, "webapp/item_analysis.html", {"test": test, "analysis": get_item_analysis(test.id)})
+
+
 @require_role("teacher")
 @require_http_methods(["GET", "POST"])
 def edit_question(request: HttpRequest, question_id: int) -> HttpResponse:
@@ -693,6 +815,8 @@ def edit_question(request: HttpRequest, question_id: int) -> HttpResponse:
             ans.is_correct = (idx == correct_index)
             ans.save(update_fields=["answer_text", "is_correct"])
 
+        invalidate_test_payload(question.test_id)
+
         return redirect("test_preview", test_id=question.test_id)
 
     return render(request, "webapp/edit_question.html", {"question": question, "answers": answers})
@@ -711,6 +835,7 @@ def delete_question(request: HttpRequest, question_id: int) -> HttpResponse:
     with transaction.atomic():
         Answers.objects.filter(question=question).delete()
         question.delete()
+    invalidate_test_payload(test_id)
 
     return redirect("test_preview", test_id=test_id)
 
@@ -726,6 +851,8 @@ def delete_test(request: HttpRequest, test_id: int) -> HttpResponse:
         Answers.objects.filter(question_id__in=q_ids).delete()
         Questions.objects.filter(id__in=q_ids).delete()
         test.delete()
+    invalidate_test_payload(test_id)
+    invalidate_teacher_stats([teacher.id])
 
     return redirect("teacher_tests")
 
@@ -764,6 +891,8 @@ def schedule_test(request: HttpRequest, test_id: int) -> HttpResponse:
 
         with transaction.atomic():
             TestSchedule.objects.update_or_create(test=test, group=group, defaults={"scheduled_at": dt})
+            # к scheduled_at вся группа придёт за одними и теми же вопросами — кладём их в cache заранее
+            transaction.on_commit(lambda: prewarm_test_payload(test.id))
 
         return redirect("teacher_tests")
 
@@ -927,104 +1056,40 @@ def teacher_statistics(request: HttpRequest) -> HttpResponse:
             if not allowed_students.filter(id=sid).exists():
                 selected_student = "all"
 
-    teacher_attempts = (
-        Testattempts.objects
-        .select_related("user", "test", "test__topic", "schedule", "schedule__group", "test__created_by")
-        .filter(Q(schedule__group__teacher=teacher) | Q(test__created_by=teacher))
-    )
-
-    basic_attempts = (
-        AdaptiveAttempt.objects
-        .select_related("user")
-        .filter(user__role="student", user__studentsgroups__group__teacher=teacher)
-        .distinct()
-    )
-
-    if selected_group != "all":
-        gid = int(selected_group)
-        teacher_attempts = teacher_attempts.filter(schedule__group_id=gid)
-        basic_attempts = basic_attempts.filter(user__studentsgroups__group_id=gid)
-
-    if selected_student != "all":
-        sid = int(selected_student)
-        teacher_attempts = teacher_attempts.filter(user_id=sid)
-        basic_attempts = basic_attempts.filter(user_id=sid)
-
-    if selected_test.startswith("T-"):
-        tid = selected_test[2:].strip()
-        if tid.isdigit():
-            teacher_attempts = teacher_attempts.filter(test_id=int(tid))
-        basic_attempts = basic_attempts.none()
-    elif selected_test.startswith("B-"):
-        code = selected_test[2:].strip()
-        basic_attempts = basic_attempts.filter(topic_code=code)
-        teacher_attempts = teacher_attempts.none()
-
-    t_count = teacher_attempts.count()
-    b_count = basic_attempts.count()
-    total_attempts = t_count + b_count
-
-    t_avg = teacher_attempts.aggregate(a=Avg("score"))["a"] or 0.0
-    b_avg = basic_attempts.aggregate(a=Avg("score_percent"))["a"] or 0.0
-    avg_score = ((t_avg * t_count + b_avg * b_count) / total_attempts) if total_attempts else 0.0
-
-    student_ids = set(teacher_attempts.values_list("user_id", flat=True)) | set(basic_attempts.values_list("user_id", flat=True))
-    students_count = len(student_ids)
-
-    teacher_test_ids = set(teacher_attempts.values_list("test_id", flat=True))
-    basic_codes = set(basic_attempts.values_list("topic_code", flat=True))
-    tests_count = len(teacher_test_ids) + len(basic_codes)
-
-    basic_title_map = {x["code"]: x["title"] for x in BASIC_TESTS}
-
-    # student -> group map (для показа группы даже если schedule пустой)
-    links = (
-        StudentsGroups.objects
-        .select_related("group")
-        .filter(group__teacher=teacher)
-    )
-    group_by_student = {l.student_id: l.group.name for l in links if l.group_id}
+    filters = {
+        "group_id": int(selected_group) if selected_group != "all" else None,
+        "student_id": int(selected_student) if selected_student != "all" else None,
+        "test_key": selected_test if selected_test != "all" else None,
+    }
+    cursor = request.GET.get("cursor")
 
-    history = []
+    def build_stats() -> dict:
+        # карточки — из свёртки TeacherStatsDaily (webapp/stats_rollup.py), а не по всем попыткам
+        summary = teacher_summary(teacher.id, **filters)
 
-    for a in teacher_attempts.order_by("-started_at")[:50]:
-        group_name = "—"
-        if a.schedule_id and a.schedule and a.schedule.group:
-            group_name = a.schedule.group.name
-        else:
-            group_name = group_by_student.get(a.user_id, "—")
-
-        history.append({
-            "kind": "teacher",
-            "attempt_id": a.id,  # <-- нужно для Preview
-            "title": a.test.title if a.test else "Teacher test",
-            "topic": getattr(getattr(a.test, "topic", None), "name", str(getattr(a.test, "topic", ""))),
-            "author": getattr(getattr(a.test, "created_by", None), "username", "—"),
-            "student": getattr(getattr(a, "user", None), "username", "—"),
-            "group": group_name,
-            "dt": a.finished_at or a.started_at,
-            "score": a.score if a.score is not None else 0,
-        })
-
-    for a in basic_attempts.order_by("-started_at")[:50]:
-     history.append({
-        "kind": "basic",
-        "attempt_id": a.id,   
-        "title": basic_title_map.get(a.topic_code, a.topic_code),
-        "author": "System",
-        "student": getattr(getattr(a, "user", None), "username", "—"),
-        "group": group_by_student.get(a.user_id, "—"),
-        "topic": basic_title_map.get(a.topic_code, a.topic_code),
-        "dt": a.finished_at or a.started_at,
-        "score": int(a.score_percent or 0),
-    })
+        # история — страница UNION по обоим видам попыток (webapp/services.py)
+        page = teacher_history(teacher.id, cursor=cursor, **filters)
+        history = _history_items(page)
 
+        # попытки без schedule: группу берём по членству студента
+        no_group = {x["student_id"] for x in history if not x["group"]}
+        group_by_student = {}
+        if no_group:
+            group_by_student = dict(
+                StudentsGroups.objects
+                .filter(group__teacher=teacher, student_id__in=no_group)
+                .values_list("student_id", "group__name")
+            )
+        for x in history:
+            x["group"] = x["group"] or group_by_student.get(x["student_id"], "—")
 
-    for x in history:
-        x["dt"] = _aware(x.get("dt"))
+        return {**summary, "history": history, "history_next_cursor": page.next_cursor}
 
-    history.sort(key=lambda x: (x["dt"] is None, x["dt"]), reverse=True)
-    history = history[:30]
+    # первая страница — из cache (webapp/stats_cache.py), более старые страницы всегда из БД
+    if cursor:
+        stats = build_stats()
+    else:
+        stats = get_teacher_stats(teacher.id, (selected_test, selected_group, selected_student), build_stats)
 
     return render(request, "webapp/statistics.html", {
         "groups": groups,
@@ -1036,11 +1101,12 @@ def teacher_statistics(request: HttpRequest) -> HttpResponse:
         "selected_group": draft_group,
         "selected_student": draft_student,
 
-        "total_attempts": total_attempts,
-        "avg_score": avg_score,
-        "students_count": students_count,
-        "tests_count": tests_count,
-        "history": history,
+        "total_attempts": stats["total_attempts"],
+        "avg_score": stats["avg_score"],
+        "students_count": stats["students_count"],
+        "tests_count": stats["tests_count"],
+        "history": stats["history"],
+        "history_next_cursor": stats["history_next_cursor"],
     })
 
 
@@ -1064,6 +1130,98 @@ def teacher_statistics_students(request: HttpRequest) -> HttpResponse:
     return JsonResponse({"students": [{"id": u.id, "username": u.username} for u in qs]})
 
 
+@require_role("teacher")
+@require_http_methods(["GET"])
+def teacher_group_leaderboard(request: HttpRequest, group_id: int) -> HttpResponse:
+    teacher: Users = request.current_user
+    group = get_object_or_404(Groups, id=group_id, teacher=teacher)
+
+    # тесты — только те, что есть в свёртке группы
+    keys = sorted(set(
+        TeacherStatsDaily.objects.filter(teacher=teacher, group_id=group.id).values_list("test_key", flat=True)
+    ))
+    titles = dict(
+        (f"T-{tid}", title)
+        for tid, title in Tests.objects.filter(id__in=[int(k[2:]) for k in keys if k.startswith("T-")])
+        .values_list("id", "title")
+    )
+    tests = [{"key": k, "title": titles.get(k) or TOPIC_TITLES.get(k[2:], k)} for k in keys]
+
+    selected_test = request.GET.get("test", "all")
+    if selected_test not in keys:
+        selected_test = "all"
+
+    board = group_leaderboard(teacher.id, group.id, test_key=None if selected_test == "all" else selected_test)
+    return render(request, "webapp/group_leaderboard.html", {
+        "group": group,
+        "tests": tests,
+        "selected_test": selected_test,
+        "rows": board["rows"],
+        "median": board["median"],
+    })
+
+
+def _stats_filters(request: HttpRequest) -> dict:
+    """
+    Фильтры teacher_statistics: из GET (test/group/student), иначе выбранные на странице (session).
+    Отдельно не проверяются — все выборки и так ограничены учителем.
+    """
+    def pick(name: str) -> str:
+        return str(request.GET.get(name) or request.session.get(f"stats_{name}", "all")).strip()
+
+    test_key, group, student = pick("test"), pick("group"), pick("student")
+    return {
+        "group_id": int(group) if group.isdigit() else None,
+        "student_id": int(student) if student.isdigit() else None,
+        "test_key": test_key if test_key[:2] in ("T-", "B-") else None,
+    }
+
+
+@require_role("teacher")
+@require_http_methods(["GET"])
+def teacher_statistics_trend(request: HttpRequest) -> HttpResponse:
+    """?bucket=day|week&from=YYYY-MM-DD&to=YYYY-MM-DD — по умолчанию последние 365 дней."""
+    teacher: Users = request.current_user
+    bucket = request.GET.get("bucket", "day")
+    if bucket not in ("day", "week"):
+        return JsonResponse({"error": "unknown_bucket"}, status=400)
+    try:
+        until = date.fromisoformat(request.GET["to"]) if request.GET.get("to") else timezone.localdate()
+        since = date.fromisoformat(request.GET["from"]) if request.GET.get("from") else until - timedelta(days=365)
+    except ValueError:
+        return JsonResponse({"error": "invalid_date"}, status=400)
+    if since > until or (until - since).days > TREND_MAX_DAYS:
+        return JsonResponse({"error": "invalid_range"}, status=400)
+
+    trend = teacher_trend(teacher.id, since=since, until=until, bucket=bucket, **_stats_filters(request))
+    return JsonResponse({"from": since.isoformat(), "to": until.isoformat(), **trend})
+
+
+@require_role("teacher")
+@require_http_methods(["GET"])
+def teacher_statistics_export(request: HttpRequest) -> HttpResponse:
+    """?data=attempts|answers&format=csv|xlsx — с фильтрами, выбранными на странице статистики."""
+    teacher: Users = request.current_user
+    data = request.GET.get("data", "attempts")
+    fmt = request.GET.get("format", "csv")
+    if data not in EXPORTS or fmt not in FORMATS:
+        return JsonResponse({"error": "unknown_export"}, status=400)
+
+    columns, rows = EXPORTS[data]
+    content_type, stream = FORMATS[fmt]
+    response = StreamingHttpResponse(stream(columns, rows(teacher.id, **_stats_filters(request))), content_type=content_type)
+    filename = f"{data}-{timezone.localdate():%Y%m%d}.{fmt}"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+@require_role("teacher")
+@require_http_methods(["GET"])
+def teacher_statistics_cache(request: HttpRequest) -> HttpResponse:
+    """Счётчики попаданий cache статистики (при общем CACHES — по всем процессам)."""
+    return JsonResponse(cache_counters())
+
+
 # Студент: профиль / группа / прогресс / тесты
 @require_role("student")
 def student_profile(request: HttpRequest) -> HttpResponse:
@@ -1084,68 +1242,22 @@ def student_profile(request: HttpRequest) -> HttpResponse:
 def student_progress(request: HttpRequest) -> HttpResponse:
     student = request.current_user
 
-    teacher_qs = (
-        Testattempts.objects
-        .filter(user=student, finished_at__isnull=False)
-        .select_related("test", "test__topic", "schedule")
-        .order_by("-finished_at")
-    )
-
-    basic_qs = (
-        AdaptiveAttempt.objects
-        .filter(user=student, finished_at__isnull=False)
-        .order_by("-finished_at")
-    )
-
-    def teacher_score_percent(a: Testattempts) -> int:
-        if a.score is not None:
-            return int(a.score)
-        total = a.total_questions or 0
-        correct = a.correct_answers or 0
-        return int(round((correct / total) * 100)) if total > 0 else 0
-
-    def safe_dt(dt):
-          if not dt:
-              return timezone.localtime(timezone.now())
-          if timezone.is_naive(dt):
-                  dt = dt.replace(tzinfo=dt_timezone.utc)
-          return timezone.localtime(dt)
-
-    history = []
-
-    for a in teacher_qs:
-        history.append({
-            "kind": "teacher",
-            "title": a.test.title,
-            "topic": getattr(a.test.topic, "name", str(a.test.topic)),
-            "dt": safe_dt(a.finished_at or a.started_at),
-            "score": teacher_score_percent(a),
-        })
-
-    for a in basic_qs:
-        title = TOPIC_TITLES.get(a.topic_code, a.topic_code)
-        history.append({
-            "kind": "basic",
-            "title": title,
-            "topic": title,
-            "dt": safe_dt(a.finished_at or a.started_at),
-            "score": int(a.score_percent or 0),
-        })
-
-    history.sort(key=lambda x: x["dt"], reverse=True)
+    # итоги — агрегатами в SQL, история — страница с курсором (webapp/services.py)
+    summary = student_summary(student.id)
+    page = student_history(student.id, cursor=request.GET.get("cursor"))
 
-    all_scores = [h["score"] for h in history]
-    total_attempts = len(history)
-    completed_tests = len(history)
-    avg_score = round(sum(all_scores) / total_attempts, 1) if total_attempts else 0
-    best_result = max(all_scores) if total_attempts else 0
+    history = _history_items(page)
+    for x in history:
+        x["dt"] = timezone.localtime(x["dt"]) if x["dt"] else timezone.localtime(timezone.now())
 
     return render(request, "webapp/student_progress.html", {
-        "total_attempts": total_attempts,
-        "completed_tests": completed_tests,
-        "avg_score": avg_score,
-        "best_result": float(best_result),
+        "total_attempts": summary["total_attempts"],
+        "completed_tests": summary["total_attempts"],
+        "avg_score": summary["avg_score"],
+        "best_result": float(summary["best_score"]),
+        "standings": student_standings(student.id),
         "history": history,
+        "history_next_cursor": page.next_cursor,
     })
 
 
@@ -1283,27 +1395,108 @@ def _session_key(topic_code: str) -> str:
     return f"adaptive:{topic_code}"
 
 
-def _q_answers(q: AdaptiveQuestion) -> list[str]:
-    return [q.option_a, q.option_b, q.option_c, q.option_d]
+def _q_answers(q: BankQuestion) -> list[str]:
+    return list(q.options)
 
 
-def _pick_question(topic_code: str, level: int, asked_ids: list[int]) -> AdaptiveQuestion | None:
-    qs = (
-        AdaptiveQuestion.objects
-        .filter(topic_code=topic_code, level=level, is_active=True)
-        .exclude(id__in=asked_ids)
-        .order_by("?")
-    )
-    q = qs.first()
-    if q:
-        return q
-    return (
-        AdaptiveQuestion.objects
-        .filter(topic_code=topic_code, is_active=True)
-        .exclude(id__in=asked_ids)
-        .order_by("?")
-        .first()
-    )
+def _pick_question(topic_code: str, level: int, asked_ids: list[int]) -> BankQuestion | None:
+    return question_bank.pick(topic_code, level, asked_ids)
+
+
+def _is_irt(state: dict) -> bool:
+    return state.get("engine") == "irt" and irt is not None
+
+
+def _adaptive_done(state: dict) -> bool:
+    if _is_irt(state):
+        return irt.should_stop(state)
+    return len(state.get("asked_ids", [])) >= TEST_LEN
+
+
+def _adaptive_total(state: dict) -> int:
+    return irt.max_items() if _is_irt(state) else TEST_LEN
+
+
+def _next_level(level: int, streak_ok: int, streak_bad: int, is_correct: bool) -> tuple[int, int, int]:
+    """Два верных подряд — уровень вверх, два неверных — вниз. Возвращает (level, streak_ok, streak_bad)."""
+    if is_correct:
+        streak_ok, streak_bad = streak_ok + 1, 0
+        if streak_ok >= 2 and level < 3:
+            level, streak_ok = level + 1, 0
+    else:
+        streak_ok, streak_bad = 0, streak_bad + 1
+        if streak_bad >= 2 and level > 1:
+            level, streak_bad = level - 1, 0
+    return level, streak_ok, streak_bad
+
+
+def _plan_next(topic_code: str, state: dict) -> None:
+    """
+    Фиксирует в state текущий вопрос (current_qid) и заранее выбирает следующий
+    для обоих исходов ответа (branches: ok / bad). GET только читает state.
+    """
+    if _is_irt(state):
+        irt.plan_next(topic_code, state)
+        return
+
+    asked_ids = list(state.get("asked_ids", []))
+    level = int(state.get("level", 1))
+
+    current = state.get("current_qid")
+    if not current or current in asked_ids:
+        q = _pick_question(topic_code, level, asked_ids)
+        current = q.id if q else None
+        state["current_qid"] = current
+
+    branches: dict[str, int | None] = {}
+    if current is not None and len(asked_ids) + 1 < TEST_LEN:
+        exclude = asked_ids + [current]
+        streak_ok = int(state.get("streak_ok", 0))
+        streak_bad = int(state.get("streak_bad", 0))
+        for key, outcome in (("ok", True), ("bad", False)):
+            next_level, _, _ = _next_level(level, streak_ok, streak_bad, outcome)
+            nq = _pick_question(topic_code, next_level, exclude)
+            branches[key] = nq.id if nq else None
+    state["branches"] = branches
+
+
+def _record_adaptive_answer(attempt_id: int, question_id: int, chosen: str, is_correct: bool) -> None:
+    """
+    Первый ответ на вопрос: INSERT + атомарный UPDATE счётчиков попытки через F().
+    Повторный ответ (строка уже есть): правим её и сдвигаем correct_answers на разницу.
+    """
+    with transaction.atomic():
+        try:
+            with transaction.atomic():
+                AdaptiveAttemptAnswer.objects.create(
+                    attempt_id=attempt_id,
+                    question_id=question_id,
+                    chosen_option=chosen,
+                    is_correct=is_correct,
+                )
+        except IntegrityError:
+            prev_correct = (
+                AdaptiveAttemptAnswer.objects
+                .select_for_update()
+                .filter(attempt_id=attempt_id, question_id=question_id)
+                .values_list("is_correct", flat=True)
+                .first()
+            )
+            AdaptiveAttemptAnswer.objects.filter(
+                attempt_id=attempt_id, question_id=question_id,
+            ).update(chosen_option=chosen, is_correct=is_correct)
+
+            delta = int(is_correct) - int(bool(prev_correct))
+            if delta:
+                AdaptiveAttempt.objects.filter(id=attempt_id).update(
+                    correct_answers=F("correct_answers") + delta,
+                )
+            return
+
+        AdaptiveAttempt.objects.filter(id=attempt_id).update(
+            total_questions=F("total_questions") + 1,
+            correct_answers=F("correct_answers") + int(is_correct),
+        )
 
 
 @require_role("student")
@@ -1312,7 +1505,7 @@ def adaptive_start(request: HttpRequest, code: str) -> HttpResponse:
     user = request.current_user
     attempt = AdaptiveAttempt.objects.create(user=user, topic_code=code)
 
-    request.session[_session_key(code)] = {
+    state = {
         "attempt_id": attempt.id,
         "level": 1,
         "streak_ok": 0,
@@ -1320,6 +1513,11 @@ def adaptive_start(request: HttpRequest, code: str) -> HttpResponse:
         "asked_ids": [],
         "deadline_ts": int(timezone.now().timestamp()) + TIME_LIMIT_SEC,
     }
+    if ADAPTIVE_ENGINE == "irt" and irt is not None:
+        state["engine"] = "irt"
+        state.update(irt.initial_state())
+    _plan_next(code, state)
+    request.session[_session_key(code)] = state
     return redirect("adaptive_take", code=code)
 
 
@@ -1334,6 +1532,8 @@ def adaptive_take(request: HttpRequest, code: str) -> HttpResponse:
         return redirect("adaptive_start", code=code)
 
     attempt = get_object_or_404(AdaptiveAttempt, id=state["attempt_id"], user=user, topic_code=code)
+    if attempt.finished_at:
+        return redirect("adaptive_finish", code=code)
 
     now_ts = int(timezone.now().timestamp())
     remaining_sec = max(0, int(state["deadline_ts"]) - now_ts)
@@ -1343,59 +1543,58 @@ def adaptive_take(request: HttpRequest, code: str) -> HttpResponse:
     asked_ids = list(state.get("asked_ids", []))
     level = int(state.get("level", 1))
 
-    if len(asked_ids) >= TEST_LEN:
+    if _adaptive_done(state):
         return redirect("adaptive_finish", code=code)
 
     if request.method == "POST":
         qid = int(request.POST.get("qid", "0") or 0)
         chosen = (request.POST.get("choice") or "").strip().upper()
 
-        q = get_object_or_404(AdaptiveQuestion, id=qid, topic_code=code, is_active=True)
-        is_correct = (chosen == (q.correct_option or "").strip().upper())
+        q = question_bank.get(qid)
+        if q is None or q.topic_code != code:
+            raise Http404("Question not found")
+        is_correct = (chosen == q.correct_option)
 
-        AdaptiveAttemptAnswer.objects.update_or_create(
-            attempt=attempt,
-            question=q,
-            defaults={"chosen_option": chosen, "is_correct": is_correct},
-        )
+        _record_adaptive_answer(attempt.id, q.id, chosen, is_correct)
 
         if qid not in asked_ids:
             asked_ids.append(qid)
             state["asked_ids"] = asked_ids
 
-            if is_correct:
-                state["streak_ok"] = int(state.get("streak_ok", 0)) + 1
-                state["streak_bad"] = 0
-                if state["streak_ok"] >= 2 and level < 3:
-                    level += 1
-                    state["level"] = level
-                    state["streak_ok"] = 0
+            if _is_irt(state):
+                irt.record_response(code, state, qid, is_correct)
             else:
-                state["streak_bad"] = int(state.get("streak_bad", 0)) + 1
-                state["streak_ok"] = 0
-                if state["streak_bad"] >= 2 and level > 1:
-                    level -= 1
-                    state["level"] = level
-                    state["streak_bad"] = 0
-
-        total = AdaptiveAttemptAnswer.objects.filter(attempt=attempt).count()
-        correct = AdaptiveAttemptAnswer.objects.filter(attempt=attempt, is_correct=True).count()
-        attempt.total_questions = total
-        attempt.correct_answers = correct
-        attempt.save(update_fields=["total_questions", "correct_answers"])
+                level, state["streak_ok"], state["streak_bad"] = _next_level(
+                    level, int(state.get("streak_ok", 0)), int(state.get("streak_bad", 0)), is_correct,
+                )
+                state["level"] = level
+
+            # следующий вопрос уже выбран заранее — берём ветку по исходу ответа
+            if qid == state.get("current_qid"):
+                branches = state.get("branches") or {}
+                state["current_qid"] = branches.get("ok" if is_correct else "bad")
+            if not _adaptive_done(state):
+                _plan_next(code, state)
 
         request.session[skey] = state
 
-        if len(asked_ids) >= TEST_LEN:
+        if _adaptive_done(state):
             return redirect("adaptive_finish", code=code)
 
         return redirect("adaptive_take", code=code)
 
-    q = _pick_question(code, level, asked_ids)
+    qid = state.get("current_qid")
+    q = question_bank.get(qid) if qid and qid not in asked_ids else None
+    if q is None:
+        # старые сессии / деактивированный вопрос — выбираем заново
+        state["current_qid"] = None
+        _plan_next(code, state)
+        request.session[skey] = state
+        q = question_bank.get(state["current_qid"]) if state["current_qid"] else None
     if not q:
         return redirect("adaptive_finish", code=code)
 
-    shown_level = int(getattr(q, "level", level))
+    shown_level = q.level
 
     return render(request, "webapp/basic_adaptive_test.html", {
         "topic_title": TOPIC_TITLES.get(code, code),
@@ -1404,7 +1603,7 @@ def adaptive_take(request: HttpRequest, code: str) -> HttpResponse:
         "question": q,
         "answers": _q_answers(q),
         "q_index": len(asked_ids) + 1,
-        "q_total": TEST_LEN,
+        "q_total": _adaptive_total(state),
         "remaining_sec": remaining_sec,
         "finish_url": redirect("adaptive_finish", code=code).url,
     })
@@ -1440,16 +1639,21 @@ def adaptive_finish(request: HttpRequest, code: str) -> HttpResponse:
             "correct": 0, "incorrect": 0, "total": 0, "correct_percent": 0
         })
 
-    total = AdaptiveAttemptAnswer.objects.filter(attempt=attempt).count()
-    correct = AdaptiveAttemptAnswer.objects.filter(attempt=attempt, is_correct=True).count()
+    # счётчики уже поддерживаются в adaptive_take (_record_adaptive_answer)
+    total = int(attempt.total_questions or 0)
+    correct = int(attempt.correct_answers or 0)
     incorrect = total - correct
-    percent = int(round((correct / total) * 100)) if total else 0
+    percent = rounded_percent(correct, total)
 
-    attempt.finished_at = timezone.now()
-    attempt.total_questions = total
-    attempt.correct_answers = correct
-    attempt.score_percent = percent
-    attempt.save(update_fields=["finished_at", "total_questions", "correct_answers", "score_percent"])
+    # повторный заход на страницу не сдвигает finished_at (на нём держится calibrate_adaptive)
+    if not attempt.finished_at:
+        attempt.finished_at = timezone.now()
+        attempt.score_percent = percent
+        with transaction.atomic():
+            if AdaptiveAttempt.objects.filter(pk=attempt.pk, finished_at__isnull=True).update(
+                finished_at=attempt.finished_at, score_percent=percent,
+            ):
+                record_adaptive_attempts([attempt.pk])
 
     # session можно очищать, но безопасно
     request.session.pop(skey, None)
@@ -1487,23 +1691,76 @@ def teacher_test_start(request: HttpRequest, schedule_id: int) -> HttpResponse:
     if attempt and not attempt.finished_at:
         return redirect("teacher_test_take", attempt_id=attempt.id)
 
-    attempt = Testattempts.objects.create(
-        user=student,
-        test=schedule.test,
-        schedule=schedule,
-        started_at=now,
-    )
+    with transaction.atomic():
+        attempt = Testattempts.objects.create(
+            user=student,
+            test=schedule.test,
+            schedule=schedule,
+            started_at=now,
+        )
+        AttemptQuestionSheet.objects.create(
+            attempt=attempt,
+            question_ids=list(get_test_payload(schedule.test_id)["order"]),
+        )
 
     return redirect("teacher_test_take", attempt_id=attempt.id)
 
 
+def _attempt_sheet(attempt: Testattempts) -> AttemptQuestionSheet:
+    """Лист вопросов попытки (создаётся в teacher_test_start, для старых попыток — здесь)."""
+    try:
+        return attempt.sheet
+    except AttemptQuestionSheet.DoesNotExist:
+        pass
+
+    question_ids = list(Questions.objects.filter(test_id=attempt.test_id).order_by("id").values_list("id", flat=True))
+    answered = set(
+        Useranswers.objects
+        .filter(attempt=attempt, answer__isnull=False)
+        .values_list("question_id", flat=True)
+    )
+    # уже отвеченные — в начало листа, курсор сразу за ними
+    ordered = [q for q in question_ids if q in answered] + [q for q in question_ids if q not in answered]
+    sheet, _ = AttemptQuestionSheet.objects.get_or_create(
+        attempt=attempt,
+        defaults={"question_ids": ordered, "cursor": len(answered.intersection(question_ids))},
+    )
+    attempt.sheet = sheet
+    return sheet
+
+
+def _sheet_question(sheet: AttemptQuestionSheet, test_id: int) -> dict | None:
+    """
+    Текущий вопрос листа из закэшированного payload теста (webapp/teacher_test_payload.py).
+    Вопросы, которых нет и в свежем payload (удалены), пропускаются.
+    """
+    ids = list(sheet.question_ids or [])
+    payload = get_test_payload(test_id)
+    refreshed = False
+    while sheet.cursor < len(ids):
+        qid = ids[sheet.cursor]
+        question = payload["questions"].get(qid)
+        if question is not None:
+            return question
+
+        if not refreshed:
+            # payload в cache мог отстать от листа — перечитываем один раз
+            payload = get_test_payload(test_id, refresh=True)
+            refreshed = True
+            continue
+
+        AttemptQuestionSheet.objects.filter(pk=sheet.pk, cursor=sheet.cursor).update(cursor=F("cursor") + 1)
+        sheet.cursor += 1
+    return None
+
+
 @require_role("student")
 @require_http_methods(["GET", "POST"])
 def teacher_test_take(request: HttpRequest, attempt_id: int) -> HttpResponse:
     student = request.current_user
 
     attempt = get_object_or_404(
-        Testattempts.objects.select_related("test", "schedule"),
+        Testattempts.objects.select_related("test", "schedule", "sheet"),
         id=attempt_id,
         user=student,
     )
@@ -1515,41 +1772,48 @@ def teacher_test_take(request: HttpRequest, attempt_id: int) -> HttpResponse:
     if remaining_sec is not None and remaining_sec <= 0:
         return redirect("teacher_test_finish", attempt_id=attempt.id)
 
-    answered_q_ids = set(
-        Useranswers.objects
-        .filter(attempt=attempt, answer__isnull=False)
-        .values_list("question_id", flat=True)
-    )
-
-    question = (
-        Questions.objects.filter(test=attempt.test)
-        .exclude(id__in=answered_q_ids)
-        .order_by("id")
-        .first()
-    )
+    sheet = _attempt_sheet(attempt)
+    question = _sheet_question(sheet, attempt.test_id)
 
     if question is None:
         return redirect("teacher_test_finish", attempt_id=attempt.id)
 
-    answers_qs = list(Answers.objects.filter(question=question).order_by("id")[:4])
+    answers_qs = question["answers"]
 
     if request.method == "POST":
         chosen_id = request.POST.get("answer_id")
-        chosen = Answers.objects.filter(id=chosen_id, question=question).first() if chosen_id else None
+        chosen = next((a for a in answers_qs if str(a["id"]) == str(chosen_id)), None) if chosen_id else None
 
-        Useranswers.objects.update_or_create(
-            attempt=attempt,
-            question=question,
-            defaults={
-                "answer": chosen,
-                "answer_text": chosen.answer_text if chosen else None,
-                "is_correct": bool(chosen and chosen.is_correct),
-            }
-        )
+        values = {
+            "answer_id": chosen["id"] if chosen else None,
+            "answer_text": chosen["answer_text"] if chosen else None,
+            "is_correct": bool(chosen and _answer_keys([chosen["id"]]).get(chosen["id"])),
+        }
+        with transaction.atomic():
+            # та же блокировка попытки, что у пачек teacher_test_answers: иначе пачка и этот
+            # submit могут одновременно не найти строку ответа и вставить по одной
+            finished_at = (
+                Testattempts.objects.select_for_update()
+                .filter(pk=attempt.pk)
+                .values_list("finished_at", flat=True)
+                .first()
+            )
+            if finished_at is not None:
+                return redirect("teacher_test_finish", attempt_id=attempt.id)
+            # затем сдвигаем cursor с условием: двойной submit того же шага ничего не пишет
+            moved = True
+            if chosen is not None:
+                moved = bool(
+                    AttemptQuestionSheet.objects
+                    .filter(pk=sheet.pk, cursor=sheet.cursor)
+                    .update(cursor=F("cursor") + 1)
+                )
+            if moved and not Useranswers.objects.filter(attempt=attempt, question_id=question["id"]).update(**values):
+                Useranswers.objects.create(attempt=attempt, question_id=question["id"], **values)
         return redirect("teacher_test_take", attempt_id=attempt.id)
 
-    total = Questions.objects.filter(test=attempt.test).count()
-    answered = len(answered_q_ids)
+    total = len(sheet.question_ids)
+    answered = sheet.cursor
 
     return render(request, "webapp/student/tests.html", {
         "topic_title": attempt.test.title,
@@ -1564,30 +1828,266 @@ def teacher_test_take(request: HttpRequest, attempt_id: int) -> HttpResponse:
     })
 
 
+def _close_teacher_attempt(attempt: Testattempts) -> dict:
+    """Итоги попытки одним агрегатом по ответам; незакрытую попытку закрывает."""
+    sheet = _attempt_sheet(attempt)
+    counts = Useranswers.objects.filter(attempt=attempt).aggregate(
+        answered=Count("id", filter=Q(answer__isnull=False)),
+        correct=Count("id", filter=Q(is_correct=True)),
+    )
+    total = len(sheet.question_ids)
+    correct = counts["correct"]
+    score_percent = rounded_percent(correct, total)
+
+    if not attempt.finished_at:
+        values = {
+            "finished_at": timezone.now(),
+            "total_questions": total,
+            "correct_answers": correct,
+            "score": score_percent,
+        }
+        # finalize_attempts мог закрыть попытку раньше — его итоги не перетираем
+        with transaction.atomic():
+            closed = Testattempts.objects.filter(pk=attempt.pk, finished_at__isnull=True).update(**values)
+            if closed:
+                record_teacher_attempts([attempt.pk])
+        if closed:
+            for field, value in values.items():
+                setattr(attempt, field, value)
+        else:
+            attempt.refresh_from_db(fields=list(values))
+            correct = int(attempt.correct_answers or 0)
+            score_percent = int(attempt.score or 0)
+
+    return {
+        "total": total,
+        "answered": counts["answered"],
+        "correct": correct,
+        "score_percent": score_percent,
+    }
+
+
+# JSON-режим прохождения: все вопросы одним ответом, ответы — пачками.
+# Ответ, отправленный впритык к дедлайну, может прийти на пару секунд позже.
+ANSWER_GRACE_SEC = int(getattr(settings, "ANSWER_GRACE_SEC", 5))
+
+
+def _attempt_closed_response(attempt: Testattempts, error: str) -> JsonResponse:
+    return JsonResponse({
+        "error": error,
+        "finish_url": reverse("teacher_test_finish", args=[attempt.id]),
+    }, status=409)
+
+
+def _sheet_payload(sheet: AttemptQuestionSheet, test_id: int) -> dict:
+    payload = get_test_payload(test_id)
+    if any(qid not in payload["questions"] for qid in sheet.question_ids):
+        # payload в cache мог отстать от листа — перечитываем один раз
+        payload = get_test_payload(test_id, refresh=True)
+    return payload
+
+
 @require_role("student")
 @require_http_methods(["GET"])
-def teacher_test_finish(request: HttpRequest, attempt_id: int) -> HttpResponse:
+def teacher_test_payload(request: HttpRequest, attempt_id: int) -> HttpResponse:
     student = request.current_user
 
     attempt = get_object_or_404(
-        Testattempts.objects.select_related("test", "schedule"),
+        Testattempts.objects.select_related("test", "sheet"),
         id=attempt_id,
         user=student,
     )
 
-    total = Questions.objects.filter(test=attempt.test).count()
-    answered = Useranswers.objects.filter(attempt=attempt, answer__isnull=False).count()
-    correct = Useranswers.objects.filter(attempt=attempt, is_correct=True).count()
-    wrong = total - correct
-    score_percent = int(round((correct / total) * 100)) if total else 0
+    if attempt.finished_at:
+        return _attempt_closed_response(attempt, "finished")
 
-    now = timezone.now()
-    if not attempt.finished_at:
-        attempt.finished_at = now
-        attempt.total_questions = total
-        attempt.correct_answers = correct
-        attempt.score = score_percent
-        attempt.save(update_fields=["finished_at", "total_questions", "correct_answers", "score"])
+    remaining_sec = _attempt_remaining_sec(attempt)
+    if remaining_sec is not None and remaining_sec <= 0:
+        return _attempt_closed_response(attempt, "time_is_over")
+
+    sheet = _attempt_sheet(attempt)
+    payload = _sheet_payload(sheet, attempt.test_id)
+
+    questions = []
+    for qid in sheet.question_ids:
+        q = payload["questions"].get(qid)
+        if q is None:
+            continue
+        # is_correct клиенту не отдаём
+        questions.append({
+            "id": qid,
+            "text": q["question_text"],
+            "answers": [{"id": a["id"], "text": a["answer_text"]} for a in q["answers"]],
+        })
+
+    answered = (
+        Useranswers.objects
+        .filter(attempt=attempt, answer__isnull=False)
+        .values_list("question_id", "answer_id")
+    )
+
+    return JsonResponse({
+        "attempt_id": attempt.id,
+        "title": attempt.test.title,
+        "remaining_sec": remaining_sec,
+        "questions": questions,
+        "answered": {str(qid): aid for qid, aid in answered},
+        "answers_url": reverse("teacher_test_answers", args=[attempt.id]),
+        "finish_url": reverse("teacher_test_finish", args=[attempt.id]),
+    })
+
+
+def _answer_keys(answer_ids) -> dict[int, bool]:
+    """
+    is_correct выбранных ответов — из БД: payload в cache только для показа вопросов
+    и может отставать от правки ключа (у каждого процесса свой LocMemCache).
+    """
+    return dict(Answers.objects.filter(id__in=list(answer_ids)).values_list("id", "is_correct"))
+
+
+def _save_answer_batch(attempt: Testattempts, chosen: dict[int, dict]) -> None:
+    """Upsert пачки ответов {question_id: answer}: ключ ответов, select, bulk_update, bulk_create."""
+    if not chosen:
+        return
+    keys = _answer_keys(ans["id"] for ans in chosen.values())
+    existing = dict(
+        Useranswers.objects
+        .filter(attempt=attempt, question_id__in=list(chosen))
+        .values_list("question_id", "id")
+    )
+
+    to_update, to_create = [], []
+    for qid, ans in chosen.items():
+        row = Useranswers(
+            attempt=attempt,
+            question_id=qid,
+            answer_id=ans["id"],
+            answer_text=ans["answer_text"],
+            is_correct=bool(keys.get(ans["id"])),
+        )
+        if qid in existing:
+            row.id = existing[qid]
+            to_update.append(row)
+        else:
+            to_create.append(row)
+
+    Useranswers.objects.bulk_update(to_update, ["answer_id", "answer_text", "is_correct"])
+    Useranswers.objects.bulk_create(to_create)
+
+
+@require_role("student")
+@require_http_methods(["POST"])
+def teacher_test_answers(request: HttpRequest, attempt_id: int) -> HttpResponse:
+    """
+    Тело: {"answers": [{"question_id": .., "answer_id": ..}, ...], "finish": false}.
+    Повторная отправка той же пачки ничего не меняет, поэтому клиент может её ретраить.
+    """
+    student = request.current_user
+
+    try:
+        body = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"error": "invalid_json"}, status=400)
+    items = body.get("answers") if isinstance(body, dict) else None
+    if items is None:
+        items = []
+    if not isinstance(items, list):
+        return JsonResponse({"error": "answers_must_be_list"}, status=400)
+
+    with transaction.atomic():
+        # пачки одной попытки пишутся по очереди
+        attempt = get_object_or_404(
+            Testattempts.objects.select_for_update(of=("self",)).select_related("test", "sheet"),
+            id=attempt_id,
+            user=student,
+        )
+
+        if attempt.finished_at:
+            return _attempt_closed_response(attempt, "finished")
+
+        remaining_sec = _attempt_remaining_sec(attempt, grace_sec=ANSWER_GRACE_SEC)
+        if remaining_sec is not None and remaining_sec <= 0:
+            # время вышло: поздние ответы не принимаем, попытку закрываем тем, что уже сохранено
+            _close_teacher_attempt(attempt)
+            return _attempt_closed_response(attempt, "time_is_over")
+
+        sheet = _attempt_sheet(attempt)
+        payload = _sheet_payload(sheet, attempt.test_id)
+        on_sheet = set(sheet.question_ids)
+
+        chosen: dict[int, dict] = {}
+        rejected = []
+        for i, item in enumerate(items):
+            try:
+                qid = int(item.get("question_id"))
+                aid = int(item.get("answer_id"))
+            except (AttributeError, TypeError, ValueError):
+                rejected.append({"index": i, "error": "invalid_item"})
+                continue
+            question = payload["questions"].get(qid) if qid in on_sheet else None
+            ans = next((a for a in question["answers"] if a["id"] == aid), None) if question else None
+            if ans is None:
+                rejected.append({"index": i, "question_id": qid, "error": "unknown_answer"})
+                continue
+            # в одной пачке побеждает последний ответ на вопрос
+            chosen[qid] = ans
+
+        _save_answer_batch(attempt, chosen)
+
+        # лист держим в том же виде, что и при постраничном прохождении:
+        # отвеченные — в начале, cursor — сразу за ними
+        answered_ids = set(
+            Useranswers.objects
+            .filter(attempt=attempt, answer__isnull=False)
+            .values_list("question_id", flat=True)
+        )
+        ordered = (
+            [q for q in sheet.question_ids if q in answered_ids]
+            + [q for q in sheet.question_ids if q not in answered_ids]
+        )
+        cursor = len(answered_ids.intersection(sheet.question_ids))
+        if ordered != sheet.question_ids or cursor != sheet.cursor:
+            AttemptQuestionSheet.objects.filter(pk=sheet.pk).update(question_ids=ordered, cursor=cursor)
+
+        result = _close_teacher_attempt(attempt) if body.get("finish") else None
+
+    return JsonResponse({
+        "saved": len(chosen),
+        "rejected": rejected,
+        "answered": cursor,
+        "total": len(sheet.question_ids),
+        "remaining_sec": _attempt_remaining_sec(attempt),
+        "finished": result is not None,
+        "finish_url": reverse("teacher_test_finish", args=[attempt.id]),
+    })
+
+
+@require_role("student")
+@require_http_methods(["GET"])
+def teacher_test_finish(request: HttpRequest, attempt_id: int) -> HttpResponse:
+    student = request.current_user
+
+    attempt = get_object_or_404(
+        Testattempts.objects.select_related("test", "schedule", "sheet"),
+        id=attempt_id,
+        user=student,
+    )
+
+    if attempt.finished_at and attempt.total_questions is not None:
+        # попытка уже закрыта — отдаём сохранённые итоги без пересчёта
+        total = int(attempt.total_questions)
+        correct = int(attempt.correct_answers or 0)
+        score_percent = int(attempt.score or 0)
+        # не sheet.cursor: курсор проходит и мимо удалённых вопросов, на которые ответа не было
+        answered = Useranswers.objects.filter(attempt=attempt, answer__isnull=False).count()
+        wrong = total - correct
+    else:
+        result = _close_teacher_attempt(attempt)
+        total = result["total"]
+        answered = result["answered"]
+        correct = result["correct"]
+        wrong = total - correct
+        score_percent = result["score_percent"]
 
     return render(request, "webapp/student/teacher_test_finish.html", {
         "topic_title": attempt.test.title,
@@ -1616,57 +2116,10 @@ def teacher_student_profile(request: HttpRequest, student_id: int) -> HttpRespon
 
     group = link.group
 
-    teacher_qs = (
-        Testattempts.objects
-        .filter(user=student_user, finished_at__isnull=False)
-        .select_related("test", "test__topic", "test__created_by", "schedule")
-        .order_by("-finished_at")
-    )
+    summary = student_summary(student_user.id)
+    page = student_history(student_user.id, cursor=request.GET.get("cursor"))
+    history = _history_items(page)
 
-    basic_qs = (
-        AdaptiveAttempt.objects
-        .filter(user=student_user, finished_at__isnull=False)
-        .order_by("-finished_at")
-    )
-
-    basic_title_map = {x["code"]: x["title"] for x in BASIC_TESTS}
-
-    history = []
-
-    for a in teacher_qs:
-        history.append({
-            "kind": "teacher",
-            "attempt_id": a.id,
-            "title": a.test.title,
-            "topic": getattr(a.test.topic, "name", ""),
-            "author": getattr(a.test.created_by, "username", "—"),
-            "dt": a.finished_at or a.started_at,
-            "score": int(a.score or 0),
-        })
-
-    for a in basic_qs:
-        title = basic_title_map.get(a.topic_code, a.topic_code)
-        history.append({
-            "kind": "basic",
-            "attempt_id": a.id,
-            "title": title,
-            "topic": title,
-            "author": "System",
-            "dt": a.finished_at or a.started_at,
-            "score": int(a.score_percent or 0),
-        })
-
-    for x in history:
-        x["dt"] = _aware(x.get("dt"))
-
-    history.sort(key=lambda x: x["dt"], reverse=True)
-
-    scores = [x["score"] for x in history]
-    total_attempts = len(history)
-    avg_score = round(sum(scores) / total_attempts, 1) if total_attempts else 0
-    best_score = max(scores) if total_attempts else 0
-
-   
     back_url = request.GET.get("back")
     if back_url:
         back_url = unquote(back_url)
@@ -1679,10 +2132,11 @@ def teacher_student_profile(request: HttpRequest, student_id: int) -> HttpRespon
     return render(request, "webapp/teacher_student_profile.html", {
         "student": student_user,
         "group": group,
-        "total_attempts": total_attempts,
-        "avg_score": avg_score,
-        "best_score": best_score,
-        "history": history[:30],
+        "total_attempts": summary["total_attempts"],
+        "avg_score": summary["avg_score"],
+        "best_score": summary["best_score"],
+        "history": history,
+        "history_next_cursor": page.next_cursor,
         "back_url": back_url,
     })
 
@@ -1851,14 +2305,6 @@ def teacher_basic_attempt_preview(request: HttpRequest, attempt_id: int) -> Http
 def student_ai_stat_helper(request: HttpRequest) -> HttpResponse:
     student: Users = request.current_user
 
-    
-    snapshot = build_ai_stat_snapshot(student)
-    snap_hash = snapshot_hash(snapshot)
-
-    menu_url = reverse("student_menu")
-    error = None
-
-    
     latest = (
         AIStatHelperReport.objects
         .filter(student=student)
@@ -1866,54 +2312,126 @@ def student_ai_stat_helper(request: HttpRequest) -> HttpResponse:
         .first()
     )
 
-    is_stale = bool(latest and latest.snapshot_hash != snap_hash)
-    has_report = bool(latest and (latest.report_json or latest.report_text))
+    # снимок пересобирается только если у студента появились новые завершённые попытки
+    snapshot, snap_hash, watermark = current_snapshot(student, latest)
+
+    menu_url = reverse("student_menu")
+    error = None
 
-   
     if request.method == "POST":
         action = (request.POST.get("action") or "").strip()
 
         if action == "refresh":
-            
             return redirect("student_ai_stat_helper")
 
         if action == "analyze":
+            # генерирует воркер (run_ai_report_worker), страница опрашивает student_ai_stat_helper_status
             try:
-                
-                report_dict, report_text = generate_ai_stat_report(student=student, snapshot=snapshot)
-
-               
-                AIStatHelperReport.objects.update_or_create(
-                    student=student,
-                    snapshot_hash=snap_hash,
-                    defaults={
-                        "report_json": report_dict or {},
-                        "report_text": report_text or "",
-                    }
-                )
-
+                if circuit_open():
+                    # провайдер недоступен — не копим задачи, показываем последний отчёт
+                    raise CircuitOpenError("AI service is temporarily unavailable, showing your last report")
+                enqueue_report_job(student, snapshot=snapshot, snapshot_hash=snap_hash, watermark=watermark)
                 return redirect("student_ai_stat_helper")
-
-            except Exception as e:
+            except (AIReportQuotaExceeded, CircuitOpenError) as e:
                 error = str(e)
 
-
-    latest = (
-        AIStatHelperReport.objects
-        .filter(student=student)
-        .order_by("-created_at", "-id")
-        .first()
-    )
+    job = latest_job(student)
+    job_active = bool(job and job.status in AI_JOB_ACTIVE)
+    if error is None and job and job.status == AIReportJob.FAILED and (not latest or job.created_at > latest.created_at):
+        error = job.error or "Analysis failed"
 
     report = None
     if latest:
         report = latest.report_json or {}
 
     return render(request, "webapp/student_ai_stat_helper.html", {
-        "snapshot": snapshot,         
-        "report": report,             
+        "snapshot": snapshot,
+        "report": report,
         "has_report": bool(latest and (latest.report_json or latest.report_text)),
         "is_stale": bool(latest and latest.snapshot_hash != snap_hash),
         "error": error,
+        "job_active": job_active,
         "menu_url": menu_url,
     })
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@require_role("student")
+@require_http_methods(["POST"])
+def student_ai_stat_helper_start(request: HttpRequest) -> JsonResponse:
+    """
+    «Анализ» со стримингом, шаг 1 (POST, с CSRF): ставит задачу с квотой и откладывает её для SSE.
+    busy — генерация уже идёт (воркером или в другой вкладке), страница переходит на опрос статуса.
+    """
+    student: Users = request.current_user
+    if circuit_open():
+        return JsonResponse({"error": "AI service is temporarily unavailable, showing your last report"}, status=503)
+
+    latest = AIStatHelperReport.objects.filter(student=student).order_by("-created_at", "-id").first()
+    snapshot, snap_hash, watermark = current_snapshot(student, latest)
+    try:
+        job = start_stream_job(student, snapshot=snapshot, snapshot_hash=snap_hash, watermark=watermark)
+    except AIReportQuotaExceeded as e:
+        return JsonResponse({"error": str(e)}, status=429)
+    if job is None:
+        return JsonResponse({"busy": True})
+    return JsonResponse({
+        "job": job.id,
+        "stream_url": f"{reverse('student_ai_stat_helper_stream')}?job={job.id}",
+    })
+
+
+@require_role("student")
+@require_http_methods(["GET"])
+def student_ai_stat_helper_stream(request: HttpRequest) -> StreamingHttpResponse:
+    """
+    Шаг 2 (EventSource): только подключается к задаче из student_ai_stat_helper_start, ничего
+    не создаёт. summary приходит кусками по мере генерации, в конце — done, и страница перечитывает
+    готовый отчёт. busy — задачу уже взял другой поток или воркер.
+    """
+    student: Users = request.current_user
+    try:
+        job_id = int(request.GET.get("job") or 0)
+    except ValueError:
+        job_id = 0
+
+    def events():
+        # первый байт сразу: запрос к LLM — уже внутри потока
+        yield ": start\n\n"
+        job = attach_stream_job(student, job_id) if job_id else None
+        if job is None:
+            yield _sse("busy", {})
+            return
+
+        # closing: при обрыве соединения stream_job сразу вернёт задачу в очередь
+        with closing(stream_job(job)) as stream:
+            for event, data in stream:
+                if event == "summary":
+                    yield _sse("summary", {"text": data})
+                elif event == "done":
+                    yield _sse("done", {"job": job.id})
+                else:
+                    yield _sse("error", {"error": data})
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # nginx не должен буферизовать поток
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@require_role("student")
+@require_http_methods(["GET"])
+def student_ai_stat_helper_status(request: HttpRequest) -> JsonResponse:
+    # опрашивается страницей каждые пару секунд — один запрос к БД
+    job = latest_job(request.current_user)
+    if job is None:
+        return JsonResponse({"status": None})
+    return JsonResponse({
+        "job": job.id,
+        "status": job.status,
+        "error": job.error if job.status == AIReportJob.FAILED else "",
+    })